@@ -0,0 +1,413 @@
+"""
+Приближённый поиск ближайших соседей (IVF) по эмбеддингам пользователей.
+
+Векторы разбиваются на nlist кластеров сферическим k-means; запрос сравнивается
+только с векторами из nprobe ближайших кластеров. Больше nprobe — выше полнота и медленнее поиск.
+
+Индекс хранится в каталоге и открывается через np.memmap без чтения всех данных:
+    centroids.npy  — центры кластеров (nlist, dim) float32;
+    vectors.npy    — нормализованные векторы (capacity, dim) в режиме квантования индекса
+                     (float32, float16 или int8, см. quantization.py);
+    scales.npy     — масштаб каждой строки (capacity,) float32 (нужен режиму int8);
+    lists.npy      — номер кластера каждой строки (capacity,) int32, -1 — удалённая строка;
+    usernames.txt  — имя пользователя строки (по одному в строке файла, только дописывается);
+    meta.json      — dim, режим квантования, ёмкость, число строк и удалений, размер usernames.txt,
+                     версия и поколение.
+
+Один индекс открывают все процессы сервера (gunicorn). Запись сериализуется блокировкой
+файла lock и публикуется записью meta.json (общий с embedding_store.py протокол, см. shared_directory.py),
+а поиск перед чтением подхватывает опубликованные другими процессами строки.
+
+Команды:
+    python ann_index.py build --db-url sqlite:///app.db --path app.db.ivf --quantization int8
+    python ann_index.py report --path app.db.ivf --k 10
+"""
+import argparse
+import os
+import time
+
+import numpy as np
+
+from metrics import timed
+from quantization import QUANTIZATION_MODES, normalize, quantize, dequantize, similarities, l2_distances
+from shared_directory import SharedDirectory, file_lock, install, write_usernames
+
+
+def train_centroids(vectors, nlist, iterations=20, sample_size=100000, seed=0):
+    """
+    Обучает центры кластеров сферическим k-means.
+
+    Аргументы:
+        vectors (numpy.ndarray): Нормализованные векторы (n, dim).
+        nlist (int): Число кластеров.
+        iterations (int): Число итераций.
+        sample_size (int): Сколько векторов использовать для обучения.
+
+    Возвращает:
+        numpy.ndarray: Нормализованные центры (nlist, dim) float32.
+    """
+    rng = np.random.default_rng(seed)
+    if len(vectors) > sample_size:
+        vectors = vectors[rng.choice(len(vectors), sample_size, replace=False)]
+    nlist = max(1, min(nlist, len(vectors)))
+    centroids = vectors[rng.choice(len(vectors), nlist, replace=False)].copy()
+    for _ in range(iterations):
+        assignments = np.argmax(vectors @ centroids.T, axis=1)
+        sums = np.zeros_like(centroids)
+        np.add.at(sums, assignments, vectors)
+        counts = np.bincount(assignments, minlength=nlist)
+        empty = counts == 0
+        if empty.any():
+            # Пустой кластер получает случайный вектор выборки
+            sums[empty] = vectors[rng.choice(len(vectors), int(empty.sum()))]
+        centroids = normalize(sums)
+    return centroids.astype(np.float32)
+
+
+class IVFIndex(SharedDirectory):
+    def __init__(self, path, nprobe=8):
+        """
+        Открывает индекс из каталога (файлы отображаются в память, данные не копируются).
+
+        Аргументы:
+            path (str): Каталог индекса (создаётся IVFIndex.build).
+            nprobe (int): Сколько ближайших кластеров просматривать при поиске.
+        """
+        super().__init__(path)
+        self.nprobe = nprobe
+        self._open()
+        print(f"[LOG ANN] Индекс открыт: {len(self._positions)} векторов, {self.nlist} кластеров, nprobe={nprobe}.")
+
+    def _meta(self):
+        return dict(super()._meta(), quantization_mode=self.quantization_mode)
+
+    def _open_arrays(self, meta):
+        """Отображает файлы в память; кластеры строятся по lists.npy в _index_rows."""
+        self.quantization_mode = meta.get("quantization_mode", 'float32')
+        self.centroids = np.load(self._file('centroids.npy'))
+        self.nlist = len(self.centroids)
+        self._vectors = np.load(self._file('vectors.npy'), mmap_mode='r+')
+        self._lists = np.load(self._file('lists.npy'), mmap_mode='r+')
+        # У индексов, построенных до квантования, масштабов нет: векторы float32 без масштаба
+        has_scales = os.path.exists(self._file('scales.npy'))
+        self._scales = np.load(self._file('scales.npy'), mmap_mode='r+') if has_scales else None
+
+    def _capacity(self):
+        return len(self._lists)
+
+    def _index_rows(self):
+        """Строки каждого кластера и позиция каждого пользователя строятся по lists.npy."""
+        lists = np.asarray(self._lists[:self.count])
+        live = np.flatnonzero(lists >= 0)
+        order = live[np.argsort(lists[live], kind='stable')]
+        bounds = np.searchsorted(lists[order], np.arange(self.nlist + 1))
+        self._members = [list(order[bounds[i]:bounds[i + 1]]) for i in range(self.nlist)]
+        self._member_arrays = [None] * self.nlist
+        self._positions = {self._usernames[row]: int(row) for row in live}
+
+    def _index_added(self, first, added):
+        for row, username in enumerate(added, start=first):
+            cluster = int(self._lists[row])
+            if cluster >= 0:
+                self._positions[username] = row
+                self._members[cluster].append(row)
+                self._member_arrays[cluster] = None
+
+    @classmethod
+    def build(cls, path, usernames, embeddings, nlist=None, nprobe=8, capacity=None, quantization_mode='float32'):
+        """
+        Обучает кластеры и записывает индекс в каталог.
+        Файлы пишутся во временные и подменяются под блокировкой, поэтому процессы,
+        у которых индекс уже открыт, при следующем поиске переоткроют новый.
+
+        Аргументы:
+            path (str): Каталог индекса.
+            usernames (list[str]): Имена пользователей.
+            embeddings (array): Эмбеддинги (n, dim).
+            nlist (int): Число кластеров; по умолчанию около 4 * sqrt(n).
+            capacity (int): Начальная ёмкость файлов; по умолчанию 2 * n.
+            quantization_mode (str): Хранение векторов: 'float32', 'float16' или 'int8' (см. quantization.py).
+
+        Возвращает:
+            IVFIndex: Открытый индекс.
+        """
+        vectors = normalize(embeddings)
+        codes, scales = quantize(vectors, quantization_mode)
+        count, dim = vectors.shape
+        nlist = nlist or max(1, int(4 * np.sqrt(max(count, 1))))
+        capacity = max(capacity or 2 * count, 1024)
+        os.makedirs(path, exist_ok=True)
+        start = time.perf_counter()
+        centroids = train_centroids(vectors, nlist) if count else normalize(np.eye(1, dim))
+        with open(os.path.join(path, 'centroids.npy.tmp'), 'wb') as f:
+            np.save(f, centroids)
+
+        stored = np.lib.format.open_memmap(os.path.join(path, 'vectors.npy.tmp'), mode='w+',
+                                           dtype=codes.dtype, shape=(capacity, dim))
+        stored[:count] = codes
+        stored.flush()
+        stored_scales = np.lib.format.open_memmap(os.path.join(path, 'scales.npy.tmp'), mode='w+',
+                                                  dtype=np.float32, shape=(capacity,))
+        stored_scales[:] = 1.0
+        stored_scales[:count] = scales
+        stored_scales.flush()
+        lists = np.lib.format.open_memmap(os.path.join(path, 'lists.npy.tmp'), mode='w+',
+                                          dtype=np.int32, shape=(capacity,))
+        lists[:] = -1
+        if count:
+            lists[:count] = np.argmax(vectors @ centroids.T, axis=1)
+        lists.flush()
+        del stored, stored_scales, lists
+        usernames_size = write_usernames(path, usernames)
+        with file_lock(path):
+            install(path, ('centroids.npy', 'vectors.npy', 'scales.npy', 'lists.npy', 'usernames.txt'),
+                    dim=dim, quantization_mode=quantization_mode, capacity=capacity, count=count,
+                    usernames_size=usernames_size)
+        print(f"[LOG ANN] Индекс построен за {time.perf_counter() - start:.2f}s: {count} векторов, {len(centroids)} кластеров.")
+        return cls(path, nprobe=nprobe)
+
+    @classmethod
+    def from_database(cls, db, path, nlist=None, nprobe=8, quantization_mode='float32'):
+        """
+        Открывает индекс из каталога (или строит по базе, если его нет) и подписывает его на изменения.
+        Открытый индекс сверяется с базой: изменения, сделанные без подписки (пока сервер
+        был остановлен, из main.py delete-user или enroll.py), применяются при открытии.
+        Индекс в другом режиме квантования строится заново.
+        """
+        usernames, embeddings = db.get_all_embeddings()
+        index = None
+        if os.path.exists(os.path.join(path, 'meta.json')):
+            index = cls(path, nprobe=nprobe)
+            if index.quantization_mode != quantization_mode:
+                print(f"[LOG ANN] Индекс хранится в режиме {index.quantization_mode}, нужен {quantization_mode}: "
+                      f"индекс строится заново.")
+                index = None
+            else:
+                added, removed = index.sync(usernames, embeddings)
+                if added or removed:
+                    print(f"[LOG ANN] Индекс сверен с базой: добавлено или заменено {added}, удалено {removed}.")
+        if index is None:
+            if not usernames:
+                raise ValueError("[ОШИБКА ANN] В базе нет пользователей для обучения кластеров.")
+            index = cls.build(path, usernames, embeddings, nlist=nlist, nprobe=nprobe,
+                              quantization_mode=quantization_mode)
+        db.subscribe(index)
+        return index
+
+    def sync(self, usernames, embeddings, chunk_size=65536):
+        """
+        Приводит индекс к полному списку пользователей базы: лишние строки удаляются,
+        недостающие и изменившиеся векторы дописываются. Сравнение идёт блоками по chunk_size строк.
+
+        Аргументы:
+            usernames (list[str]): Все имена пользователей базы.
+            embeddings (array): Их эмбеддинги (n, dim).
+
+        Возвращает:
+            tuple[int, int]: Сколько записей добавлено (или заменено) и сколько удалено.
+        """
+        expected = set(usernames)
+        with self._write_lock():
+            removed = [username for username in self._positions if username not in expected]
+            for username in removed:
+                self._remove_row(username)
+            if removed:
+                self._publish()
+            stale = []
+            for start in range(0, len(usernames), chunk_size):
+                names = usernames[start:start + chunk_size]
+                codes, _ = quantize(embeddings[start:start + chunk_size], self.quantization_mode)
+                known = [i for i, username in enumerate(names) if username in self._positions]
+                stale.extend(start + i for i, username in enumerate(names) if username not in self._positions)
+                if known:
+                    rows = np.array([self._positions[names[i]] for i in known], dtype=np.int64)
+                    # Квантование детерминировано: у неизменившегося эмбеддинга коды совпадают
+                    stored = np.asarray(self._vectors[rows], dtype=np.float32)
+                    same = np.all(np.abs(stored - codes[known].astype(np.float32)) <= 1e-6, axis=1)
+                    stale.extend(start + known[i] for i in np.flatnonzero(~same))
+            stale.sort()
+            for start in range(0, len(stale), chunk_size):
+                rows = stale[start:start + chunk_size]
+                self.add_many([usernames[i] for i in rows], np.asarray(embeddings[rows]))
+        return len(stale), len(removed)
+
+    def _grow(self):
+        """Удваивает ёмкость файлов vectors.npy, scales.npy и lists.npy (под блокировкой записи)."""
+        arrays = [('_vectors', 'vectors.npy', 0), ('_lists', 'lists.npy', -1)]
+        if self._scales is not None:
+            arrays.append(('_scales', 'scales.npy', 1))
+        self._grow_arrays(arrays)
+
+    def add(self, username, embedding):
+        """Добавляет (или заменяет) вектор пользователя и сразу сохраняет изменение на диск."""
+        self.add_many([username], [embedding])
+
+    def add_many(self, usernames, embeddings):
+        """
+        Добавляет (или заменяет) векторы многих пользователей с одной записью на диск.
+        Несколько процессов сервера могут писать в один индекс: запись сериализуется
+        блокировкой файла lock, а строки пишутся с числа строк, опубликованного в meta.json.
+        """
+        if not len(usernames):
+            return
+        vectors = normalize(embeddings)
+        clusters = np.argmax(vectors @ self.centroids.T, axis=1)
+        codes, scales = quantize(vectors, self.quantization_mode)
+        with self._write_lock():
+            for username in usernames:
+                self._remove_row(username)
+            while self.count + len(usernames) > len(self._vectors):
+                self._grow()
+            first = self.count
+            self._vectors[first:first + len(usernames)] = codes
+            self._lists[first:first + len(usernames)] = clusters
+            self._vectors.flush()
+            self._lists.flush()
+            if self._scales is not None:
+                self._scales[first:first + len(usernames)] = scales
+                self._scales.flush()
+            self._append_usernames(usernames)
+            for row, (username, cluster) in enumerate(zip(usernames, clusters), start=first):
+                self._positions[username] = row
+                self._members[cluster].append(row)
+                self._member_arrays[cluster] = None
+            self._publish()
+
+    def remove(self, username):
+        """Помечает строку пользователя удалённой. Возвращает True, если пользователь был в индексе."""
+        with self._write_lock():
+            if not self._remove_row(username):
+                return False
+            self._publish()
+            return True
+
+    def _remove_row(self, username):
+        """Помечает строку удалённой без публикации (вызывается под блокировкой записи)."""
+        row = self._positions.pop(username, None)
+        if row is None:
+            return False
+        cluster = int(self._lists[row])
+        self._lists[row] = -1
+        self._lists.flush()
+        self._members[cluster].remove(row)
+        self._member_arrays[cluster] = None
+        self._removed += 1
+        return True
+
+    def _row_scales(self, rows):
+        """Масштабы строк (единицы у индекса без scales.npy)."""
+        if self._scales is None:
+            return np.ones(len(rows), dtype=np.float32)
+        return np.asarray(self._scales[rows])
+
+    def _scores(self, rows, query):
+        """Косинусные сходства запроса со строками rows с учётом режима квантования."""
+        return similarities(self._vectors[rows], self._row_scales(rows), query)
+
+    def _rows(self, cluster):
+        """Строки кластера в виде массива (кэшируется до следующего изменения кластера)."""
+        rows = self._member_arrays[cluster]
+        if rows is None:
+            rows = self._member_arrays[cluster] = np.array(self._members[cluster], dtype=np.int64)
+        return rows
+
+    @timed('ann_search')
+    def search(self, embedding, k=1, nprobe=None):
+        """
+        Приближённый поиск ближайших пользователей.
+
+        Аргументы:
+            embedding (list/array): Эмбеддинг запроса.
+            k (int): Число результатов.
+            nprobe (int): Сколько кластеров просматривать (по умолчанию self.nprobe).
+
+        Возвращает:
+            list[tuple[str, float]]: Пары (username, расстояние euclidean_l2) по возрастанию расстояния.
+        """
+        query = normalize(embedding)[0]
+        with self._lock:
+            self.refresh()
+            nprobe = min(nprobe or self.nprobe, self.nlist)
+            probes = np.argpartition(-(self.centroids @ query), nprobe - 1)[:nprobe]
+            rows = np.concatenate([self._rows(cluster) for cluster in probes])
+            if len(rows) == 0:
+                return []
+            rows.sort()  # Последовательное чтение страниц memmap
+            scores = self._scores(rows, query)
+            k = min(k, len(rows))
+            top = np.argpartition(-scores, k - 1)[:k]
+            top = top[np.argsort(-scores[top])]
+            return [(self._usernames[rows[i]], float(d)) for i, d in zip(top, l2_distances(scores[top]))]
+
+    def exact_search(self, embedding, k=1):
+        """Точный поиск по всем живым строкам (эталон для отчёта о полноте)."""
+        query = normalize(embedding)[0]
+        with self._lock:
+            self.refresh()
+            rows = np.flatnonzero(np.asarray(self._lists[:self.count]) >= 0)
+            scores = self._scores(rows, query)
+            k = min(k, len(rows))
+            top = np.argpartition(-scores, k - 1)[:k]
+            top = top[np.argsort(-scores[top])]
+            return [(self._usernames[rows[i]], float(d)) for i, d in zip(top, l2_distances(scores[top]))]
+
+    def recall_report(self, queries=None, k=10, nprobe_values=(1, 2, 4, 8, 16, 32), num_queries=200, seed=0):
+        """
+        Сравнивает приближённый поиск с точным.
+
+        Аргументы:
+            queries (array): Запросы; по умолчанию — сохранённые векторы с небольшим шумом.
+            k (int): Сколько соседей сравнивать.
+            nprobe_values (tuple): Значения nprobe для проверки.
+
+        Возвращает:
+            list[dict]: Для каждого nprobe: recall@k, средняя задержка приближённого и точного поиска (мс).
+        """
+        if queries is None:
+            rng = np.random.default_rng(seed)
+            live = np.flatnonzero(np.asarray(self._lists[:self.count]) >= 0)
+            sample = rng.choice(live, min(num_queries, len(live)), replace=False)
+            rows = np.sort(sample)
+            queries = dequantize(self._vectors[rows], self._row_scales(rows))
+            queries = queries + rng.normal(0, 0.05, (len(sample), self.dim)).astype(np.float32)
+        queries = normalize(queries)
+
+        start = time.perf_counter()
+        exact = [{name for name, _ in self.exact_search(query, k)} for query in queries]
+        exact_ms = (time.perf_counter() - start) * 1000 / len(queries)
+
+        report = []
+        for nprobe in nprobe_values:
+            if nprobe > self.nlist:
+                break
+            start = time.perf_counter()
+            found = [{name for name, _ in self.search(query, k, nprobe=nprobe)} for query in queries]
+            approx_ms = (time.perf_counter() - start) * 1000 / len(queries)
+            recall = np.mean([len(a & e) / max(len(e), 1) for a, e in zip(found, exact)])
+            report.append({"nprobe": nprobe, f"recall@{k}": round(float(recall), 4),
+                           "approx_ms": round(approx_ms, 3), "exact_ms": round(exact_ms, 3)})
+        return report
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Приближённый индекс эмбеддингов (IVF).")
+    parser.add_argument("command", choices=["build", "report"])
+    parser.add_argument("--db-url", default="sqlite:///app.db")
+    parser.add_argument("--path", default="app.db.ivf", help="Каталог индекса.")
+    parser.add_argument("--nlist", type=int, default=None, help="Число кластеров (по умолчанию около 4 * sqrt(n)).")
+    parser.add_argument("--k", type=int, default=10)
+    parser.add_argument("--quantization", default="float32", choices=QUANTIZATION_MODES,
+                        help="Хранение векторов индекса.")
+    args = parser.parse_args()
+
+    if args.command == "build":
+        from db import Database
+        usernames, embeddings = Database(args.db_url).get_all_embeddings()
+        IVFIndex.build(args.path, usernames, embeddings, nlist=args.nlist, quantization_mode=args.quantization)
+    else:
+        for row in IVFIndex(args.path).recall_report(k=args.k):
+            print(f"[RESULT] {row}")
+
+
+if __name__ == "__main__":
+    main()
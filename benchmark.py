@@ -0,0 +1,272 @@
+"""
+Воспроизводимые замеры горячих путей: декодирование, детекция, эмбеддинг, сравнение и БД.
+
+Запуск:
+    python benchmark.py --output bench.json
+    python benchmark.py --skip-ml --db-sizes 1000,10000,100000
+    python benchmark.py --compare old.json new.json
+
+Результат — JSON с перцентилями задержек (мс), пропускной способностью (операций/с)
+и пиковым RSS процесса, чтобы сравнивать коммиты между собой.
+"""
+import argparse
+import contextlib
+import io
+import json
+import os
+import platform
+import subprocess
+import sys
+import tempfile
+import time
+
+import numpy as np
+
+BASE_DIR = os.path.dirname(os.path.abspath(__file__))
+FIXTURES = [os.path.join(BASE_DIR, name) for name in ('ruslan.jpeg', 'ruslan2.jpeg', 'damir.jpeg')]
+
+try:
+    import resource
+except ImportError:  # Windows
+    resource = None
+
+
+def log(message):
+    """Прогресс пишется в stderr, чтобы stdout оставался чистым JSON."""
+    print(f"[LOG BENCH] {message}", file=sys.stderr)
+
+
+def peak_rss_mb():
+    """Пиковый RSS процесса в МБ (None, если платформа не поддерживает)."""
+    if resource is None:
+        return None
+    peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    # Linux отдаёт килобайты, macOS — байты
+    return round(peak / (1024 * 1024) if sys.platform == 'darwin' else peak / 1024, 1)
+
+
+def measure(fn, repeat=20, warmup=2, items=1):
+    """
+    Замеряет функцию.
+
+    Аргументы:
+        fn (callable): Функция без аргументов.
+        repeat (int): Число замеряемых вызовов.
+        warmup (int): Число вызовов перед замером.
+        items (int): Сколько операций выполняет один вызов (для пропускной способности).
+
+    Возвращает:
+        dict: Перцентили и среднее в миллисекундах, пропускная способность и пиковый RSS.
+    """
+    samples = np.empty(repeat, dtype=np.float64)
+    # Логи модулей ([LOG ...]) не должны попадать в замер
+    with open(os.devnull, 'w') as devnull, contextlib.redirect_stdout(devnull):
+        for _ in range(warmup):
+            fn()
+        for i in range(repeat):
+            start = time.perf_counter()
+            fn()
+            samples[i] = time.perf_counter() - start
+    samples_ms = samples * 1000.0
+    return {
+        "n": repeat,
+        "mean_ms": round(float(samples_ms.mean()), 4),
+        "p50_ms": round(float(np.percentile(samples_ms, 50)), 4),
+        "p90_ms": round(float(np.percentile(samples_ms, 90)), 4),
+        "p99_ms": round(float(np.percentile(samples_ms, 99)), 4),
+        "min_ms": round(float(samples_ms.min()), 4),
+        "max_ms": round(float(samples_ms.max()), 4),
+        "throughput_per_s": round(items * repeat / float(samples.sum()), 2) if samples.sum() > 0 else None,
+        "peak_rss_mb": peak_rss_mb(),
+    }
+
+
+def bench_decode(repeat):
+    """
+    Декодирование фикстур через Camera.file_to_numpy, Camera.bytes_to_numpy и Camera.upload_to_numpy,
+    а также синтетического снимка 12 Мп (как фото с телефона).
+    """
+    import cv2
+    from camera import Camera
+    camera = Camera()
+    samples = {}
+    for path in FIXTURES:
+        with open(path, 'rb') as f:
+            samples[os.path.basename(path)] = f.read()
+    gradient = np.linspace(0, 255, 4000, dtype=np.float32)
+    photo = np.stack([np.add.outer(gradient[:3000] * 0.5, gradient * 0.5)] * 3, axis=-1).astype(np.uint8)
+    samples["12mp"] = cv2.imencode('.jpg', photo, [cv2.IMWRITE_JPEG_QUALITY, 90])[1].tobytes()
+    del photo
+
+    results = {}
+    for name, data in samples.items():
+        path = next((p for p in FIXTURES if os.path.basename(p) == name), None)
+        if path is not None:
+            results[f"file_to_numpy[{name}]"] = measure(lambda: camera.file_to_numpy(path), repeat)
+        results[f"bytes_to_numpy[{name}]"] = measure(lambda: camera.bytes_to_numpy(data), repeat)
+        results[f"upload_to_numpy[{name}]"] = measure(lambda: camera.upload_to_numpy(io.BytesIO(data)), repeat)
+    return results
+
+
+def bench_compare(repeat, dim=128, seed=0):
+    """Сравнение эмбеддингов: FaceAuth.compare_embeddings и поиск 1:N в FaceIndex."""
+    from face_auth import FaceAuth
+    from face_index import FaceIndex
+    rng = np.random.default_rng(seed)
+    a, b = rng.standard_normal(dim).tolist(), rng.standard_normal(dim).tolist()
+    face_auth = FaceAuth()
+    # Порог передаётся явно, чтобы не импортировать DeepFace ради verification.find_threshold;
+    # на время сравнения его значение не влияет (0.40 — порог DeepFace для Facenet и cosine)
+    threshold = float(face_auth.calibration.get("threshold", 0.40))
+    results = {
+        f"compare_embeddings[{face_auth.distance_metric}]": measure(
+            lambda: face_auth.compare_embeddings(a, b, threshold=threshold), repeat * 50),
+    }
+    for size in (1000, 10000, 100000):
+        usernames = [f"user_{i}" for i in range(size)]
+        embeddings = rng.standard_normal((size, dim), dtype=np.float32)
+        query = rng.standard_normal(dim)
+        for mode in ('float32', 'float16', 'int8'):
+            index = FaceIndex(dim=dim, capacity=size, quantization_mode=mode)
+            index.add_many(usernames, embeddings)
+            stats = measure(lambda: index.search(query, k=5), repeat)
+            stats["index_mb"] = round(index.memory_bytes() / 2 ** 20, 2)
+            results[f"face_index_search[{size},{mode}]"] = stats
+    return results
+
+
+def bench_ml(repeat):
+    """Детекция, эмбеддинг и сравнение на фикстурах (нужны DeepFace и веса моделей)."""
+    from face_auth import FaceAuth
+    face_auth = FaceAuth()
+    face_auth.warm_up()
+    results = {}
+    for path in FIXTURES:
+        name = os.path.basename(path)
+        results[f"detect_face[{name}]"] = measure(lambda: face_auth.detect_face(path), repeat)
+        results[f"get_embedding[{name}]"] = measure(lambda: face_auth.get_embedding(path), repeat)
+        results[f"detect_and_embed[{name}]"] = measure(lambda: face_auth.detect_and_embed(path), repeat)
+    results["get_embeddings[batch=3]"] = measure(lambda: face_auth.get_embeddings(FIXTURES), repeat, items=len(FIXTURES))
+    embedding1, embedding2 = face_auth.get_embedding(FIXTURES[0]), face_auth.get_embedding(FIXTURES[1])
+    results["compare_embeddings"] = measure(lambda: face_auth.compare_embeddings(embedding1, embedding2), repeat * 50)
+    results["compare_photos[ruslan,ruslan2]"] = measure(lambda: face_auth.compare_photos(FIXTURES[0], FIXTURES[1]), repeat)
+    return results
+
+
+def bench_db(sizes, repeat, dim=128, seed=0):
+    """
+    Операции Database на синтетических галереях.
+    Галерея заполняется пакетно (add_users), add_user замеряется поверх заполненной базы.
+    """
+    from db import Database
+    rng = np.random.default_rng(seed)
+    photo = rng.integers(0, 256, size=(160, 160, 3), dtype=np.uint8)
+    results = {}
+    for size in sizes:
+        log(f"База данных на {size} пользователей...")
+        with tempfile.TemporaryDirectory() as tmp:
+            db = Database(f"sqlite:///{os.path.join(tmp, 'bench.db')}")
+            for start in range(0, size, 5000):
+                count = min(5000, size - start)
+                embeddings = rng.standard_normal((count, dim), dtype=np.float32)
+                db.add_users([{"username": f"user_{start + i}", "embedding": embeddings[i]} for i in range(count)])
+
+            counter = iter(range(size, size + repeat + 2))
+            results[f"add_user[{size}]"] = measure(
+                lambda: db.add_user(f"user_{next(counter)}", embedding=rng.standard_normal(dim), photo=photo), repeat)
+            results[f"get_user_data[{size}]"] = measure(
+                lambda: db.get_user_data(f"user_{rng.integers(size)}"), repeat)
+            results[f"get_all_users[{size}]"] = measure(db.get_all_users, max(repeat // 5, 3), warmup=1, items=size)
+            results[f"get_all_embeddings[{size}]"] = measure(db.get_all_embeddings, max(repeat // 5, 3), warmup=1, items=size)
+            db.engine.dispose()
+    return results
+
+
+def git_commit():
+    try:
+        return subprocess.check_output(['git', 'rev-parse', 'HEAD'], cwd=BASE_DIR, stderr=subprocess.DEVNULL).decode().strip()
+    except Exception:
+        return None
+
+
+def run(db_sizes, repeat, skip_ml=False):
+    """Запускает все группы замеров и возвращает отчёт. Логи модулей уходят в stderr."""
+    with contextlib.redirect_stdout(sys.stderr):
+        return _run(db_sizes, repeat, skip_ml)
+
+
+def _run(db_sizes, repeat, skip_ml):
+    report = {
+        "meta": {
+            "commit": git_commit(),
+            "timestamp": time.strftime('%Y-%m-%dT%H:%M:%S'),
+            "python": platform.python_version(),
+            "numpy": np.__version__,
+            "platform": platform.platform(),
+            "repeat": repeat,
+        },
+        "results": {},
+    }
+    log("Декодирование изображений...")
+    report["results"]["decode"] = bench_decode(repeat)
+    log("Сравнение эмбеддингов и индекс...")
+    report["results"]["compare"] = bench_compare(repeat)
+    report["results"]["db"] = bench_db(db_sizes, repeat)
+    if not skip_ml:
+        log("Модели (детекция и эмбеддинг)...")
+        report["results"]["ml"] = bench_ml(repeat)
+    report["meta"]["peak_rss_mb"] = peak_rss_mb()
+    return report
+
+
+def compare_reports(old_path, new_path, tolerance=0.10):
+    """
+    Сравнивает p50 двух отчётов и печатает изменения.
+    Возвращает:
+        int: Число замеров, замедлившихся больше чем на tolerance.
+    """
+    with open(old_path) as f:
+        old = json.load(f)["results"]
+    with open(new_path) as f:
+        new = json.load(f)["results"]
+    regressions = 0
+    for group, benches in new.items():
+        for name, stats in benches.items():
+            before = old.get(group, {}).get(name)
+            if not before or not before["p50_ms"]:
+                continue
+            change = stats["p50_ms"] / before["p50_ms"] - 1.0
+            marker = ""
+            if change > tolerance:
+                marker = "  <-- РЕГРЕССИЯ"
+                regressions += 1
+            print(f"{group}/{name}: {before['p50_ms']:.3f} -> {stats['p50_ms']:.3f} мс ({change:+.1%}){marker}")
+    return regressions
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Замеры производительности горячих путей.")
+    parser.add_argument("--db-sizes", default="1000,10000,100000", help="Размеры синтетических галерей через запятую.")
+    parser.add_argument("--repeat", type=int, default=20, help="Число замеряемых вызовов на операцию.")
+    parser.add_argument("--skip-ml", action="store_true", help="Не замерять модели DeepFace.")
+    parser.add_argument("--output", help="Файл для JSON-отчёта (по умолчанию stdout).")
+    parser.add_argument("--compare", nargs=2, metavar=("OLD", "NEW"), help="Сравнить два отчёта.")
+    parser.add_argument("--tolerance", type=float, default=0.10, help="Допустимое замедление p50 при сравнении.")
+    args = parser.parse_args()
+
+    if args.compare:
+        sys.exit(1 if compare_reports(*args.compare, tolerance=args.tolerance) else 0)
+
+    sizes = [int(size) for size in args.db_sizes.split(",") if size]
+    report = run(sizes, args.repeat, skip_ml=args.skip_ml)
+    output = json.dumps(report, indent=2, ensure_ascii=False)
+    if args.output:
+        with open(args.output, 'w', encoding='utf-8') as f:
+            f.write(output)
+        log(f"Отчёт сохранён в {args.output}")
+    else:
+        print(output)
+
+
+if __name__ == "__main__":
+    main()
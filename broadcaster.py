@@ -0,0 +1,157 @@
+import threading
+import time
+import cv2
+from metrics import METRICS, timed
+
+STREAM_CLIENTS = METRICS.gauge('stream_clients', 'Connected /video_stream clients.')
+
+# Пауза перед повторной попыткой, если камера не отдала кадр или не запустилась
+RETRY_INTERVAL = 0.5
+
+
+class StreamBroadcaster:
+    def __init__(self, camera, max_fps=15.0, quality=80, max_width=640):
+        """
+        Раздача MJPEG-потока многим клиентам с однократным кодированием кадра.
+
+        Один поток-кодировщик берёт кадры из общего буфера камеры, уменьшает их,
+        кодирует в JPEG и публикует готовую часть multipart-ответа. Все подписчики
+        получают одни и те же байты. Медленный клиент не копит очередь: после отправки
+        он сразу получает самый свежий кадр, а промежуточные пропускаются.
+
+        Аргументы:
+            camera (Camera): Камера в фоновом режиме (threaded=True).
+            max_fps (float): Максимальная частота кодирования кадров.
+            quality (int): Качество JPEG (0-100).
+            max_width (int): Максимальная ширина кадра в потоке; None — без уменьшения.
+        """
+        if not camera.threaded:
+            raise ValueError("StreamBroadcaster требует камеру в фоновом режиме (Camera(threaded=True)).")
+        self.camera = camera
+        self.max_fps = max_fps
+        self.quality = quality
+        self.max_width = max_width
+        self._condition = threading.Condition()
+        self._part = None  # Последний закодированный кадр вместе с заголовками multipart
+        self._sequence = 0
+        self._subscribers = 0
+        self._thread = None
+        self._epoch = 0  # Растёт, когда кодировщик завершается из-за камеры: потоки клиентов закрываются
+        print("[LOG STREAM] Раздатчик видеопотока успешно создан.")
+
+    @property
+    def subscribers(self):
+        """Число подключённых клиентов."""
+        return self._subscribers
+
+    @timed('jpeg_encode')
+    def _encode(self, frame):
+        """Уменьшает кадр и кодирует его в часть multipart-ответа."""
+        height, width = frame.shape[:2]
+        if self.max_width and width > self.max_width:
+            scale = self.max_width / width
+            frame = cv2.resize(frame, (self.max_width, int(height * scale)), interpolation=cv2.INTER_AREA)
+        ret, buffer = cv2.imencode('.jpg', frame, [cv2.IMWRITE_JPEG_QUALITY, self.quality])
+        if not ret:
+            return None
+        return (b'--frame\r\n'
+                b'Content-Type: image/jpeg\r\n\r\n' + buffer.tobytes() + b'\r\n')
+
+    def _encode_loop(self):
+        """Кодирует кадры, пока есть подписчики, не чаще max_fps раз в секунду."""
+        print("[LOG STREAM] Кодировщик видеопотока запущен.")
+        interval = 1.0 / self.max_fps if self.max_fps else 0.0
+        camera_sequence = 0
+        next_time = time.monotonic()
+        while True:
+            with self._condition:
+                if self._subscribers == 0:
+                    self._thread = None
+                    break
+            delay = next_time - time.monotonic()
+            if delay > 0:
+                time.sleep(delay)
+            latest = self.camera.wait_for_frame(camera_sequence)
+            if latest is None:
+                # Кадра нет сразу, если камера остановлена (start() отказал из-за частых операций
+                # или процесс не смог забрать камеру у прежнего владельца): без паузы цикл занял бы ядро
+                if not self.camera.is_running and not self._restart_camera():
+                    break
+                next_time = time.monotonic() + max(interval, RETRY_INTERVAL)
+                continue
+            camera_sequence, _, frame = latest
+            part = self._encode(frame)
+            if part is None:
+                print("[LOG STREAM] Не удалось закодировать кадр в JPEG.")
+                continue
+            with self._condition:
+                self._sequence += 1
+                self._part = part
+                self._condition.notify_all()
+            next_time = max(next_time + interval, time.monotonic())
+        print("[LOG STREAM] Кодировщик видеопотока остановлен.")
+
+    def _restart_camera(self):
+        """
+        Пытается снова запустить остановленную камеру.
+        Возвращает False, если камера не может работать: тогда кодировщик завершается и потоки клиентов закрываются.
+        """
+        try:
+            self.camera.start()
+        except RuntimeError as e:
+            print(f"[LOG STREAM] Камера недоступна, видеопоток завершён: {e}")
+            with self._condition:
+                self._thread = None
+                self._epoch += 1
+                self._condition.notify_all()
+            return False
+        return True  # Отказ из-за частых операций повторится после паузы
+
+    def _subscribe(self):
+        """
+        Регистрирует клиента и при необходимости запускает камеру и кодировщик.
+        Бросает RuntimeError, если камеру запустить не удалось.
+        Возвращает:
+            int: Эпоха кодировщика, к которой подключён клиент.
+        """
+        if not self.camera.is_running:
+            self.camera.start()
+        if not self.camera.is_running:
+            raise RuntimeError("Камера не запущена: повторите попытку позже.")
+        with self._condition:
+            self._subscribers += 1
+            STREAM_CLIENTS.set(self._subscribers)
+            if self._thread is None:
+                self._thread = threading.Thread(target=self._encode_loop, name="stream-encoder", daemon=True)
+                self._thread.start()
+            epoch = self._epoch
+        print(f"[LOG STREAM] Клиент подключён. Всего клиентов: {self._subscribers}.")
+        return epoch
+
+    def _unsubscribe(self):
+        with self._condition:
+            self._subscribers -= 1
+            STREAM_CLIENTS.set(self._subscribers)
+        print(f"[LOG STREAM] Клиент отключён. Всего клиентов: {self._subscribers}.")
+
+    def stream(self):
+        """
+        Генератор MJPEG-потока для одного клиента.
+
+        Возвращает:
+            generator[bytes]: Части multipart-ответа с кадрами JPEG; поток завершается, если камера недоступна.
+        """
+        epoch = self._subscribe()
+        try:
+            sequence = 0
+            while True:
+                with self._condition:
+                    self._condition.wait_for(lambda: self._sequence > sequence or self._epoch != epoch, timeout=1.0)
+                    if self._epoch != epoch:
+                        return
+                    if self._sequence <= sequence:
+                        continue
+                    sequence, part = self._sequence, self._part
+                yield part
+        finally:
+            self._unsubscribe()
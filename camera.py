@@ -1,24 +1,295 @@
 import cv2
 import numpy as np
-from PIL import Image
-from io import BytesIO
+from collections import deque
+import os
+import threading
 import time
+from metrics import timed
+
+try:
+    import fcntl
+except ImportError:  # Windows: блокировка устройства между процессами не поддерживается
+    fcntl = None
+
+
+# Ограничения для загружаемых изображений
+UPLOAD_MAX_BYTES = 10 * 1024 * 1024  # Размер файла (также MAX_CONTENT_LENGTH запроса в Web)
+UPLOAD_MAX_PIXELS = 40_000_000  # Ширина * высота из заголовка; больше — отказ до декодирования
+UPLOAD_TARGET_SIDE = 800  # Уменьшать при декодировании, пока длинная сторона не меньше этого
+
+# Флаги декодирования с уменьшением в 8, 4 и 2 раза (для JPEG уменьшение идёт прямо в декодере)
+REDUCED_DECODE_FLAGS = ((8, cv2.IMREAD_REDUCED_COLOR_8), (4, cv2.IMREAD_REDUCED_COLOR_4), (2, cv2.IMREAD_REDUCED_COLOR_2))
+
+# Общий буфер кадров для процессов, не владеющих камерой (см. SharedFrameBuffer)
+SHARED_FRAME_MAX_BYTES = 1920 * 1080 * 3  # Кадр больше не публикуется
+SHARED_FRAME_MAX_AGE = 2.0  # Кадр старше (секунды) считается брошенным: владелец завершился или завис
+SHARED_POLL_INTERVAL = 0.01  # Как часто читатель проверяет появление нового кадра
+
+PNG_SIGNATURE = b'\x89PNG\r\n\x1a\n'
+# Маркеры JPEG SOF с размерами кадра (C4, C8 и CC — другие сегменты)
+JPEG_SOF_MARKERS = frozenset(range(0xC0, 0xD0)) - {0xC4, 0xC8, 0xCC}
+
+
+def image_header_size(data):
+    """
+    Читает размеры изображения из заголовка JPEG или PNG без декодирования.
+
+    Аргументы:
+        data (bytes/memoryview): Байты файла.
+
+    Возвращает:
+        tuple[int, int] | None: (ширина, высота) или None, если формат не JPEG/PNG или заголовок повреждён.
+    """
+    view = memoryview(data)
+    if bytes(view[:8]) == PNG_SIGNATURE and len(view) >= 24 and bytes(view[12:16]) == b'IHDR':
+        return int.from_bytes(view[16:20], 'big'), int.from_bytes(view[20:24], 'big')
+    if bytes(view[:2]) != b'\xff\xd8':
+        return None
+    i = 2
+    while i + 4 <= len(view):
+        if view[i] != 0xFF:
+            return None
+        marker = view[i + 1]
+        if marker == 0xFF:  # Байт-заполнитель
+            i += 1
+            continue
+        if 0xD0 <= marker <= 0xD9 or marker == 0x01:  # Маркеры без длины
+            i += 2
+            continue
+        if marker in JPEG_SOF_MARKERS and i + 9 <= len(view):
+            return int.from_bytes(view[i + 7:i + 9], 'big'), int.from_bytes(view[i + 5:i + 7], 'big')
+        i += 2 + int.from_bytes(view[i + 2:i + 4], 'big')
+    return None
+
+
+def read_upload(stream, max_bytes=UPLOAD_MAX_BYTES):
+    """
+    Читает загруженный файл в буфер без лишних копий.
+
+    Файл в памяти (BytesIO) отдаётся как memoryview его буфера, файл на диске читается
+    одним readinto в заранее выделенный bytearray.
+
+    Аргументы:
+        stream: Поток файла (например, FileStorage.stream из Flask).
+        max_bytes (int): Максимальный размер файла.
+
+    Возвращает:
+        memoryview: Байты файла.
+    """
+    inner = getattr(stream, '_file', stream)  # SpooledTemporaryFile хранит данные в _file
+    if hasattr(inner, 'getbuffer'):
+        view = inner.getbuffer()
+        if len(view) > max_bytes:
+            raise ValueError(f"Файл больше {max_bytes // (1024 * 1024)} МБ.")
+        return view
+    if stream.seekable():
+        stream.seek(0, os.SEEK_END)
+        size = stream.tell()
+        stream.seek(0)
+        if size > max_bytes:
+            raise ValueError(f"Файл больше {max_bytes // (1024 * 1024)} МБ.")
+        buffer = bytearray(size)
+        view = memoryview(buffer)
+        read = 0
+        while read < size:
+            count = stream.readinto(view[read:])
+            if not count:
+                break
+            read += count
+        return view[:read]
+    data = stream.read(max_bytes + 1)
+    if len(data) > max_bytes:
+        raise ValueError(f"Файл больше {max_bytes // (1024 * 1024)} МБ.")
+    return memoryview(data)
+
+
+def decode_upload(data, max_pixels=UPLOAD_MAX_PIXELS, target_side=UPLOAD_TARGET_SIDE):
+    """
+    Декодирует JPEG/PNG из буфера с уменьшением при декодировании.
+
+    Размеры читаются из заголовка; изображение больше max_pixels отклоняется без декодирования.
+    Коэффициент уменьшения (8, 4 или 2) выбирается наибольшим, при котором длинная сторона
+    остаётся не меньше target_side. JPEG в этом случае декодируется сразу в уменьшенном размере,
+    и полноразмерный массив не создаётся.
+
+    Аргументы:
+        data (bytes/memoryview): Байты файла.
+        max_pixels (int): Максимум ширина * высота.
+        target_side (int): Минимальная длинная сторона после уменьшения; None — без уменьшения.
+
+    Возвращает:
+        numpy.ndarray: Изображение BGR (как cv2.imread). Бросает ValueError при неверном или слишком большом файле.
+    """
+    size = image_header_size(data)
+    if size is None:
+        raise ValueError("Поддерживаются только изображения JPEG и PNG.")
+    width, height = size
+    if width * height > max_pixels:
+        raise ValueError(f"Изображение слишком большое: {width}x{height}.")
+    flag = cv2.IMREAD_COLOR
+    if target_side:
+        for factor, reduced_flag in REDUCED_DECODE_FLAGS:
+            if max(width, height) // factor >= target_side:
+                flag = reduced_flag
+                break
+    with timed('decode'):
+        image = cv2.imdecode(np.frombuffer(data, dtype=np.uint8), flag)
+    if image is None:
+        raise ValueError("Не удалось декодировать изображение.")
+    return image
+
+
+class CameraBusy(RuntimeError):
+    """Камерой владеет другой процесс сервера (HTTP 503)."""
+
+
+class SharedFrameBuffer:
+    HEADER_BYTES = 64
+
+    def __init__(self, path, max_bytes=SHARED_FRAME_MAX_BYTES):
+        """
+        Последний кадр камеры в файле, отображённом в память всеми процессами сервера.
+
+        Заголовок — числа int64: номер записи (нечётный, пока кадр пишется), время захвата
+        в микросекундах, высота, ширина и число каналов; за ним байты кадра. Пишет только
+        процесс-владелец камеры, читатели копируют кадр и повторяют чтение, если номер записи
+        за это время изменился.
+
+        Аргументы:
+            path (str): Файл буфера.
+            max_bytes (int): Максимальный размер кадра в байтах.
+        """
+        self.path = path
+        self.max_bytes = max_bytes
+        self._header = None
+        self._data = None
+
+    def _map(self, create):
+        """Отображает файл в память; читатель ждёт, пока владелец его создаст."""
+        if self._header is not None:
+            return True
+        size = self.HEADER_BYTES + self.max_bytes
+        if create:
+            with open(self.path, 'a+b') as f:
+                if os.fstat(f.fileno()).st_size < size:
+                    f.truncate(size)
+        elif not os.path.exists(self.path) or os.path.getsize(self.path) < size:
+            return False
+        mapped = np.memmap(self.path, dtype=np.uint8, mode='r+', shape=(size,))
+        self._header = mapped[:self.HEADER_BYTES].view(np.int64)
+        self._data = mapped[self.HEADER_BYTES:]
+        return True
+
+    def sequence(self):
+        """Номер последнего опубликованного кадра (0, если кадров не было)."""
+        if not self._map(create=False):
+            return 0
+        return int(self._header[0]) // 2
+
+    def write(self, frame, timestamp):
+        """Публикует кадр. Возвращает False, если кадр больше max_bytes."""
+        frame = np.ascontiguousarray(frame)
+        if frame.nbytes > self.max_bytes:
+            return False
+        self._map(create=True)
+        header = self._header
+        start = int(header[0]) | 1  # Нечётный номер: кадр пишется (и после сбоя прежнего владельца)
+        header[0] = start
+        self._data[:frame.nbytes] = frame.reshape(-1)
+        header[1:5] = (int(timestamp * 1e6), frame.shape[0], frame.shape[1], frame.shape[2] if frame.ndim == 3 else 1)
+        header[0] = start + 1
+        return True
+
+    def read(self):
+        """
+        Возвращает:
+            tuple | None: (номер кадра, время захвата, кадр BGR) или None, если кадров нет.
+        """
+        if not self._map(create=False):
+            return None
+        header = self._header
+        for _ in range(5):
+            before = int(header[0])
+            if before == 0:
+                return None
+            if before % 2:
+                time.sleep(0.001)
+                continue
+            timestamp, height, width, channels = (int(value) for value in header[1:5])
+            frame = np.array(self._data[:height * width * channels]).reshape(height, width, channels)
+            if int(header[0]) == before:
+                return before // 2, timestamp / 1e6, frame
+        return None
+
 
 class Camera:
-    def __init__(self, min_interval=1.0):
+    def __init__(self, min_interval=1.0, threaded=False, buffer_size=4, lock_path=None, frames_path=None):
         """
         Инициализация класса камеры.
         
         Аргументы:
             min_interval (float): Минимальный интервал времени (в секундах) между операциями start/stop.
+            threaded (bool): Читать кадры в фоновом потоке. Тогда устройством владеет один поток,
+                а get_frame и видеопотоки берут кадры из общего буфера, не блокируясь на чтении.
+            buffer_size (int): Сколько последних кадров хранится в буфере фонового режима.
+            lock_path (str): Файл блокировки устройства для нескольких процессов сервера:
+                камеру открывает только процесс, захвативший блокировку. None — без блокировки.
+            frames_path (str): Файл общего буфера кадров (фоновый режим с lock_path): владелец
+                публикует в него кадры, остальные процессы читают их оттуда, а не получают CameraBusy.
+                По умолчанию lock_path + '.frames'.
         """
         self.cap = None
         self.is_running = False
         self.last_operation_time = 0
         self.min_interval = min_interval
         self.last_frame = None  # Кэш последнего кадра
+        self.threaded = threaded
+        self.fps = None  # Частота кадров устройства (заполняется при запуске)
+        self._buffer = deque(maxlen=buffer_size)  # Последние кадры: (номер, время, кадр)
+        self._sequence = 0
+        self._frame_ready = threading.Condition()
+        self._capture_thread = None
+        self.lock_path = lock_path
+        self._lock_file = None  # Открытый файл блокировки, пока процесс владеет устройством
+        self._shared = None
+        if threaded and lock_path is not None and fcntl is not None:
+            self._shared = SharedFrameBuffer(frames_path or lock_path + '.frames')
+        self._follower = False  # Камерой владеет другой процесс, кадры читаются из общего буфера
         print("[LOG CAMERA] Класс камеры успешно создан.")
 
+    @property
+    def is_owner(self):
+        """Может ли этот процесс открывать устройство."""
+        return self.lock_path is None or fcntl is None or self._lock_file is not None
+
+    def acquire_device(self):
+        """
+        Захватывает блокировку устройства без ожидания.
+        Блокировка снимается в stop() или автоматически при завершении процесса,
+        после чего устройство может забрать другой процесс.
+        Бросает CameraBusy, если устройством владеет другой процесс.
+        """
+        if self.is_owner:
+            return
+        lock_file = open(self.lock_path, 'a+')
+        try:
+            fcntl.flock(lock_file, fcntl.LOCK_EX | fcntl.LOCK_NB)
+        except OSError:
+            lock_file.close()
+            raise CameraBusy("Камерой владеет другой процесс сервера.")
+        lock_file.seek(0)
+        lock_file.truncate()
+        lock_file.write(str(os.getpid()))
+        lock_file.flush()
+        self._lock_file = lock_file
+        print(f"[LOG CAMERA] Процесс {os.getpid()} владеет камерой.")
+
+    def release_device(self):
+        """Снимает блокировку устройства."""
+        if self._lock_file is not None:
+            self._lock_file.close()
+            self._lock_file = None
+
     def _can_operate(self):
         """Проверяет, прошло ли достаточно времени с последней операции."""
         current_time = time.time()
@@ -37,14 +308,118 @@ class Camera:
             print("[LOG CAMERA] Не удалось запустить камеру из-за частых операций.")
             return
 
+        try:
+            self.acquire_device()
+        except CameraBusy:
+            if self._shared is None:
+                raise
+            self._follower = True
+            self.is_running = True
+            print("[LOG CAMERA] Камерой владеет другой процесс: кадры читаются из общего буфера.")
+            return
+        self._follower = False
+        if self._shared is not None:
+            # Номера кадров продолжают номера прежнего владельца, чтобы ожидающие потоки их не пропустили
+            self._sequence = max(self._sequence, self._shared.sequence())
         print("[LOG CAMERA] Инициализация камеры...")
         self.cap = cv2.VideoCapture(0, cv2.CAP_DSHOW)
         if not self.cap.isOpened():
             print("[LOG CAMERA] Не удалось инициализировать камеру. Проверьте подключение.")
+            self.release_device()
             raise RuntimeError("Не удалось инициализировать камеру. Проверьте подключение.")
         self.is_running = True
+        self.fps = self.cap.get(cv2.CAP_PROP_FPS) or None
+        if self.threaded:
+            self._capture_thread = threading.Thread(target=self._capture_loop, name="camera-capture", daemon=True)
+            self._capture_thread.start()
         print("[LOG CAMERA] Камера успешно инициализирована.")
 
+    def _capture_loop(self):
+        """Фоновое чтение кадров: cap.read() блокируется до следующего кадра, поэтому цикл идёт с частотой камеры."""
+        print(f"[LOG CAMERA] Фоновый захват запущен (FPS устройства: {self.fps}).")
+        while self.is_running:
+            with timed('capture'):
+                ret, frame = self.cap.read()
+            if not ret:
+                print("[LOG CAMERA] Не удалось получить кадр с камеры в фоновом потоке.")
+                time.sleep(0.05)
+                continue
+            timestamp = time.time()
+            with self._frame_ready:
+                self._sequence += 1
+                self._buffer.append((self._sequence, timestamp, frame))
+                self._frame_ready.notify_all()
+            if self._shared is not None and not self._shared.write(frame, timestamp):
+                print(f"[LOG CAMERA] Кадр {frame.shape} больше общего буфера и не опубликован.")
+        print("[LOG CAMERA] Фоновый захват остановлен.")
+
+    def _read_shared(self):
+        """Последний кадр из общего буфера, если он не старше SHARED_FRAME_MAX_AGE."""
+        latest = self._shared.read()
+        if latest is None or time.time() - latest[1] > SHARED_FRAME_MAX_AGE:
+            return None
+        return latest
+
+    def _take_over(self):
+        """
+        Забирает камеру, если прежний владелец её освободил (завершился или остановил камеру).
+        Возвращает True, если этот процесс стал владельцем.
+        """
+        try:
+            self.acquire_device()
+        except CameraBusy:
+            return False
+        print("[LOG CAMERA] Прежний владелец освободил камеру: процесс открывает её сам.")
+        self._follower = False
+        self.is_running = False
+        self.last_operation_time = 0
+        try:
+            self.start()
+        except RuntimeError as e:
+            print(f"[LOG CAMERA] Не удалось запустить камеру: {e}")
+            return False
+        return True
+
+    def get_latest(self):
+        """
+        Возвращает последний кадр из буфера фонового режима.
+        
+        Возвращает:
+            tuple | None: (номер кадра, время захвата, кадр BGR) или None, если кадров ещё нет.
+        """
+        if self._follower:
+            return self._read_shared()
+        with self._frame_ready:
+            return self._buffer[-1] if self._buffer else None
+
+    def wait_for_frame(self, after_sequence=0, timeout=1.0):
+        """
+        Ждёт кадр новее указанного номера.
+        
+        Аргументы:
+            after_sequence (int): Номер последнего уже полученного кадра.
+            timeout (float): Максимальное время ожидания в секундах.
+        
+        Возвращает:
+            tuple | None: (номер кадра, время захвата, кадр BGR) или None по таймауту.
+        """
+        if self._follower:
+            deadline = time.monotonic() + timeout
+            while self.is_running and self._follower:
+                latest = self._read_shared()
+                if latest is not None and latest[0] > after_sequence:
+                    return latest
+                if time.monotonic() >= deadline:
+                    # Свежих кадров нет: владелец мог завершиться, тогда камеру забирает этот процесс
+                    self._take_over()
+                    return None
+                time.sleep(SHARED_POLL_INTERVAL)
+        with self._frame_ready:
+            self._frame_ready.wait_for(lambda: self._sequence > after_sequence or not self.is_running, timeout=timeout)
+            if self._sequence > after_sequence and self._buffer:
+                return self._buffer[-1]
+            return None
+
     def get_frame(self, RGB2=False):
         """
         Получение текущего кадра с камеры.
@@ -54,10 +429,14 @@ class Camera:
         """
 
         if not self.is_running:
+            if self._shared is None:
+                self.acquire_device()  # Без ожидания min_interval, если камерой владеет другой процесс
             print("[LOG CAMERA] Камера не запущена. Попытка запустить...")
             try:
-                time.sleep()
+                time.sleep(self.min_interval)
                 self.start()
+            except CameraBusy:
+                raise
             except RuntimeError as e:
                 print(f"[LOG CAMERA] Не удалось запустить камеру: {e}")
                 if self.last_frame is not None:
@@ -66,7 +445,14 @@ class Camera:
                 else:
                     raise RuntimeError("Камера не запущена и нет доступных кадров.")
 
-        ret, frame = self.cap.read()
+        if self.threaded:
+            latest = self.get_latest() or self.wait_for_frame(0, timeout=max(self.min_interval, 1.0))
+            if latest is None and self._follower:
+                raise CameraBusy("Камерой владеет другой процесс сервера, но он не публикует кадры.")
+            ret, frame = (True, latest[2]) if latest else (False, None)
+        else:
+            with timed('capture'):
+                ret, frame = self.cap.read()
         if not ret:
             print("[LOG CAMERA] Не удалось получить кадр с камеры. Возвращается последний кадр.")
             if self.last_frame is not None:
@@ -87,9 +473,20 @@ class Camera:
             return
 
         print("[LOG CAMERA] Завершение работы с камерой...")
+        self.is_running = False
+        if self._follower:
+            self._follower = False
+            print("[LOG CAMERA] Чтение общего буфера кадров остановлено.")
+            return
+        if self._capture_thread is not None:
+            with self._frame_ready:
+                self._frame_ready.notify_all()
+            self._capture_thread.join(timeout=2.0)
+            self._capture_thread = None
         self.cap.release()
         self.cap = None
         self.is_running = False
+        self.release_device()
         print("[LOG CAMERA] Работа с камерой завершена.")
 
     def file_to_numpy(self, filepath):
@@ -121,14 +518,37 @@ class Camera:
             numpy.ndarray: Изображение в формате массива пикселей.
         """
         try:
-            image = Image.open(BytesIO(byte_data))
-            converted_image = cv2.cvtColor(np.array(image), cv2.COLOR_RGB2BGR)
+            converted_image = cv2.imdecode(np.frombuffer(byte_data, dtype=np.uint8), cv2.IMREAD_COLOR)
+            if converted_image is None:
+                raise ValueError("формат не распознан")
             print("[LOG CAMERA] Байты изображения успешно преобразованы в numpy array.")
             return converted_image
         except Exception as e:
             print(f"[LOG CAMERA] Ошибка при преобразовании байтов в изображение: {e}")
             raise ValueError(f"Ошибка при преобразовании байтов в изображение: {e}")
 
+    def upload_to_numpy(self, stream, max_bytes=UPLOAD_MAX_BYTES, max_pixels=UPLOAD_MAX_PIXELS,
+                        target_side=UPLOAD_TARGET_SIDE):
+        """
+        Декодирует загруженный файл (JPEG/PNG) без промежуточных копий и с ранним уменьшением.
+
+        Аргументы:
+            stream: Поток файла (FileStorage.stream из Flask или любой файловый объект).
+            max_bytes (int): Максимальный размер файла.
+            max_pixels (int): Максимум ширина * высота.
+            target_side (int): Минимальная длинная сторона после уменьшения.
+
+        Возвращает:
+            numpy.ndarray: Изображение BGR. Бросает ValueError при неверном или слишком большом файле.
+        """
+        data = read_upload(stream, max_bytes)
+        try:
+            image = decode_upload(data, max_pixels, target_side)
+        finally:
+            data.release()  # Буфер BytesIO снова можно закрыть или изменить
+        print(f"[LOG CAMERA] Загруженное изображение декодировано: {image.shape[1]}x{image.shape[0]}.")
+        return image
+
     def generate_video_stream(self):
         """
         Генератор видеопотока в формате MJPEG.
@@ -136,6 +556,9 @@ class Camera:
         Возвращает:
             generator[bytes]: Генератор, возвращающий кадры в формате MJPEG (байты JPEG).
         """
+        if self.threaded:
+            yield from self._generate_shared_stream()
+            return
         try:
             print("[LOG CAMERA] Запуск видеопотока...")
             self.start()
@@ -145,7 +568,8 @@ class Camera:
                 frame_count += 1
                 if frame_count % 60 == 0:  # Логировать каждые 60 кадров
                     print(f"[LOG CAMERA] Обработано {frame_count} кадров.")
-                ret, buffer = cv2.imencode('.jpg', frame)
+                with timed('jpeg_encode'):
+                    ret, buffer = cv2.imencode('.jpg', frame)
                 if not ret:
                     print("[LOG CAMERA] Не удалось закодировать кадр в JPEG.")
                     continue
@@ -156,3 +580,32 @@ class Camera:
         finally:
             self.stop()
             print("[LOG CAMERA] Видеопоток завершён.")
+
+    def _generate_shared_stream(self):
+        """
+        Видеопоток в фоновом режиме: кадры берутся из общего буфера.
+        Камера не останавливается по окончании потока, так как ею пользуются другие клиенты.
+        """
+        try:
+            print("[LOG CAMERA] Запуск видеопотока из общего буфера...")
+            if not self.is_running:
+                self.start()
+            sequence = 0
+            while self.is_running:
+                latest = self.wait_for_frame(sequence)
+                if latest is None:
+                    continue
+                sequence, _, frame = latest
+                if sequence % 60 == 0:  # Логировать каждые 60 кадров
+                    print(f"[LOG CAMERA] Захвачено {sequence} кадров.")
+                with timed('jpeg_encode'):
+                    ret, buffer = cv2.imencode('.jpg', frame)
+                if not ret:
+                    print("[LOG CAMERA] Не удалось закодировать кадр в JPEG.")
+                    continue
+                yield (b'--frame\r\n'
+                       b'Content-Type: image/jpeg\r\n\r\n' + buffer.tobytes() + b'\r\n')
+        except Exception as e:
+            print(f"[LOG CAMERA] Ошибка во время видеопотока: {e}")
+        finally:
+            print("[LOG CAMERA] Видеопоток завершён.")
@@ -1,26 +1,240 @@
+import os
 import pickle
-from sqlalchemy import create_engine, Column, Integer, String, LargeBinary, inspect
+import sqlite3
+import threading
+from collections import OrderedDict
+from contextlib import contextmanager
+import cv2
+import numpy as np
+from sqlalchemy import create_engine, Column, Integer, String, LargeBinary, ForeignKey, inspect, text, event, select, bindparam
 from sqlalchemy.ext.declarative import declarative_base
 from sqlalchemy.orm import sessionmaker
+from metrics import timed
 
 Base = declarative_base()
 
+# Форматы хранения фото: расширение для cv2.imencode
+PHOTO_FORMATS = {'jpeg': '.jpg', 'png': '.png'}
+
 # Модель для пользователя
 class User(Base):
     __tablename__ = 'users'
     id = Column(Integer, primary_key=True, autoincrement=True)
     username = Column(String(50), unique=True, nullable=False)
-    embedding = Column(LargeBinary, nullable=False)  # Сериализованные данные эмбеддинга
-    photo = Column(LargeBinary, nullable=True)  # Сериализованное изображение в формате numpy array
+    embedding = Column(LargeBinary, nullable=False)  # Эмбеддинг в виде байтов float32
+    embedding_dim = Column(Integer, nullable=True)  # Размерность эмбеддинга (NULL у старых pickle-записей)
+    embedding_model = Column(String(50), nullable=True)  # Модель, которой получен эмбеддинг
+    # Старая колонка photo (pickle numpy array) больше не отображается в модель:
+    # при миграции фото переносятся в user_photos, а колонка обнуляется.
+
+
+# Модель для фото пользователя (отдельная таблица, чтобы списки пользователей не читали пиксели)
+class UserPhoto(Base):
+    __tablename__ = 'user_photos'
+    user_id = Column(Integer, ForeignKey('users.id'), primary_key=True)
+    format = Column(String(10), nullable=False)  # 'jpeg' или 'png'
+    data = Column(LargeBinary, nullable=False)  # Сжатое изображение
+
+
+def encode_embedding(embedding):
+    """
+    Сериализует эмбеддинг в байты float32 фиксированной ширины.
+    Возвращает:
+        tuple[bytes, int]: Байты эмбеддинга и его размерность.
+    """
+    vector = np.ascontiguousarray(embedding, dtype=np.float32).ravel()
+    return vector.tobytes(), int(vector.shape[0])
+
+
+def decode_embedding(data):
+    """Восстанавливает эмбеддинг float32 из байтов."""
+    return np.frombuffer(data, dtype=np.float32)
+
+
+def encode_photo(photo, photo_format='jpeg', quality=90):
+    """
+    Сжимает фото (RGB numpy array) в JPEG/PNG.
+    Аргументы:
+        photo (numpy.ndarray): Фото в формате RGB или оттенках серого.
+        photo_format (str): 'jpeg' или 'png'.
+        quality (int): Качество JPEG (0-100).
+    Возвращает:
+        bytes: Сжатое изображение.
+    """
+    if photo_format not in PHOTO_FORMATS:
+        raise ValueError(f"[ОШИБКА DB] Неподдерживаемый формат фото: {photo_format}")
+    image = np.asarray(photo)
+    if image.dtype != np.uint8:
+        image = np.clip(image, 0, 255).astype(np.uint8)
+    if image.ndim == 3 and image.shape[2] == 3:
+        image = cv2.cvtColor(image, cv2.COLOR_RGB2BGR)
+    params = [cv2.IMWRITE_JPEG_QUALITY, quality] if photo_format == 'jpeg' else []
+    ok, buffer = cv2.imencode(PHOTO_FORMATS[photo_format], image, params)
+    if not ok:
+        raise ValueError("[ОШИБКА DB] Не удалось сжать фото.")
+    return buffer.tobytes()
+
+
+def decode_photo(data):
+    """Распаковывает сжатое фото обратно в RGB numpy array."""
+    image = cv2.imdecode(np.frombuffer(data, dtype=np.uint8), cv2.IMREAD_COLOR)
+    if image is None:
+        return None
+    return cv2.cvtColor(image, cv2.COLOR_BGR2RGB)
+
+
+# Настройки SQLite для каждого нового соединения пула
+SQLITE_PRAGMAS = (
+    "PRAGMA journal_mode=WAL",  # Чтения не блокируются записью
+    "PRAGMA synchronous=NORMAL",  # В режиме WAL безопасно и без fsync на каждый коммит
+    "PRAGMA cache_size=-16000",  # 16 МБ страничного кэша на соединение
+    "PRAGMA temp_store=MEMORY",
+    "PRAGMA mmap_size=268435456",  # До 256 МБ файла читается через mmap
+    "PRAGMA busy_timeout=5000",  # Ждать блокировку до 5 секунд вместо ошибки
+)
+
+
+def create_sqlite_engine(db_url, pool_size=8, max_overflow=16):
+    """
+    Создаёт движок с пулом соединений, безопасным для потоков Flask.
+    Для файловой SQLite каждое соединение получает SQLITE_PRAGMAS.
+    """
+    if not db_url.startswith('sqlite'):
+        return create_engine(db_url, echo=False, pool_size=pool_size, max_overflow=max_overflow)
+    in_memory = db_url in ('sqlite://', 'sqlite:///:memory:')
+    if in_memory:
+        engine = create_engine(db_url, echo=False, connect_args={'check_same_thread': False})
+    else:
+        engine = create_engine(db_url, echo=False,  # echo=False для отключения логов SQL
+                               connect_args={'check_same_thread': False},
+                               pool_size=pool_size, max_overflow=max_overflow)
+
+    @event.listens_for(engine, "connect")
+    def _set_sqlite_pragmas(dbapi_connection, connection_record):
+        cursor = dbapi_connection.cursor()
+        for pragma in SQLITE_PRAGMAS:
+            if in_memory and 'journal_mode' in pragma:
+                continue
+            cursor.execute(pragma)
+        cursor.close()
+
+    return engine
 
 
 class Database:
-    def __init__(self, db_url='sqlite:///app.db'):
+    def __init__(self, db_url='sqlite:///app.db', photo_format='jpeg', photo_quality=90, embedding_cache_size=10000,
+                 embedding_store=None):
+        """
+        Аргументы:
+            db_url (str): URL базы SQLAlchemy.
+            photo_format (str): Формат хранения фото ('jpeg' или 'png').
+            photo_quality (int): Качество JPEG.
+            embedding_cache_size (int): Размер LRU-кэша эмбеддингов для входа.
+            embedding_store (EmbeddingStore): Хранилище эмбеддингов рядом с базой (см. embedding_store.py),
+                которое обновляется вместе с транзакциями; None — без хранилища.
+        """
         self.db_file = db_url.replace('sqlite:///', '')  # Извлекаем имя файла SQLite
-        self.engine = create_engine(db_url, echo=False)  # echo=False для отключения логов SQL
+        self.engine = create_sqlite_engine(db_url)
         self.Session = sessionmaker(bind=self.engine)
+        self.photo_format = photo_format
+        self.photo_quality = photo_quality
+        self._subscribers = []  # Индексы, которые нужно обновлять при изменениях
+        # Кэш эмбеддингов для входа: username -> эмбеддинг (LRU). Изменения из других процессов
+        # замечаются по PRAGMA data_version, поэтому кэш работает только с файловой SQLite
+        # (для других СУБД он выключен, база в памяти доступна одному процессу).
+        self._sqlite_file = db_url.startswith('sqlite') and db_url not in ('sqlite://', 'sqlite:///:memory:')
+        self.embedding_cache_size = embedding_cache_size if db_url.startswith('sqlite') else 0
+        self._embedding_cache = OrderedDict()
+        self._embedding_cache_lock = threading.Lock()
+        self._embedding_generation = 0  # Растёт при каждом сбросе: загрузка, начатая раньше, не попадает в кэш
+        self._data_version = None
+        self._version_conn = None  # Отдельное соединение для PRAGMA data_version (открывается в каждом процессе)
+        self._version_pid = None
+        # Запрос только колонки эмбеддинга по индексу username (уникальный ключ создаёт индекс)
+        self._embedding_query = select(User.embedding).where(User.username == bindparam('username'))
+        self.embedding_store = embedding_store
 
         self._initialize_database()
+        if embedding_store is not None:
+            self._sync_embedding_store()
+
+    def subscribe(self, subscriber):
+        """
+        Подписывает объект на изменения пользователей.
+        Аргументы:
+            subscriber: Объект с методами add(username, embedding) и remove(username).
+        """
+        self._subscribers.append(subscriber)
+
+    def _invalidate_embedding(self, username):
+        """Удаляет эмбеддинг пользователя из кэша после изменения записи."""
+        with self._embedding_cache_lock:
+            self._embedding_cache.pop(username, None)
+            self._embedding_generation += 1
+
+    def _check_data_version(self):
+        """
+        Сбрасывает кэш эмбеддингов, если базу закоммитило другое соединение, в том числе другой процесс
+        (например, main.py delete-user). Вызывается под блокировкой кэша.
+        """
+        if not self._sqlite_file:
+            return
+        try:
+            # Соединение SQLite нельзя переносить через fork: у каждого процесса своё
+            if self._version_conn is None or self._version_pid != os.getpid():
+                self._version_conn = sqlite3.connect(self.db_file, check_same_thread=False)
+                self._version_pid = os.getpid()
+            version = self._version_conn.execute("PRAGMA data_version").fetchone()[0]
+        except sqlite3.Error as e:
+            print(f"[ОШИБКА DB] Не удалось проверить версию базы, кэш эмбеддингов сброшен: {e}")
+            version = None
+        if version is None or version != self._data_version:
+            self._embedding_cache.clear()
+            self._embedding_generation += 1
+            self._data_version = version
+
+    def _notify(self, method, *args):
+        """Передаёт изменение всем подписчикам, не прерывая работу при их ошибках."""
+        for subscriber in self._subscribers:
+            try:
+                getattr(subscriber, method)(*args)
+            except Exception as e:
+                print(f"[ОШИБКА DB] Подписчик {type(subscriber).__name__} не обработал '{method}': {e}")
+
+    @contextmanager
+    def _store_transaction(self):
+        """Транзакция хранилища эмбеддингов или None, если хранилище не подключено."""
+        if self.embedding_store is None:
+            yield None
+            return
+        with self.embedding_store.transaction() as store:
+            yield store
+
+    def _sync_embedding_store(self):
+        """Сверяет хранилище эмбеддингов с таблицей users и пересобирает его при расхождении."""
+        with self.engine.connect() as conn:
+            total, max_id = conn.execute(text("SELECT COUNT(*), MAX(id) FROM users")).one()
+        if self.embedding_store.summary() != (total, max_id):
+            print("[LOG DB] Хранилище эмбеддингов расходится с базой. Пересобираем...")
+            self.rebuild_embedding_store()
+
+    @timed('db_query')
+    def rebuild_embedding_store(self, store=None):
+        """
+        Пересобирает хранилище эмбеддингов по таблице users.
+        Аргументы:
+            store (EmbeddingStore): Хранилище; по умолчанию подключённое к базе.
+        """
+        store = store if store is not None else self.embedding_store
+        with self.engine.connect() as conn:
+            rows = conn.execute(select(User.id, User.username, User.embedding, User.embedding_dim)).fetchall()
+        dim = rows[0].embedding_dim if rows else store.dim
+        skipped = [row.username for row in rows if row.embedding_dim != dim]
+        if skipped:
+            print(f"[ОШИБКА DB] Пропущены эмбеддинги другой размерности: {skipped}")
+            rows = [row for row in rows if row.embedding_dim == dim]
+        embeddings = np.frombuffer(b"".join(row.embedding for row in rows), dtype=np.float32).reshape(len(rows), dim)
+        store.rebuild([row.id for row in rows], [row.username for row in rows], embeddings)
 
     def _initialize_database(self):
         """Проверяет наличие базы данных и создаёт таблицы, если нужно."""
@@ -30,31 +244,90 @@ class Database:
             Base.metadata.create_all(self.engine)
             print("[LOG DB] База данных и таблицы успешно созданы.")
         else:
+            Base.metadata.create_all(self.engine)  # Создаёт только недостающие таблицы (user_photos)
+            self._migrate_legacy_rows(inspector)
             print("[LOG DB] Таблицы уже существуют. Инициализация завершена.")
 
-    def add_user(self, username, embedding=None, photo=None):
+    def _migrate_legacy_rows(self, inspector, batch_size=200):
+        """
+        Переводит старые записи (pickle эмбеддинга и фото) в компактный формат.
+        Эмбеддинги переписываются байтами float32, фото сжимаются и переносятся в user_photos.
+        """
+        columns = {column['name'] for column in inspector.get_columns(User.__tablename__)}
+        with self.engine.begin() as conn:
+            if 'embedding_dim' not in columns:
+                conn.execute(text("ALTER TABLE users ADD COLUMN embedding_dim INTEGER"))
+            if 'embedding_model' not in columns:
+                conn.execute(text("ALTER TABLE users ADD COLUMN embedding_model VARCHAR(50)"))
+        has_legacy_photo = 'photo' in columns
+
+        migrated = 0
+        while True:
+            with self.engine.begin() as conn:
+                photo_column = "photo" if has_legacy_photo else "NULL AS photo"
+                rows = conn.execute(
+                    text(f"SELECT id, embedding, {photo_column} FROM users WHERE embedding_dim IS NULL LIMIT :limit"),
+                    {"limit": batch_size},
+                ).fetchall()
+                if not rows:
+                    break
+                for row in rows:
+                    data, dim = encode_embedding(pickle.loads(row.embedding))
+                    conn.execute(
+                        text("UPDATE users SET embedding = :data, embedding_dim = :dim WHERE id = :id"),
+                        {"data": data, "dim": dim, "id": row.id},
+                    )
+                    if row.photo is not None:
+                        photo = pickle.loads(row.photo)
+                        if photo is not None:
+                            conn.execute(
+                                UserPhoto.__table__.insert().prefix_with("OR REPLACE"),
+                                {"user_id": row.id, "format": self.photo_format,
+                                 "data": encode_photo(photo, self.photo_format, self.photo_quality)},
+                            )
+                        conn.execute(text("UPDATE users SET photo = NULL WHERE id = :id"), {"id": row.id})
+                migrated += len(rows)
+
+        if migrated:
+            print(f"[LOG DB] Перенесено в компактный формат записей: {migrated}. Сжимаем файл базы...")
+            with self.engine.connect().execution_options(isolation_level="AUTOCOMMIT") as conn:
+                conn.execute(text("VACUUM"))
+
+    @timed('db_commit')
+    def add_user(self, username, embedding=None, photo=None, model_name='Facenet'):
         """
         Добавление нового пользователя с фото.
         Аргументы:
             username (str): Имя пользователя.
             embedding (list/array): Эмбеддинг лица.
-            photo (numpy.ndarray): Фото пользователя в формате numpy array.
+            photo (numpy.ndarray/bytes): Фото пользователя в формате numpy array (RGB)
+                или байты, уже сжатые в photo_format.
+            model_name (str): Модель, которой получен эмбеддинг.
         """
         if embedding is None:
             raise ValueError("[ОШИБКА DB] Эмбеддинг обязателен для добавления пользователя.")
 
         # Сериализация эмбеддинга
-        serialized_embedding = pickle.dumps(embedding)
+        serialized_embedding, dim = encode_embedding(embedding)
 
-        # Сериализация фото
-        serialized_photo = pickle.dumps(photo) if photo is not None else None
+        # Сжатие фото
+        compressed_photo = self._photo_bytes(photo)
 
         session = self.Session()
         try:
-            user = User(username=username, embedding=serialized_embedding, photo=serialized_photo)
-            session.add(user)
-            session.commit()
+            with self._store_transaction() as store:
+                user = User(username=username, embedding=serialized_embedding,
+                            embedding_dim=dim, embedding_model=model_name)
+                session.add(user)
+                session.flush()  # Получаем user.id для записи фото и хранилища эмбеддингов
+                if compressed_photo is not None:
+                    session.add(UserPhoto(user_id=user.id, format=self.photo_format, data=compressed_photo))
+                if store is not None:
+                    store.stage_add(user.id, username, embedding)
+                session.commit()
+            self._invalidate_embedding(username)
             print(f"[LOG DB] Пользователь '{username}' успешно добавлен.")
+            self._notify("add", username, embedding)
         except Exception as e:
             session.rollback()
             print(f"[ОШИБКА DB] Не удалось добавить пользователя '{username}': {e}")
@@ -63,21 +336,141 @@ class Database:
             session.close()
         return True
 
-    def get_user_data(self, username):
+    def _photo_bytes(self, photo):
+        """Сжимает фото; уже закодированные байты (в формате photo_format) сохраняются как есть."""
+        if photo is None:
+            return None
+        if isinstance(photo, (bytes, bytearray, memoryview)):
+            return bytes(photo)
+        return encode_photo(photo, self.photo_format, self.photo_quality)
+
+    @timed('db_commit')
+    def add_users(self, records, model_name='Facenet'):
+        """
+        Пакетное добавление пользователей одной транзакцией.
+        Если транзакция не прошла (например, одно имя уже занято), пользователи добавляются по одному,
+        чтобы ошибка одной записи не отменяла остальные.
+        Аргументы:
+            records (list[dict]): Записи с ключами username, embedding и необязательным photo
+                (numpy array или байты, уже сжатые в photo_format).
+            model_name (str): Модель, которой получены эмбеддинги.
+        Возвращает:
+            int: Количество добавленных пользователей.
+        """
+        if not records:
+            return 0
+        session = self.Session()
+        try:
+            with self._store_transaction() as store:
+                for record in records:
+                    serialized_embedding, dim = encode_embedding(record["embedding"])
+                    user = User(username=record["username"], embedding=serialized_embedding,
+                                embedding_dim=dim, embedding_model=model_name)
+                    session.add(user)
+                    compressed_photo = self._photo_bytes(record.get("photo"))
+                    if compressed_photo is not None or store is not None:
+                        session.flush()
+                    if compressed_photo is not None:
+                        session.add(UserPhoto(user_id=user.id, format=self.photo_format, data=compressed_photo))
+                    if store is not None:
+                        store.stage_add(user.id, record["username"], record["embedding"])
+                session.commit()
+            for record in records:
+                self._invalidate_embedding(record["username"])
+            print(f"[LOG DB] Пакетно добавлено пользователей: {len(records)}.")
+        except Exception as e:
+            session.rollback()
+            print(f"[ОШИБКА DB] Пакетное добавление не удалось ({e}). Добавляем пользователей по одному...")
+            return sum(bool(self.add_user(record["username"], embedding=record["embedding"],
+                                          photo=record.get("photo"), model_name=model_name))
+                       for record in records)
+        finally:
+            session.close()
+        for record in records:
+            self._notify("add", record["username"], record["embedding"])
+        return len(records)
+
+    @timed('db_query')
+    def get_usernames(self):
+        """
+        Возвращает имена всех пользователей.
+        Возвращает:
+            set[str]: Множество имён пользователей.
+        """
+        session = self.Session()
+        try:
+            return {row.username for row in session.query(User.username)}
+        except Exception as e:
+            print(f"[ОШИБКА DB] Не удалось получить имена пользователей: {e}")
+            return set()
+        finally:
+            session.close()
+
+    def get_user_embedding(self, username):
+        """
+        Быстрое получение только эмбеддинга пользователя (для входа по лицу).
+        Сначала проверяется кэш, при промахе читается одна колонка по индексу username.
+        Кэш сбрасывается, если база изменилась после прошлой проверки (см. _check_data_version).
+        Аргументы:
+            username (str): Имя пользователя.
+        Возвращает:
+            numpy.ndarray: Эмбеддинг float32 или None, если пользователь не найден.
+        """
+        if self.embedding_cache_size <= 0:
+            return self._load_user_embedding(username)
+        with self._embedding_cache_lock:
+            self._check_data_version()
+            embedding = self._embedding_cache.get(username)
+            if embedding is not None:
+                self._embedding_cache.move_to_end(username)
+                return embedding
+            generation = self._embedding_generation
+        embedding = self._load_user_embedding(username)
+        if embedding is not None:
+            with self._embedding_cache_lock:
+                self._check_data_version()
+                # Если за время чтения запись изменили или удалили, прочитанное значение могло устареть
+                if generation == self._embedding_generation:
+                    self._embedding_cache[username] = embedding
+                    while len(self._embedding_cache) > self.embedding_cache_size:
+                        self._embedding_cache.popitem(last=False)
+        return embedding
+
+    @timed('db_query')
+    def _load_user_embedding(self, username):
+        """Читает эмбеддинг из базы без ORM-сессии и без загрузки остальных колонок."""
+        try:
+            with self.engine.connect() as conn:
+                data = conn.execute(self._embedding_query, {"username": username}).scalar()
+            if data is None:
+                print(f"[LOG DB] Пользователь '{username}' не найден.")
+                return None
+            return decode_embedding(data)
+        except Exception as e:
+            print(f"[ОШИБКА DB] Не удалось получить эмбеддинг пользователя '{username}': {e}")
+            return None
+
+    @timed('db_query')
+    def get_user_data(self, username, include_photo=True):
         """
         Получение данных пользователя.
         Аргументы:
             username (str): Имя пользователя.
+            include_photo (bool): Загружать ли фото (отдельный запрос к user_photos).
         Возвращает:
-            dict: Содержит username, десериализованный эмбеддинг и фото (numpy array).
+            dict: Содержит username, эмбеддинг (numpy float32) и фото (numpy array или None).
         """
         session = self.Session()
         try:
-            user = session.query(User).filter_by(username=username).first()
+            user = session.query(User.id, User.username, User.embedding, User.embedding_model) \
+                .filter_by(username=username).first()
             if user:
-                embedding = pickle.loads(user.embedding) if user.embedding else None
-                photo = pickle.loads(user.photo) if user.photo else None
-                return {"username": user.username, "embedding": embedding, "photo": photo}
+                photo = None
+                if include_photo:
+                    record = session.query(UserPhoto.data).filter_by(user_id=user.id).first()
+                    photo = decode_photo(record.data) if record else None
+                return {"username": user.username, "embedding": decode_embedding(user.embedding),
+                        "model": user.embedding_model, "photo": photo}
             else:
                 print(f"[LOG DB] Пользователь '{username}' не найден.")
                 return None
@@ -86,22 +479,48 @@ class Database:
         finally:
             session.close()
 
-    def get_all_users(self):
+    @timed('db_query')
+    def get_user_photo(self, username):
+        """
+        Загружает только фото пользователя.
+        Возвращает:
+            numpy.ndarray: Фото (RGB) или None, если фото нет.
+        """
+        session = self.Session()
+        try:
+            record = session.query(UserPhoto.data).join(User, User.id == UserPhoto.user_id) \
+                .filter(User.username == username).first()
+            return decode_photo(record.data) if record else None
+        except Exception as e:
+            print(f"[ОШИБКА DB] Не удалось получить фото пользователя '{username}': {e}")
+            return None
+        finally:
+            session.close()
+
+    @timed('db_query')
+    def get_all_users(self, include_photos=False):
         """
         Возвращает всех пользователей в виде списка словарей.
+        Аргументы:
+            include_photos (bool): Загружать ли фото. По умолчанию фото не читаются.
         Возвращает:
             list[dict]: Список пользователей с их данными.
         """
         session = self.Session()
         try:
-            users = session.query(User).all()
+            users = session.query(User.id, User.username, User.embedding, User.embedding_model).all()
+            photos = {}
+            if include_photos:
+                photos = {record.user_id: record.data for record in session.query(UserPhoto.user_id, UserPhoto.data)}
             user_data_list = []
             for user in users:
+                photo = photos.get(user.id)
                 user_data_list.append({
                     "id": user.id,
                     "username": user.username,
-                    "embedding": pickle.loads(user.embedding) if user.embedding else None,
-                    "photo": pickle.loads(user.photo) if user.photo else None
+                    "embedding": decode_embedding(user.embedding),
+                    "model": user.embedding_model,
+                    "photo": decode_photo(photo) if photo is not None else None
                 })
             return user_data_list
         except Exception as e:
@@ -110,6 +529,37 @@ class Database:
         finally:
             session.close()
 
+    @timed('db_query')
+    def get_all_embeddings(self):
+        """
+        Возвращает эмбеддинги всех пользователей без загрузки фото.
+        Если подключено хранилище эмбеддингов, матрица читается из него (memmap) без запроса к базе.
+        Возвращает:
+            tuple[list[str], numpy.ndarray]: Имена пользователей и матрица эмбеддингов float32.
+        """
+        if self.embedding_store is not None and not self.embedding_store.stale:
+            return self.embedding_store.snapshot()
+        session = self.Session()
+        try:
+            rows = session.query(User.username, User.embedding, User.embedding_dim).all()
+            if not rows:
+                return [], np.empty((0, 0), dtype=np.float32)
+            dim = rows[0].embedding_dim
+            skipped = [row.username for row in rows if row.embedding_dim != dim]
+            if skipped:
+                print(f"[ОШИБКА DB] Пропущены эмбеддинги другой размерности: {skipped}")
+                rows = [row for row in rows if row.embedding_dim == dim]
+            usernames = [row.username for row in rows]
+            # Одна склейка байтов и один frombuffer вместо десериализации каждой строки
+            embeddings = np.frombuffer(b"".join(row.embedding for row in rows), dtype=np.float32)
+            return usernames, embeddings.reshape(len(rows), dim)
+        except Exception as e:
+            print(f"[ОШИБКА DB] Не удалось получить эмбеддинги пользователей: {e}")
+            return [], np.empty((0, 0), dtype=np.float32)
+        finally:
+            session.close()
+
+    @timed('db_commit')
     def delete_user(self, username):
         """
         Удаление пользователя по имени.
@@ -124,9 +574,15 @@ class Database:
             if not user:
                 print(f"[LOG DB] Пользователь '{username}' не найден.")
                 return False
-            session.delete(user)
-            session.commit()
+            with self._store_transaction() as store:
+                session.query(UserPhoto).filter_by(user_id=user.id).delete()
+                session.delete(user)
+                if store is not None:
+                    store.stage_remove(username)
+                session.commit()
+            self._invalidate_embedding(username)
             print(f"[LOG DB] Пользователь '{username}' успешно удалён.")
+            self._notify("remove", username)
             return True
         except Exception as e:
             session.rollback()
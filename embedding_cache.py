@@ -0,0 +1,155 @@
+import hashlib
+import json
+import os
+import threading
+from collections import OrderedDict
+
+import numpy as np
+
+
+class EmbeddingCache:
+    def __init__(self, max_entries=10000, path=None):
+        """
+        Кэш эмбеддингов с адресацией по содержимому изображения и вытеснением LRU.
+
+        Ключ — хэш пикселей декодированного изображения вместе с настройками модели,
+        поэтому одно и то же фото, пришедшее повторно (или тем же файлом), не гоняется через сеть.
+
+        Аргументы:
+            max_entries (int): Максимальное число эмбеддингов в памяти.
+            path (str): Файл .npz для сохранения кэша на диск; None — только в памяти.
+        """
+        self.max_entries = max_entries
+        self.path = path
+        self._entries = OrderedDict()  # ключ -> эмбеддинг (numpy float32)
+        self._meta = {}  # ключ -> сведения о результате (например, рамка лица), если они сохранены
+        self._lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+        if path and os.path.exists(path):
+            self.load()
+        print(f"[LOG CACHE] Кэш эмбеддингов создан (записей: {len(self._entries)}, максимум: {max_entries}).")
+
+    def __len__(self):
+        return len(self._entries)
+
+    @staticmethod
+    def key(pixels, settings):
+        """
+        Вычисляет ключ кэша.
+
+        Аргументы:
+            pixels (numpy.ndarray): Декодированное изображение.
+            settings (str): Модель, детектор и режим обработки.
+
+        Возвращает:
+            str: Шестнадцатеричный хэш.
+        """
+        pixels = np.ascontiguousarray(pixels)
+        digest = hashlib.blake2b(digest_size=16)
+        digest.update(f"{settings}|{pixels.shape}|{pixels.dtype}".encode())
+        digest.update(memoryview(pixels).cast('B'))
+        return digest.hexdigest()
+
+    def get(self, key):
+        """Возвращает эмбеддинг по ключу или None и обновляет счётчики."""
+        return self.get_entry(key)[0]
+
+    def get_entry(self, key):
+        """
+        Возвращает:
+            tuple: Эмбеддинг и сведения, сохранённые вместе с ним (dict или None); (None, None) при промахе.
+        """
+        with self._lock:
+            embedding = self._entries.get(key)
+            if embedding is None:
+                self.misses += 1
+                return None, None
+            self._entries.move_to_end(key)
+            self.hits += 1
+            meta = self._meta.get(key)
+            return embedding, (dict(meta) if meta is not None else None)
+
+    def put(self, key, embedding, meta=None):
+        """
+        Сохраняет эмбеддинг, вытесняя давно не использованные записи.
+        - meta: dict со сведениями о результате (сериализуется в JSON при save).
+        """
+        with self._lock:
+            self._entries[key] = np.asarray(embedding, dtype=np.float32)
+            self._entries.move_to_end(key)
+            if meta is not None:
+                self._meta[key] = dict(meta)
+            else:
+                self._meta.pop(key, None)
+            while len(self._entries) > self.max_entries:
+                evicted, _ = self._entries.popitem(last=False)
+                self._meta.pop(evicted, None)
+                self.evictions += 1
+
+    def clear(self):
+        with self._lock:
+            self._entries.clear()
+            self._meta.clear()
+
+    def stats(self):
+        """
+        Возвращает:
+            dict: Размер кэша, попадания, промахи, вытеснения и доля попаданий.
+        """
+        with self._lock:
+            total = self.hits + self.misses
+            return {
+                "entries": len(self._entries),
+                "hits": self.hits,
+                "misses": self.misses,
+                "evictions": self.evictions,
+                "hit_rate": self.hits / total if total else 0.0,
+            }
+
+    def save(self, path=None):
+        """Сохраняет кэш на диск (атомарно через временный файл)."""
+        path = path or self.path
+        if not path:
+            raise ValueError("[ОШИБКА CACHE] Не указан файл для сохранения кэша.")
+        with self._lock:
+            keys = list(self._entries.keys())
+            values = list(self._entries.values())
+            meta = [self._meta.get(key) for key in keys]
+        try:
+            embeddings = np.stack(values) if values else np.empty((0, 0), dtype=np.float32)
+        except ValueError as e:
+            print(f"[ОШИБКА CACHE] Эмбеддинги разной размерности нельзя сохранить в один файл: {e}")
+            return False
+        tmp_path = f"{path}.tmp"
+        with open(tmp_path, 'wb') as f:
+            np.savez(f, keys=np.array(keys, dtype='U32'), embeddings=embeddings,
+                     meta=np.array([json.dumps(item, default=_json_default) if item is not None else ''
+                                    for item in meta], dtype=str))
+        os.replace(tmp_path, path)
+        print(f"[LOG CACHE] Кэш сохранён в {path} (записей: {len(keys)}).")
+        return True
+
+    def load(self, path=None):
+        """Загружает кэш с диска; самые старые записи сверх max_entries отбрасываются."""
+        path = path or self.path
+        try:
+            with np.load(path) as data:
+                keys, embeddings = data["keys"], data["embeddings"]
+                # Файлы старого формата сохраняли только эмбеддинги
+                meta = data["meta"] if "meta" in data.files else [''] * len(keys)
+        except Exception as e:
+            print(f"[ОШИБКА CACHE] Не удалось загрузить кэш из {path}: {e}")
+            return False
+        for key, embedding, item in zip(keys, embeddings, meta):
+            self.put(str(key), embedding, json.loads(str(item)) if str(item) else None)
+        print(f"[LOG CACHE] Кэш загружен из {path} (записей: {len(self._entries)}).")
+        return True
+
+
+def _json_default(value):
+    """Числа и массивы NumPy в сведениях записи сохраняются как обычные числа и списки."""
+    if hasattr(value, 'tolist'):
+        return value.tolist()
+    raise TypeError(f"Object of type {type(value).__name__} is not JSON serializable")
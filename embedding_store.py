@@ -0,0 +1,225 @@
+"""
+Хранилище эмбеддингов рядом с app.db, отображаемое в память.
+
+Каталог хранилища (по умолчанию app.db.store):
+    embeddings.npy — матрица эмбеддингов (capacity, dim) float32;
+    ids.npy        — id пользователя в SQLite для каждой строки (capacity,) int64, 0 — строка удалена;
+    usernames.txt  — имя пользователя строки (по одному в строке файла, только дописывается);
+    meta.json      — dim, capacity, число строк и удалений, размер usernames.txt, версия и поколение.
+
+Файлы открываются через np.memmap, поэтому все процессы сервера разделяют одни и те же страницы,
+а загрузка галереи не требует запроса к базе и десериализации строк.
+
+Запись идёт вместе с транзакцией SQLite (см. Database.add_user / delete_user):
+строки пишутся в свободные слоты до коммита базы, а становятся видимыми только после
+записи meta.json — уже после коммита. При ошибке коммита слоты просто переиспользуются.
+Публикация и блокировка записи между процессами — общие с ann_index.py (см. shared_directory.py).
+
+Пересборка по базе:
+    python embedding_store.py rebuild --db-url sqlite:///app.db
+"""
+import argparse
+import os
+import time
+from contextlib import contextmanager
+
+import numpy as np
+
+from metrics import timed
+from shared_directory import SharedDirectory, file_lock, install, write_usernames
+
+
+class EmbeddingStore(SharedDirectory):
+    def __init__(self, path='app.db.store', dim=128, capacity=1024):
+        """
+        Открывает хранилище (или создаёт пустое).
+
+        Аргументы:
+            path (str): Каталог хранилища.
+            dim (int): Размерность эмбеддинга для нового хранилища.
+            capacity (int): Начальная ёмкость нового хранилища (число строк).
+        """
+        super().__init__(path)
+        self.stale = False  # True, если запись в хранилище не удалась и оно отстаёт от базы
+        self._pending_rows = []  # Имена строк, записанных в слоты после count, но ещё не опубликованных
+        self._pending_removed = []
+        os.makedirs(path, exist_ok=True)
+        with file_lock(path):
+            if not os.path.exists(self._file('meta.json')):
+                self._create(dim, capacity)
+        self._open()
+        print(f"[LOG STORE] Хранилище эмбеддингов открыто: {len(self._positions)} записей.")
+
+    def _create(self, dim, capacity, user_ids=(), usernames=(), embeddings=None):
+        """Записывает новые файлы хранилища (через временные файлы) и публикует их (под file_lock)."""
+        count = len(usernames)
+        for name, dtype, shape, data in (('embeddings.npy', np.float32, (capacity, dim), embeddings),
+                                         ('ids.npy', np.int64, (capacity,), user_ids)):
+            array = np.lib.format.open_memmap(self._file(name + '.tmp'), mode='w+', dtype=dtype, shape=shape)
+            if count:
+                array[:count] = data
+            array.flush()
+            del array
+        usernames_size = write_usernames(self.path, usernames)
+        install(self.path, ('embeddings.npy', 'ids.npy', 'usernames.txt'),
+                dim=dim, capacity=capacity, count=count, usernames_size=usernames_size)
+
+    def _open_arrays(self, meta):
+        self._embeddings = np.load(self._file('embeddings.npy'), mmap_mode='r+')
+        self._ids = np.load(self._file('ids.npy'), mmap_mode='r+')
+
+    def _capacity(self):
+        return len(self._ids)
+
+    def _index_rows(self):
+        """Словарь username -> строка по живым строкам ids.npy."""
+        live = np.flatnonzero(np.asarray(self._ids[:self.count]) > 0)
+        self._positions = {self._usernames[row]: int(row) for row in live}
+
+    def _index_added(self, first, added):
+        for row, username in enumerate(added, start=first):
+            if self._ids[row] > 0:
+                self._positions[username] = row
+
+    def state(self):
+        """
+        Возвращает:
+            tuple[int, int]: Поколение и версия хранилища после refresh; меняются при каждой публикации
+            в любом процессе, поэтому по ним копии галереи в памяти узнают, что пора перечитать хранилище.
+        """
+        with self._lock:
+            self.refresh()
+            return self._generation, self._version
+
+    def summary(self):
+        """
+        Возвращает:
+            tuple[int, int | None]: Число живых записей и максимальный id пользователя
+            (для сверки с таблицей users).
+        """
+        with self._lock:
+            self.refresh()
+            ids = np.asarray(self._ids[:self.count])
+        ids = ids[ids > 0]
+        return len(ids), (int(ids.max()) if len(ids) else None)
+
+    @contextmanager
+    def transaction(self):
+        """
+        Транзакция записи; внутри неё вызываются stage_add / stage_remove и коммит базы.
+
+        Изменения публикуются при выходе из блока без исключения и отбрасываются при исключении.
+        Между процессами запись сериализуется блокировкой файла lock.
+        """
+        with self._write_lock():
+            self._pending_rows, self._pending_removed = [], []
+            try:
+                yield self
+            except BaseException:
+                self._pending_rows, self._pending_removed = [], []
+                raise
+            try:
+                self._commit_pending()
+            except Exception as e:
+                # База уже закоммичена: хранилище помечается устаревшим до пересборки
+                self.stale = True
+                print(f"[ОШИБКА STORE] Не удалось записать изменения, требуется пересборка: {e}")
+
+    def stage_add(self, user_id, username, embedding):
+        """Записывает эмбеддинг в свободный слот; строка станет видимой после публикации."""
+        vector = np.asarray(embedding, dtype=np.float32).ravel()
+        if vector.shape[0] != self.dim:
+            raise ValueError(f"[ОШИБКА STORE] Ожидался эмбеддинг размерности {self.dim}, получено {vector.shape[0]}.")
+        row = self.count + len(self._pending_rows)
+        if row >= self._capacity():
+            self._grow_arrays([('_embeddings', 'embeddings.npy', 0), ('_ids', 'ids.npy', 0)])
+        self._embeddings[row] = vector
+        self._ids[row] = user_id
+        if username in self._positions:
+            self._pending_removed.append(username)
+        self._pending_rows.append(username)
+
+    def stage_remove(self, username):
+        """Отмечает запись пользователя к удалению при публикации."""
+        if username in self._positions:
+            self._pending_removed.append(username)
+
+    def _commit_pending(self):
+        """Делает записанные строки и удаления видимыми: данные на диск, затем meta.json."""
+        if not self._pending_rows and not self._pending_removed:
+            return
+        for username in self._pending_removed:
+            row = self._positions.pop(username, None)
+            if row is not None:
+                self._ids[row] = 0
+                self._removed += 1
+        self._embeddings.flush()
+        self._ids.flush()
+        first = self.count
+        self._append_usernames(self._pending_rows)
+        for offset, username in enumerate(self._pending_rows):
+            self._positions[username] = first + offset
+        self._publish()
+        self._pending_rows, self._pending_removed = [], []
+
+    def rebuild(self, user_ids, usernames, embeddings):
+        """
+        Переписывает хранилище целиком.
+
+        Аргументы:
+            user_ids (list[int]): id пользователей в SQLite.
+            usernames (list[str]): Имена пользователей.
+            embeddings (array): Эмбеддинги (n, dim).
+        """
+        embeddings = np.asarray(embeddings, dtype=np.float32)
+        dim = embeddings.shape[1] if len(usernames) else self.dim
+        start = time.perf_counter()
+        # Без refresh: пересборка должна работать и по повреждённому хранилищу
+        with self._lock, file_lock(self.path):
+            self._embeddings = self._ids = None
+            self._create(dim, max(2 * len(usernames), 1024), user_ids, usernames, embeddings)
+            self._open()
+            self.stale = False
+        print(f"[LOG STORE] Хранилище пересобрано за {time.perf_counter() - start:.2f}s: {len(usernames)} записей.")
+
+    @timed('store_load')
+    def snapshot(self):
+        """
+        Все живые записи хранилища.
+
+        Возвращает:
+            tuple[list[str], numpy.ndarray]: Имена пользователей и матрица эмбеддингов float32.
+            Без удалённых строк матрица — срез memmap без копирования.
+        """
+        with self._lock:
+            self.refresh()
+            count = self.count
+            usernames = self._usernames[:count]
+            ids = np.asarray(self._ids[:count])
+            embeddings = self._embeddings
+        live = ids > 0
+        if live.all():
+            return list(usernames), embeddings[:count]
+        rows = np.flatnonzero(live)
+        return [usernames[row] for row in rows], embeddings[rows]
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Хранилище эмбеддингов рядом с базой.")
+    parser.add_argument("command", choices=["rebuild", "info"])
+    parser.add_argument("--db-url", default="sqlite:///app.db")
+    parser.add_argument("--path", default=None, help="Каталог хранилища (по умолчанию <файл базы>.store).")
+    args = parser.parse_args()
+
+    from db import Database
+    path = args.path or args.db_url.replace('sqlite:///', '') + '.store'
+    store = EmbeddingStore(path)
+    if args.command == "rebuild":
+        Database(args.db_url).rebuild_embedding_store(store)
+    else:
+        live, max_id = store.summary()
+        print(f"[RESULT] {path}: записей {live}, размерность {store.dim}, максимальный id {max_id}")
+
+
+if __name__ == "__main__":
+    main()
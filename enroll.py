@@ -0,0 +1,197 @@
+"""
+Массовая регистрация пользователей из каталога с фотографиями.
+
+Раскладка каталога:
+    photos/ivan.jpeg          -> пользователь 'ivan'
+    photos/maria/1.jpg, 2.jpg -> пользователь 'maria' (берётся первое фото, на котором найдено лицо)
+
+Пользователи добавляются в базу вместе с хранилищем эмбеддингов и, если он построен, в приближённый
+индекс (IVF): работающие воркеры сервера подхватывают их без перезапуска.
+
+Запуск:
+    python enroll.py photos --workers 4 --batch-size 32 --commit-size 500
+"""
+import argparse
+import os
+import time
+from concurrent.futures import ProcessPoolExecutor, as_completed
+
+import cv2
+
+from db import Database, encode_photo
+from embedding_store import EmbeddingStore
+from main import ANN_INDEX_PATH, EMBEDDING_STORE_PATH
+
+IMAGE_EXTENSIONS = {'.jpg', '.jpeg', '.png', '.bmp', '.webp'}
+
+# FaceAuth процесса-воркера (создаётся один раз в _init_worker)
+_face_auth = None
+
+
+def collect_images(directory):
+    """
+    Собирает фото из каталога.
+    Возвращает:
+        dict[str, list[str]]: username -> пути к его фотографиям.
+    """
+    users = {}
+    for entry in sorted(os.listdir(directory)):
+        path = os.path.join(directory, entry)
+        if os.path.isdir(path):
+            images = [os.path.join(path, name) for name in sorted(os.listdir(path))
+                      if os.path.splitext(name)[1].lower() in IMAGE_EXTENSIONS]
+            if images:
+                users[entry] = images
+        elif os.path.splitext(entry)[1].lower() in IMAGE_EXTENSIONS:
+            users.setdefault(os.path.splitext(entry)[0], []).append(path)
+    return users
+
+
+def _init_worker(model_name, detector_backend):
+    """Загружает модели один раз на процесс-воркер."""
+    global _face_auth
+    from face_auth import FaceAuth
+    _face_auth = FaceAuth(model_name=model_name, detector_backend=detector_backend)
+    _face_auth.load_models()
+
+
+def _embed_chunk(chunk, batch_size, photo_format, photo_quality):
+    """
+    Декодирует и обрабатывает группу пользователей в процессе-воркере.
+    Аргументы:
+        chunk (list[tuple[str, list[str]]]): Пары (username, пути к фото).
+    Возвращает:
+        tuple[list[dict], dict, int]: Записи для Database.add_users, ошибки {username: текст}
+        и число обработанных изображений.
+    """
+    items, images, failures = [], [], {}
+    for username, paths in chunk:
+        for path in paths:
+            image = cv2.imread(path)  # BGR, как ожидает DeepFace
+            if image is None:
+                failures[username] = f"Не удалось прочитать {path}"
+                continue
+            items.append((username, image))
+            images.append(image)
+
+    results, errors = _face_auth.detect_and_embed_many(images, batch_size=batch_size)
+    records = {}
+    for i, ((username, image), result) in enumerate(zip(items, results)):
+        if username in records:
+            continue
+        if result is None:
+            failures[username] = errors.get(i, "Лицо не найдено")
+            continue
+        records[username] = {
+            "username": username,
+            "embedding": result["embedding"],
+            "photo": encode_photo(cv2.cvtColor(image, cv2.COLOR_BGR2RGB), photo_format, photo_quality),
+        }
+    for username in records:
+        failures.pop(username, None)
+    return list(records.values()), failures, len(images)
+
+
+class _AddedUsers:
+    """Подписчик базы: копит добавленных пользователей, чтобы дописать их в IVF-индекс одной записью."""
+
+    def __init__(self):
+        self.usernames, self.embeddings = [], []
+
+    def add(self, username, embedding):
+        self.usernames.append(username)
+        self.embeddings.append(embedding)
+
+    def remove(self, username):
+        pass
+
+    def flush(self, index):
+        """Дописывает накопленных пользователей в индекс (если он есть)."""
+        if index is not None and self.usernames:
+            index.add_many(self.usernames, self.embeddings)
+        self.usernames, self.embeddings = [], []
+
+
+def _open_ann_index(path):
+    """Открывает построенный IVF-индекс или возвращает None, если его нет."""
+    if not os.path.exists(os.path.join(path, 'meta.json')):
+        return None
+    from ann_index import IVFIndex
+    return IVFIndex(path)
+
+
+def enroll(directory, db_url='sqlite:///app.db', workers=None, batch_size=32, commit_size=500,
+           model_name='Facenet', detector_backend='opencv', store_path=EMBEDDING_STORE_PATH,
+           ann_index_path=ANN_INDEX_PATH):
+    """
+    Регистрирует всех пользователей из каталога, пропуская уже существующих.
+    Возвращает:
+        dict: Статистика (enrolled, skipped, failed, images, seconds, images_per_second).
+    """
+    start = time.perf_counter()
+    # Как main.open_database: записи в users и хранилище эмбеддингов идут одной транзакцией
+    db = Database(db_url, embedding_store=EmbeddingStore(store_path))
+    ann_index = _open_ann_index(ann_index_path)
+    added = _AddedUsers()
+    db.subscribe(added)
+    users = collect_images(directory)
+    existing = db.get_usernames()
+    pending = [(username, paths) for username, paths in users.items() if username not in existing]
+    skipped = len(users) - len(pending)
+    print(f"[LOG ENROLL] Найдено пользователей: {len(users)}, уже зарегистрировано: {skipped}, к обработке: {len(pending)}.")
+
+    enrolled, images, failures, buffer = 0, 0, {}, []
+    chunks = [pending[i:i + batch_size] for i in range(0, len(pending), batch_size)]
+    with ProcessPoolExecutor(max_workers=workers, initializer=_init_worker,
+                             initargs=(model_name, detector_backend)) as pool:
+        futures = [pool.submit(_embed_chunk, chunk, batch_size, db.photo_format, db.photo_quality)
+                   for chunk in chunks]
+        for future in as_completed(futures):
+            records, chunk_failures, chunk_images = future.result()
+            buffer.extend(records)
+            failures.update(chunk_failures)
+            images += chunk_images
+            if len(buffer) >= commit_size:
+                enrolled += db.add_users(buffer, model_name=model_name)
+                added.flush(ann_index)
+                buffer = []
+            elapsed = time.perf_counter() - start
+            print(f"[LOG ENROLL] Обработано изображений: {images} ({images / elapsed:.1f} изобр./с), "
+                  f"зарегистрировано: {enrolled + len(buffer)}, ошибок: {len(failures)}.")
+    enrolled += db.add_users(buffer, model_name=model_name)
+    added.flush(ann_index)
+
+    elapsed = time.perf_counter() - start
+    stats = {
+        "enrolled": enrolled,
+        "skipped": skipped,
+        "failed": len(failures),
+        "images": images,
+        "seconds": round(elapsed, 2),
+        "images_per_second": round(images / elapsed, 2) if elapsed > 0 else 0.0,
+    }
+    for username, error in sorted(failures.items()):
+        print(f"[ОШИБКА ENROLL] {username}: {error}")
+    print(f"[LOG ENROLL] Готово: {stats}")
+    return stats
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Массовая регистрация пользователей из каталога с фото.")
+    parser.add_argument("directory", help="Каталог: файл или папка на каждого пользователя.")
+    parser.add_argument("--db-url", default="sqlite:///app.db")
+    parser.add_argument("--workers", type=int, default=None, help="Число процессов (по умолчанию — по числу ядер).")
+    parser.add_argument("--batch-size", type=int, default=32, help="Пользователей в одной задаче и лиц в пакете модели.")
+    parser.add_argument("--commit-size", type=int, default=500, help="Пользователей в одной транзакции БД.")
+    parser.add_argument("--model", default="Facenet")
+    parser.add_argument("--detector", default="opencv")
+    parser.add_argument("--store", default=EMBEDDING_STORE_PATH, help="Каталог хранилища эмбеддингов.")
+    parser.add_argument("--ann-index", default=ANN_INDEX_PATH, help="Каталог IVF-индекса (если построен).")
+    args = parser.parse_args()
+    enroll(args.directory, db_url=args.db_url, workers=args.workers, batch_size=args.batch_size,
+           commit_size=args.commit_size, model_name=args.model, detector_backend=args.detector,
+           store_path=args.store, ann_index_path=args.ann_index)
+
+
+if __name__ == "__main__":
+    main()
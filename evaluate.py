@@ -0,0 +1,241 @@
+"""
+Оценка распознавания и калибровка порога на размеченном наборе фото (заменяет face.py).
+
+Разметка:
+    photos/maria/1.jpg, 2.jpg -> 'maria' (папка на человека);
+    photos/ivan2.jpeg         -> 'ivan' (имя файла без цифр в конце).
+
+Все фото проходят через модель один раз. Расстояния между всеми парами считаются
+матричными операциями NumPy блоками строк (память ограничена chunk_elements)
+и сразу складываются в гистограммы «свой / чужой». По гистограммам строятся кривые
+FAR/FRR для каждой метрики и находится EER. С флагом --write порог метрики с наименьшим EER
+записывается в thresholds.json, откуда его читает FaceAuth, — только если своих и чужих пар
+не меньше MIN_GENUINE_PAIRS / MIN_IMPOSTOR_PAIRS: по нескольким фото порог случаен.
+
+Запуск:
+    python evaluate.py photos --model Facenet --report evaluation.json --write
+    python evaluate.py            # фото из каталога проекта (ruslan, ruslan2, damir), без записи порога
+"""
+import argparse
+import json
+import os
+import re
+import time
+
+import numpy as np
+
+from embedding_cache import EmbeddingCache
+from enroll import IMAGE_EXTENSIONS
+from face_auth import FaceAuth, DISTANCE_METRICS, THRESHOLDS_PATH, update_calibration
+
+# Сколько расстояний считается за один блок (массивы блока — по 64 МБ)
+CHUNK_ELEMENTS = 1 << 24
+
+# Минимум пар, по которым порог можно записать в конфиг FaceAuth
+MIN_GENUINE_PAIRS = 100
+MIN_IMPOSTOR_PAIRS = 1000
+
+
+def collect_labeled_images(directory):
+    """
+    Собирает фото с метками.
+    Возвращает:
+        tuple[list[str], list[str]]: Пути к фото и метки (имя папки или имя файла без цифр в конце).
+    """
+    paths, labels = [], []
+    for entry in sorted(os.listdir(directory)):
+        path = os.path.join(directory, entry)
+        if os.path.isdir(path):
+            for name in sorted(os.listdir(path)):
+                if os.path.splitext(name)[1].lower() in IMAGE_EXTENSIONS:
+                    paths.append(os.path.join(path, name))
+                    labels.append(entry)
+        elif os.path.splitext(entry)[1].lower() in IMAGE_EXTENSIONS:
+            stem = re.sub(r'[\d_\-]+$', '', os.path.splitext(entry)[0]) or os.path.splitext(entry)[0]
+            paths.append(path)
+            labels.append(stem)
+    return paths, labels
+
+
+def _prepare(embeddings, metric):
+    """Векторы для метрики: нормализованные для euclidean_l2 и cosine."""
+    embeddings = np.asarray(embeddings, dtype=np.float32)
+    if metric == 'euclidean':
+        return embeddings
+    norms = np.linalg.norm(embeddings, axis=1, keepdims=True)
+    norms[norms == 0] = 1.0
+    return embeddings / norms
+
+
+def max_distance(embeddings, metric):
+    """Верхняя граница расстояния (правая граница гистограммы)."""
+    if metric == 'euclidean':
+        return float(2 * np.linalg.norm(embeddings, axis=1).max()) or 1.0
+    return 2.0
+
+
+def distance_histograms(embeddings, labels, metric, bins=2000, chunk_elements=CHUNK_ELEMENTS):
+    """
+    Гистограммы расстояний всех пар (i < j) отдельно для своих и чужих пар.
+
+    Аргументы:
+        embeddings (array): Эмбеддинги (n, dim).
+        labels (list): Метки в том же порядке.
+        metric (str): 'euclidean', 'euclidean_l2' или 'cosine'.
+        bins (int): Число корзин гистограммы.
+        chunk_elements (int): Сколько расстояний считать за один блок.
+
+    Возвращает:
+        tuple[numpy.ndarray, numpy.ndarray, numpy.ndarray]: Счётчики своих и чужих пар по корзинам
+        и границы корзин (bins + 1).
+    """
+    vectors = _prepare(embeddings, metric)
+    count = len(vectors)
+    _, codes = np.unique(np.asarray(labels), return_inverse=True)
+    squared = np.einsum('ij,ij->i', vectors, vectors)
+    upper = max_distance(vectors, metric)
+    scale = bins / upper
+    genuine = np.zeros(bins, dtype=np.int64)
+    impostor = np.zeros(bins, dtype=np.int64)
+
+    rows_per_block = max(1, chunk_elements // max(count, 1))
+    for start in range(0, count, rows_per_block):
+        stop = min(start + rows_per_block, count)
+        # Блок строк [start, stop) против столбцов [start, n): берутся только пары j > i
+        products = vectors[start:stop] @ vectors[start:].T
+        if metric == 'cosine':
+            distances = 1.0 - products
+        else:
+            distances = np.sqrt(np.maximum(squared[start:stop, None] + squared[None, start:] - 2.0 * products, 0.0))
+        pairs = np.arange(count - start)[None, :] > np.arange(stop - start)[:, None]
+        same = codes[start:stop, None] == codes[None, start:]
+        indices = np.clip((distances * scale).astype(np.int32), 0, bins - 1)
+        genuine += np.bincount(indices[pairs & same], minlength=bins)
+        impostor += np.bincount(indices[pairs & ~same], minlength=bins)
+    return genuine, impostor, np.linspace(0.0, upper, bins + 1)
+
+
+def sweep_thresholds(genuine, impostor, edges):
+    """
+    FAR и FRR для порогов на правых границах корзин (пара принимается, если расстояние <= порога).
+
+    Возвращает:
+        dict: thresholds, far, frr (массивы) и eer, eer_threshold, eer_index.
+    """
+    thresholds = edges[1:]
+    far = np.cumsum(impostor) / max(int(impostor.sum()), 1)  # Доля чужих пар, принятых как свои
+    frr = 1.0 - np.cumsum(genuine) / max(int(genuine.sum()), 1)  # Доля своих пар, отклонённых
+    index = int(np.argmin(np.abs(far - frr)))
+    return {"thresholds": thresholds, "far": far, "frr": frr, "eer_index": index,
+            "eer": float((far[index] + frr[index]) / 2), "eer_threshold": float(thresholds[index])}
+
+
+def evaluate_embeddings(embeddings, labels, metrics=DISTANCE_METRICS, bins=2000, chunk_elements=CHUNK_ELEMENTS):
+    """
+    Кривые FAR/FRR и EER для каждой метрики.
+
+    Возвращает:
+        dict: {метрика: {threshold, eer, far, frr, genuine_pairs, impostor_pairs, curve}}.
+        curve — {thresholds, far, frr} в виде списков.
+    """
+    report = {}
+    for metric in metrics:
+        genuine, impostor, edges = distance_histograms(embeddings, labels, metric, bins, chunk_elements)
+        sweep = sweep_thresholds(genuine, impostor, edges)
+        index = sweep["eer_index"]
+        report[metric] = {
+            "threshold": sweep["eer_threshold"],
+            "eer": sweep["eer"],
+            "far": float(sweep["far"][index]),
+            "frr": float(sweep["frr"][index]),
+            "genuine_pairs": int(genuine.sum()),
+            "impostor_pairs": int(impostor.sum()),
+            "curve": {key: np.round(sweep[key], 6).tolist() for key in ("thresholds", "far", "frr")},
+        }
+    return report
+
+
+def write_thresholds(model_name, report, path=THRESHOLDS_PATH, images=0):
+    """
+    Записывает порог метрики с наименьшим EER в конфиг FaceAuth (прочие поля и записи других моделей сохраняются).
+    Возвращает:
+        dict: Запись модели.
+    """
+    metric = min(report, key=lambda name: report[name]["eer"])
+    return update_calibration(
+        model_name, path,
+        distance_metric=metric,
+        threshold=report[metric]["threshold"],
+        eer=report[metric]["eer"],
+        images=images,
+        metrics={name: {"threshold": stats["threshold"], "eer": stats["eer"]} for name, stats in report.items()},
+        calibrated_at=time.strftime("%Y-%m-%d %H:%M:%S"),
+    )
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Оценка распознавания и калибровка порога.")
+    parser.add_argument("directory", nargs="?", default=os.path.dirname(os.path.abspath(__file__)),
+                        help="Каталог с фото: папка на человека или файлы 'имя<цифры>.jpg'.")
+    parser.add_argument("--model", default="Facenet")
+    parser.add_argument("--detector", default="opencv")
+    parser.add_argument("--metrics", nargs="+", default=list(DISTANCE_METRICS), choices=DISTANCE_METRICS)
+    parser.add_argument("--bins", type=int, default=2000, help="Число корзин гистограммы расстояний.")
+    parser.add_argument("--batch-size", type=int, default=32)
+    parser.add_argument("--cache", default="embedding_cache.npz", help="Файл кэша эмбеддингов ('' — без кэша).")
+    parser.add_argument("--report", default=None, help="Записать кривые FAR/FRR в JSON.")
+    parser.add_argument("--thresholds", default=THRESHOLDS_PATH, help="Конфиг порогов для FaceAuth.")
+    parser.add_argument("--write", action="store_true", help="Записать порог в конфиг FaceAuth.")
+    parser.add_argument("--min-genuine-pairs", type=int, default=MIN_GENUINE_PAIRS,
+                        help="Минимум своих пар для записи порога.")
+    parser.add_argument("--min-impostor-pairs", type=int, default=MIN_IMPOSTOR_PAIRS,
+                        help="Минимум чужих пар для записи порога.")
+    args = parser.parse_args()
+
+    paths, labels = collect_labeled_images(args.directory)
+    print(f"[LOG] Фото: {len(paths)}, людей: {len(set(labels))}.")
+    cache = EmbeddingCache(path=args.cache) if args.cache else None
+    face_auth = FaceAuth(model_name=args.model, detector_backend=args.detector, cache=cache, thresholds_path=None)
+
+    start = time.perf_counter()
+    embeddings, failures = face_auth.get_embeddings(paths, batch_size=args.batch_size)
+    for i, error in sorted(failures.items()):
+        print(f"[ERROR] Ошибка обработки {paths[i]}: {error}")
+    kept = [i for i, embedding in enumerate(embeddings) if embedding is not None]
+    print(f"[LOG] Эмбеддинги получены за {time.perf_counter() - start:.2f}s ({len(kept)} из {len(paths)}).")
+    if cache is not None:
+        cache.save()
+    if len(kept) < 2:
+        print("[ERROR] Для оценки нужно хотя бы два фото с найденным лицом.")
+        return
+
+    matrix = np.stack([np.asarray(embeddings[i], dtype=np.float32) for i in kept])
+    kept_labels = [labels[i] for i in kept]
+    start = time.perf_counter()
+    report = evaluate_embeddings(matrix, kept_labels, args.metrics, args.bins)
+    print(f"[LOG] Пары посчитаны за {time.perf_counter() - start:.2f}s.")
+    for metric, stats in report.items():
+        print(f"[RESULT] {args.model}/{metric}: порог {stats['threshold']:.4f}, EER {stats['eer']:.2%} "
+              f"(FAR {stats['far']:.2%}, FRR {stats['frr']:.2%}), своих пар {stats['genuine_pairs']}, "
+              f"чужих {stats['impostor_pairs']}")
+        if not stats['genuine_pairs'] or not stats['impostor_pairs']:
+            print(f"[ERROR] Для {metric} нужны и свои, и чужие пары: порог не откалиброван.")
+
+    if args.report:
+        with open(args.report, 'w', encoding='utf-8') as f:
+            json.dump({"model": args.model, "detector": args.detector, "images": len(kept), "metrics": report}, f)
+        print(f"[LOG] Кривые FAR/FRR записаны в {args.report}.")
+    if not args.write:
+        return
+    usable = {metric: stats for metric, stats in report.items()
+              if stats['genuine_pairs'] >= args.min_genuine_pairs and stats['impostor_pairs'] >= args.min_impostor_pairs}
+    if not usable:
+        print(f"[ERROR] Порог не записан: нужно не меньше {args.min_genuine_pairs} своих и "
+              f"{args.min_impostor_pairs} чужих пар.")
+        return
+    entry = write_thresholds(args.model, usable, args.thresholds, images=len(kept))
+    print(f"[RESULT] В {args.thresholds} записано: {args.model} — {entry['distance_metric']} <= {entry['threshold']:.4f}")
+
+
+if __name__ == "__main__":
+    main()
@@ -1,29 +1,239 @@
-from deepface import DeepFace
+import importlib
+import json
+import cv2
 import numpy as np
+import os
+import time
+from metrics import timed
+
+
+class _LazyModule:
+    """Модуль, который импортируется при первом обращении к его атрибутам."""
+
+    def __init__(self, module_name):
+        self._module_name = module_name
+        self._module = None
+
+    def _load(self):
+        if self._module is None:
+            self._module = importlib.import_module(self._module_name)
+        return self._module
+
+    def __getattr__(self, name):
+        return getattr(self._load(), name)
+
+
+# DeepFace тянет TensorFlow/Keras (секунды на импорт), поэтому импортируется только при работе с моделями:
+# база, веб-маршруты и служебные команды запускаются без него.
+DeepFace = _LazyModule('deepface.DeepFace')
+preprocessing = _LazyModule('deepface.modules.preprocessing')
+verification = _LazyModule('deepface.modules.verification')
+detection = _LazyModule('deepface.modules.detection')
+
+
+def import_deepface():
+    """Импортирует DeepFace и TensorFlow сразу (например, чтобы замерить время импорта при запуске)."""
+    for module in (DeepFace, preprocessing, verification, detection):
+        module._load()
+
+# Фото для прогрева моделей (лежит рядом с модулем)
+WARMUP_IMAGE = os.path.join(os.path.dirname(os.path.abspath(__file__)), 'ruslan.jpeg')
+
+# Калиброванные пороги по моделям (записывает evaluate.py --write). Без записи для модели
+# используется косинусное расстояние и порог DeepFace для этой модели (как у DeepFace.verify).
+THRESHOLDS_PATH = os.path.join(os.path.dirname(os.path.abspath(__file__)), 'thresholds.json')
+DEFAULT_DISTANCE_METRIC = 'cosine'
+DISTANCE_METRICS = ('euclidean', 'euclidean_l2', 'cosine')
+
+
+def find_distance(embedding1, embedding2, distance_metric='euclidean'):
+    """
+    Расстояние между двумя эмбеддингами.
+    - distance_metric: 'euclidean', 'euclidean_l2' (между нормализованными векторами) или 'cosine' (1 - cos).
+    """
+    a = np.asarray(embedding1, dtype=np.float32).ravel()
+    b = np.asarray(embedding2, dtype=np.float32).ravel()
+    if distance_metric == 'euclidean':
+        return float(np.linalg.norm(a - b))
+    norm_a, norm_b = np.linalg.norm(a) or 1.0, np.linalg.norm(b) or 1.0
+    if distance_metric == 'euclidean_l2':
+        return float(np.linalg.norm(a / norm_a - b / norm_b))
+    if distance_metric == 'cosine':
+        return float(1.0 - a @ b / (norm_a * norm_b))
+    raise ValueError(f"Unknown distance metric: {distance_metric}. Available: {DISTANCE_METRICS}")
+
+
+def load_calibration(model_name, path=THRESHOLDS_PATH):
+    """
+    Читает запись модели из конфига порогов.
+    Возвращает:
+        dict: {distance_metric, threshold, ...} от evaluate.py и identification от quantization.py;
+        пустой dict, если калибровки нет.
+    """
+    if not path or not os.path.exists(path):
+        return {}
+    try:
+        with open(path, encoding='utf-8') as f:
+            entry = json.load(f).get(model_name) or {}
+        if "distance_metric" in entry and entry["distance_metric"] not in DISTANCE_METRICS:
+            raise ValueError(f"unknown distance metric {entry['distance_metric']}")
+        return entry
+    except Exception as e:
+        print(f"[ERROR FaceAuth] Failed to read thresholds from {path}: {e}")
+        return {}
+
+
+def update_calibration(model_name, path=THRESHOLDS_PATH, **fields):
+    """
+    Обновляет поля записи модели в конфиге порогов (остальные поля и записи других моделей сохраняются).
+    Возвращает:
+        dict: Запись модели.
+    """
+    config = {}
+    if os.path.exists(path):
+        with open(path, encoding='utf-8') as f:
+            config = json.load(f)
+    config.setdefault(model_name, {}).update(fields)
+    tmp_path = path + ".tmp"
+    with open(tmp_path, 'w', encoding='utf-8') as f:
+        json.dump(config, f, indent=2, ensure_ascii=False)
+    os.replace(tmp_path, path)
+    return config[model_name]
+
 
 class FaceAuth:
-    def __init__(self, model_name='Facenet'):
+    def __init__(self, model_name='Facenet', detector_backend='opencv', cache=None, thresholds_path=THRESHOLDS_PATH):
         self.model_name = model_name
+        self.detector_backend = detector_backend
+        self.models = {}  # Загруженные модели: имя -> объект модели DeepFace
+        self.is_ready = False
+        self.cache = cache  # EmbeddingCache или None
+        # Метрика и порог для compare_embeddings: из калибровки evaluate.py или порог DeepFace (см. threshold)
+        self.calibration = load_calibration(model_name, thresholds_path)
+        self.calibrated = "distance_metric" in self.calibration
+        self.distance_metric = self.calibration["distance_metric"] if self.calibrated else DEFAULT_DISTANCE_METRIC
+        self._threshold = float(self.calibration["threshold"]) if self.calibrated else None
+        if self.calibrated:
+            print(f"[LOG FaceAuth] Calibrated threshold for {model_name}: {self.distance_metric} <= {self._threshold:.4f}")
+
+    @property
+    def threshold(self):
+        """
+        Порог compare_embeddings. Без калибровки — verification.find_threshold для модели и метрики;
+        он берётся при первом сравнении, чтобы создание FaceAuth не импортировало DeepFace.
+        """
+        if self._threshold is None:
+            self._threshold = float(verification.find_threshold(self.model_name, self.distance_metric))
+        return self._threshold
+
+    def identification_threshold(self, quantization_mode='float32'):
+        """
+        Порог euclidean_l2 для поиска 1:N (FaceIndex, IVFIndex) с векторами в режиме quantization_mode:
+        из калибровки quantization.py --check --write, иначе порог DeepFace для euclidean_l2.
+        """
+        thresholds = self.calibration.get("identification", {}).get("thresholds", {})
+        if quantization_mode in thresholds:
+            return float(thresholds[quantization_mode])
+        return float(verification.find_threshold(self.model_name, 'euclidean_l2'))
+
+    def _required_models(self):
+        """Список моделей (имя, задача DeepFace), которые используются при обработке запросов."""
+        models = [(self.model_name, 'facial_recognition')]
+        if self.detector_backend != 'skip':
+            models.append((self.detector_backend, 'face_detector'))
+        return models
+
+    def load_models(self):
+        """
+        Загружает все модели заранее, чтобы первый запрос не ждал их построения.
+        DeepFace кэширует построенные модели, поэтому последующие вызовы используют их же.
+        Возвращает:
+            dict: Время загрузки каждой модели в секундах.
+        """
+        timings = {}
+        for name, task in self._required_models():
+            if name in self.models:
+                continue
+            start = time.perf_counter()
+            self.models[name] = DeepFace.build_model(model_name=name, task=task)
+            timings[name] = time.perf_counter() - start
+            print(f"[LOG FaceAuth] Model '{name}' ({task}) loaded in {timings[name]:.2f}s")
+        return timings
+
+    def warm_up(self, image=WARMUP_IMAGE):
+        """
+        Загружает модели и прогоняет через них тестовое фото.
+        Первый проход инициализирует графы TensorFlow, после него запросы обрабатываются с обычной скоростью.
+        - image: путь к фото или numpy array с лицом.
+        Возвращает:
+            dict: Время загрузки ('load') и прогрева ('warmup') по каждой стадии в секундах.
+        """
+        report = {'load': self.load_models(), 'warmup': {}}
+
+        start = time.perf_counter()
+        if self.detect_and_embed(image) is None:
+            raise RuntimeError(f"Warm-up image has no detectable face: {image}")
+        report['warmup']['detect_and_embed'] = time.perf_counter() - start
+
+        for stage, seconds in report['warmup'].items():
+            print(f"[LOG FaceAuth] Warm-up '{stage}' took {seconds:.2f}s")
+        self.is_ready = True
+        return report
+
+    def ensure_ready(self):
+        """Прогревает модели, если это ещё не сделано."""
+        if not self.is_ready:
+            self.warm_up()
+
+    def _cache_settings(self, mode):
+        """Настройки, от которых зависит эмбеддинг: часть ключа кэша."""
+        return f"{self.model_name}|{self.detector_backend}|{mode}"
+
+    def _decode(self, image):
+        """Декодирует путь или байты в numpy array (BGR, как cv2.imread), чтобы хэшировать пиксели."""
+        if isinstance(image, str):
+            decoded = cv2.imread(image)
+            if decoded is None:
+                raise ValueError(f"Failed to read image: {image}")
+            return decoded
+        return self._load_image(image)
 
     def get_embedding(self, image):
         """Получает эмбеддинг для изображения."""
         try:
+            key = None
+            if self.cache is not None:
+                image = self._decode(image)
+                key = self.cache.key(image, self._cache_settings('represent'))
+                cached = self.cache.get(key)
+                if cached is not None:
+                    return cached
             # Передаем массив пикселей вместо пути к файлу
-            embedding = DeepFace.represent(img_path=image, model_name=self.model_name, enforce_detection=False)
-            return embedding[0]["embedding"]
+            with timed('embed'):
+                embedding = DeepFace.represent(img_path=image, model_name=self.model_name,
+                                               detector_backend=self.detector_backend, enforce_detection=False)
+            embedding = embedding[0]["embedding"]
+            if key is not None:
+                self.cache.put(key, embedding)
+            return embedding
         except Exception as e:
             print(f"[ERROR FaceAuth] Failed to get embedding: {e}")
             return None
 
-    def compare_embeddings(self, embedding1, embedding2, threshold=0.6):
-        """Сравнивает два эмбеддинга."""
+    @timed('compare')
+    def compare_embeddings(self, embedding1, embedding2, threshold=None):
+        """
+        Сравнивает два эмбеддинга по метрике и порогу модели (self.distance_metric, self.threshold).
+        - threshold: порог вместо self.threshold.
+        """
         try:
-            distance = np.linalg.norm(np.array(embedding1) - np.array(embedding2))
-            return distance < threshold
+            distance = find_distance(embedding1, embedding2, self.distance_metric)
+            return distance <= (self.threshold if threshold is None else threshold)
         except Exception as e:
             print(f"[ERROR FaceAuth] Failed to compare embeddings: {e}")
             return False
 
+    @timed('compare')
     def compare_photos(self, photo1, photo2):
         """
         Сравнивает две фотографии и проверяет, один ли это человек.
@@ -31,12 +241,237 @@ class FaceAuth:
         Возвращает True, если фотографии принадлежат одному человеку, иначе False.
         """
         try:
-            result = DeepFace.verify(img1_path=photo1, img2_path=photo2, model_name=self.model_name, enforce_detection=False)
+            if self.cache is not None:
+                # Без калибровки это те же шаги, что у DeepFace.verify (косинусное расстояние и его порог),
+                # но эмбеддинги из кэша
+                embedding1, embedding2 = self.get_embedding(photo1), self.get_embedding(photo2)
+                if embedding1 is None or embedding2 is None:
+                    return False
+                return self.compare_embeddings(embedding1, embedding2)
+            result = DeepFace.verify(img1_path=photo1, img2_path=photo2, model_name=self.model_name,
+                                     detector_backend=self.detector_backend, enforce_detection=False)
             return result["verified"]
         except Exception as e:
             print(f"[ERROR FaceAuth] Failed to compare photos: {e}")
             return False
 
+    @timed('detect')
+    def _extract_faces(self, image):
+        """
+        Один проход детектора: находит и выравнивает лица.
+        - image: numpy array или путь к файлу.
+        Возвращает:
+            list[dict]: Лица DeepFace (face, facial_area, confidence). Бросает ValueError, если лиц нет.
+        """
+        return DeepFace.extract_faces(img_path=image, detector_backend=self.detector_backend,
+                                      enforce_detection=True, align=True)
+
+    def _recognition_model(self):
+        """Возвращает загруженную модель распознавания, при необходимости строит её."""
+        if self.model_name not in self.models:
+            self.models[self.model_name] = DeepFace.build_model(model_name=self.model_name, task='facial_recognition')
+        return self.models[self.model_name]
+
+    @staticmethod
+    def _load_image(image):
+        """
+        Приводит вход к виду, который принимает DeepFace.
+        - image: numpy array, путь к файлу или байты закодированного изображения.
+        """
+        if isinstance(image, (bytes, bytearray, memoryview)):
+            decoded = cv2.imdecode(np.frombuffer(image, dtype=np.uint8), cv2.IMREAD_COLOR)
+            if decoded is None:
+                raise ValueError("Failed to decode image bytes")
+            return decoded
+        return image
+
+    @timed('embed')
+    def embed_faces(self, faces):
+        """
+        Получает эмбеддинги для уже найденных и выровненных лиц одним пакетом.
+        Шаги те же, что у DeepFace.represent: лицо переводится обратно в BGR, приводится
+        к входу модели и нормализуется, поэтому эмбеддинги совпадают с записанными при регистрации.
+        - faces: список лиц в формате DeepFace (RGB, float в диапазоне [0, 1]).
+        Возвращает:
+            numpy.ndarray: Матрица эмбеддингов float32 формы (len(faces), размерность).
+        """
+        model = self._recognition_model()
+        height, width = model.input_shape
+        batch = np.concatenate([
+            preprocessing.normalize_input(preprocessing.resize_image(img=np.asarray(face)[:, :, ::-1],
+                                                                     target_size=(width, height)))
+            for face in faces
+        ])
+        return np.asarray(model.model.predict_on_batch(batch), dtype=np.float32)
+
+    def embed_face(self, face):
+        """
+        Получает эмбеддинг уже найденного и выровненного лица без повторной детекции.
+        - face: вырезанное лицо в формате DeepFace (RGB, float в диапазоне [0, 1]).
+        Возвращает:
+            numpy.ndarray: Эмбеддинг лица (float32).
+        """
+        return self.embed_faces([face])[0]
+
+    @staticmethod
+    def _align_region(image, box, eyes=None):
+        """
+        Вырезает область кадра так же, как DeepFace.extract_faces при регистрации: рамка с полями
+        в половину размера (за краем кадра — чёрные пиксели) поворачивается по линии глаз,
+        и из неё вырезается спроецированная рамка.
+        - image: numpy array в BGR.
+        - box: рамка (x, y, w, h).
+        - eyes: координаты (левый глаз, правый глаз) на кадре или None — без поворота.
+        Возвращает:
+            numpy.ndarray: Лицо в формате DeepFace (RGB, float в диапазоне [0, 1]).
+        """
+        x, y, w, h = (int(value) for value in box)
+        left_eye, right_eye = eyes if eyes is not None else (None, None)
+        sub_img, relative_x, relative_y = detection.extract_sub_image(img=np.asarray(image), facial_area=(x, y, w, h))
+        aligned, angle = detection.align_img_wrt_eyes(img=sub_img, left_eye=left_eye, right_eye=right_eye)
+        x1, y1, x2, y2 = detection.project_facial_area(
+            facial_area=(relative_x, relative_y, relative_x + w, relative_y + h),
+            angle=angle, size=(sub_img.shape[0], sub_img.shape[1]))
+        crop = aligned[int(y1):int(y2), int(x1):int(x2)]
+        if crop.size == 0:
+            raise ValueError(f"Empty region: {box}")
+        # embed_faces вернёт лицо в BGR перед моделью, как DeepFace.represent
+        return crop[:, :, ::-1].astype(np.float32) / 255.0
+
+    def embed_regions(self, regions):
+        """
+        Получает эмбеддинги областей кадров без запуска детектора (например, рамок от трекера) одним пакетом.
+        - regions: список (image, box, eyes) — кадр BGR, рамка (x, y, w, h) и глаза (см. _align_region).
+        Возвращает:
+            tuple[list, dict]: Эмбеддинги в порядке входа (None для неудачных)
+            и ошибки {индекс входа: текст ошибки}.
+        """
+        results = [None] * len(regions)
+        failures = {}
+        faces = []
+        for i, (image, box, eyes) in enumerate(regions):
+            try:
+                faces.append((i, self._align_region(image, box, eyes)))
+            except Exception as e:
+                failures[i] = str(e)
+        if faces:
+            for (i, _), embedding in zip(faces, self.embed_faces([face for _, face in faces])):
+                results[i] = embedding
+        return results, failures
+
+    def embed_region(self, image, box, eyes=None):
+        """
+        Получает эмбеддинг области кадра без запуска детектора, выровненной как при регистрации.
+        - image: numpy array в BGR (как кадр камеры или cv2.imread).
+        - box: рамка (x, y, w, h).
+        - eyes: координаты (левый глаз, правый глаз) на кадре (facial_area детектора) или None.
+        Возвращает:
+            numpy.ndarray: Эмбеддинг (float32).
+        """
+        return self.embed_face(self._align_region(image, box, eyes))
+
+    def detect_and_embed_many(self, images, batch_size=32):
+        """
+        Детектирует лица на многих изображениях и получает эмбеддинги пакетами.
+        Детекция выполняется по одному изображению, а выровненные лица идут в модель пачками по batch_size.
+        С кэшем результаты ищутся по хэшу пикселей: повторное фото (и повтор внутри пакета)
+        не проходит ни через детектор, ни через модель.
+        - images: список numpy array, путей к файлам или байтов изображений.
+        Возвращает:
+            tuple[list, dict]: Результаты в порядке входа (dict как у detect_and_embed или None)
+            и ошибки {индекс входа: текст ошибки}.
+        """
+        if self.cache is None:
+            return self._detect_and_embed_many(images, batch_size)
+
+        results = [None] * len(images)
+        failures = {}
+        pending = {}  # ключ -> (декодированное изображение, индексы входа с этим изображением)
+        for i, image in enumerate(images):
+            try:
+                decoded = self._decode(image)
+            except Exception as e:
+                failures[i] = str(e)
+                continue
+            key = self.cache.key(decoded, self._cache_settings('detect'))
+            if key in pending:
+                pending[key][1].append(i)
+                continue
+            embedding, meta = self.cache.get_entry(key)
+            if embedding is not None and meta is not None:
+                # Выровненное лицо не кэшируется: у результата из кэша face = None
+                results[i] = {"face": None, "facial_area": meta["facial_area"],
+                              "confidence": meta["confidence"], "embedding": embedding}
+            else:
+                pending[key] = (decoded, [i])
+
+        keys = list(pending)
+        computed, errors = self._detect_and_embed_many([pending[key][0] for key in keys], batch_size)
+        for j, (key, result) in enumerate(zip(keys, computed)):
+            if result is not None:
+                self.cache.put(key, result["embedding"],
+                               {"facial_area": result["facial_area"], "confidence": result["confidence"]})
+            for i in pending[key][1]:
+                if result is not None:
+                    results[i] = result
+                else:
+                    failures[i] = errors.get(j, "Unknown error")
+        return results, failures
+
+    def _detect_and_embed_many(self, images, batch_size):
+        """detect_and_embed_many без кэша."""
+        results = [None] * len(images)
+        failures = {}
+        for chunk_start in range(0, len(images), batch_size):
+            detected = []
+            for i in range(chunk_start, min(chunk_start + batch_size, len(images))):
+                try:
+                    faces = self._extract_faces(self._load_image(images[i]))
+                    detected.append((i, max(faces, key=lambda face: face.get("confidence") or 0)))
+                except Exception as e:
+                    failures[i] = f"No face detected: {e}"
+            if not detected:
+                continue
+            try:
+                embeddings = self.embed_faces([face["face"] for _, face in detected])
+            except Exception as e:
+                for i, _ in detected:
+                    failures[i] = f"Failed to embed detected face: {e}"
+                continue
+            for (i, face), embedding in zip(detected, embeddings):
+                results[i] = {
+                    "face": face["face"],
+                    "facial_area": face["facial_area"],
+                    "confidence": face.get("confidence"),
+                    "embedding": embedding,
+                }
+        for i, error in failures.items():
+            print(f"[ERROR FaceAuth] Item {i}: {error}")
+        return results, failures
+
+    def get_embeddings(self, images, batch_size=32):
+        """
+        Пакетное получение эмбеддингов.
+        - images: список numpy array, путей к файлам или байтов изображений.
+        - batch_size: сколько лиц подаётся в модель за один вызов.
+        Возвращает:
+            tuple[list, dict]: Эмбеддинги в порядке входа (None для неудачных)
+            и ошибки {индекс входа: текст ошибки}.
+        """
+        results, failures = self.detect_and_embed_many(images, batch_size=batch_size)
+        return [result["embedding"] if result else None for result in results], failures
+
+    def detect_and_embed(self, image):
+        """
+        Детектирует лицо и получает его эмбеддинг за один проход детектора.
+        - image: numpy array, путь к файлу или байты изображения.
+        Возвращает:
+            dict: face (выровненное лицо; None для результата из кэша), facial_area (рамка x, y, w, h),
+            confidence и embedding; None, если лицо не найдено или обработка не удалась.
+        """
+        results, _ = self.detect_and_embed_many([image])
+        return results[0]
+
     def detect_face(self, image):
         """
         Проверяет, есть ли лицо на фотографии.
@@ -45,9 +480,7 @@ class FaceAuth:
             bool: True, если лицо найдено, иначе False.
         """
         try:
-            # Используем DeepFace для детекции лиц
-            analysis = DeepFace.analyze(img_path=image, actions=['gender'], enforce_detection=True)
-            return True  # Если анализ успешен, лицо обнаружено
+            return len(self._extract_faces(image)) > 0
         except Exception as e:
             print(f"[ERROR FaceAuth] No face detected: {e}")
             return False
@@ -0,0 +1,192 @@
+import threading
+import numpy as np
+from metrics import timed
+import quantization
+
+
+class FaceIndex:
+    def __init__(self, dim=128, capacity=1024, quantization_mode='float32'):
+        """
+        Инициализация индекса идентификации лиц (поиск 1:N).
+
+        Все эмбеддинги хранятся в одной непрерывной матрице,
+        строки которой заранее нормализованы, поэтому запрос сводится
+        к одному матричному умножению.
+
+        Аргументы:
+            dim (int): Размерность эмбеддинга (128 для Facenet).
+            capacity (int): Начальная ёмкость матрицы (число строк).
+            quantization_mode (str): Хранение строк: 'float32', 'float16' (в 2 раза меньше памяти)
+                или 'int8' с масштабом на строку (около 4 раз меньше), см. quantization.py.
+        """
+        self.dim = dim
+        self.quantization_mode = quantization_mode
+        self._matrix = np.zeros((max(capacity, 1), dim), dtype=quantization.storage_dtype(quantization_mode))
+        self._scales = np.ones(max(capacity, 1), dtype=np.float32)  # Масштабы строк для int8
+        self._usernames = []  # Имя пользователя для каждой занятой строки
+        self._positions = {}  # username -> номер строки
+        self._lock = threading.RLock()
+        self._store = None  # EmbeddingStore, с которым индекс сверяется перед поиском
+        self._store_state = None
+        print("[LOG INDEX] Индекс лиц успешно создан.")
+
+    @classmethod
+    def from_database(cls, db, dim=128, quantization_mode='float32'):
+        """
+        Строит индекс по всем пользователям базы и подписывает его на изменения.
+        Если к базе подключено хранилище эмбеддингов, индекс перечитывает его при изменении
+        версии — так видны регистрации и удаления из других процессов (воркеров gunicorn, main.py).
+
+        Аргументы:
+            db (Database): База данных пользователей.
+            dim (int): Размерность эмбеддинга.
+            quantization_mode (str): Режим хранения строк.
+
+        Возвращает:
+            FaceIndex: Заполненный индекс.
+        """
+        store = db.embedding_store
+        # Состояние читается до снимка: изменение между ними приведёт к лишнему перечитыванию, а не к пропуску
+        state = store.state() if store is not None else None
+        usernames, embeddings = db.get_all_embeddings()
+        index = cls(dim=dim, capacity=max(len(usernames) * 2, 1024), quantization_mode=quantization_mode)
+        index.add_many(usernames, embeddings)
+        if store is not None:
+            index._store, index._store_state = store, state
+        db.subscribe(index)
+        print(f"[LOG INDEX] Индекс построен по базе данных: {len(index)} пользователей.")
+        return index
+
+    def __len__(self):
+        return len(self._usernames)
+
+    def __contains__(self, username):
+        return username in self._positions
+
+    def memory_bytes(self):
+        """Память, занимаемая занятыми строками индекса (коды и масштабы)."""
+        count = len(self._usernames)
+        scales = self._scales[:count].nbytes if self.quantization_mode == 'int8' else 0
+        return self._matrix[:count].nbytes + scales
+
+    def _reserve(self, extra):
+        """Увеличивает ёмкость матрицы, если новых строк не хватает места."""
+        needed = len(self._usernames) + extra
+        capacity = self._matrix.shape[0]
+        if needed <= capacity:
+            return
+        while capacity < needed:
+            capacity *= 2
+        matrix = np.zeros((capacity, self.dim), dtype=self._matrix.dtype)
+        matrix[:len(self._usernames)] = self._matrix[:len(self._usernames)]
+        scales = np.ones(capacity, dtype=np.float32)
+        scales[:len(self._usernames)] = self._scales[:len(self._usernames)]
+        self._matrix, self._scales = matrix, scales
+
+    def add(self, username, embedding):
+        """
+        Добавляет или заменяет эмбеддинг пользователя.
+
+        Аргументы:
+            username (str): Имя пользователя.
+            embedding (list/array): Эмбеддинг лица.
+        """
+        self.add_many([username], [embedding])
+
+    def add_many(self, usernames, embeddings):
+        """
+        Пакетное добавление эмбеддингов.
+
+        Аргументы:
+            usernames (list[str]): Имена пользователей.
+            embeddings (list/array): Эмбеддинги в том же порядке.
+        """
+        if len(usernames) == 0:
+            return
+        codes, scales = quantization.quantize(embeddings, self.quantization_mode)
+        if codes.shape != (len(usernames), self.dim):
+            raise ValueError(f"[ОШИБКА INDEX] Ожидались эмбеддинги формы ({len(usernames)}, {self.dim}), получено {codes.shape}.")
+        with self._lock:
+            self._reserve(len(usernames))
+            for username, code, scale in zip(usernames, codes, scales):
+                row = self._positions.get(username)
+                if row is None:
+                    row = len(self._usernames)
+                    self._usernames.append(username)
+                    self._positions[username] = row
+                self._matrix[row] = code
+                self._scales[row] = scale
+
+    def _sync_store(self):
+        """Перестраивает индекс по хранилищу, если с прошлой сверки его изменил любой процесс."""
+        if self._store is None or self._store.stale:
+            return
+        state = self._store.state()
+        if state == self._store_state:
+            return
+        usernames, embeddings = self._store.snapshot()
+        codes, scales = quantization.quantize(embeddings, self.quantization_mode) if len(usernames) else (None, None)
+        with self._lock:
+            self._usernames, self._positions = [], {}
+            self._reserve(len(usernames))
+            if len(usernames):
+                self._matrix[:len(usernames)] = codes
+                self._scales[:len(usernames)] = scales
+            self._usernames = list(usernames)
+            self._positions = {username: row for row, username in enumerate(usernames)}
+            self._store_state = state
+
+    def remove(self, username):
+        """
+        Удаляет пользователя из индекса.
+
+        Последняя строка переносится на место удалённой, поэтому матрица остаётся
+        непрерывной без пересборки.
+
+        Возвращает:
+            bool: True, если пользователь был в индексе.
+        """
+        with self._lock:
+            row = self._positions.pop(username, None)
+            if row is None:
+                return False
+            last = len(self._usernames) - 1
+            if row != last:
+                moved = self._usernames[last]
+                self._matrix[row] = self._matrix[last]
+                self._scales[row] = self._scales[last]
+                self._usernames[row] = moved
+                self._positions[moved] = row
+            self._usernames.pop()
+            return True
+
+    @timed('index_search')
+    def search(self, embedding, k=1):
+        """
+        Ищет ближайших пользователей к эмбеддингу.
+
+        Расстояние — евклидово между нормализованными векторами (euclidean_l2):
+        sqrt(2 - 2 * cos), от 0 (совпадение) до 2.
+
+        Аргументы:
+            embedding (list/array): Эмбеддинг запроса.
+            k (int): Число результатов.
+
+        Возвращает:
+            list[tuple[str, float]]: Пары (username, расстояние) по возрастанию расстояния.
+        """
+        query = quantization.normalize(embedding)[0]
+        self._sync_store()
+        with self._lock:
+            count = len(self._usernames)
+            if count == 0:
+                return []
+            k = min(k, count)
+            similarities = quantization.similarities(self._matrix[:count], self._scales[:count], query)
+            if k < count:
+                top = np.argpartition(-similarities, k - 1)[:k]
+            else:
+                top = np.arange(count)
+            top = top[np.argsort(-similarities[top])]
+            distances = quantization.l2_distances(similarities[top])
+            return [(self._usernames[i], float(d)) for i, d in zip(top, distances)]
@@ -0,0 +1,138 @@
+import threading
+import cv2
+import numpy as np
+from metrics import METRICS, timed
+
+TRACKER_FRAMES = METRICS.counter('tracker_frames_total', 'Frames handled by the face tracker.', ('mode',))
+
+
+class FaceTracker:
+    def __init__(self, face_auth, redetect_every=10, min_score=0.6, search_margin=0.5, quality_gate=None,
+                 inference=None):
+        """
+        Отслеживание лица на последовательных кадрах без полной детекции на каждом.
+
+        Полная детекция (DeepFace) выполняется на первом кадре, затем рамка лица
+        ведётся сопоставлением с шаблоном (cv2.matchTemplate) в окрестности прежней позиции.
+        Детектор запускается снова каждые redetect_every кадров или когда совпадение
+        с шаблоном падает ниже min_score. В модель эмбеддингов идёт только рамка, выровненная
+        по глазам последней детекции так же, как лицо при регистрации.
+
+        Аргументы:
+            face_auth (FaceAuth): Загруженные модели.
+            redetect_every (int): Полная детекция не реже, чем раз в столько кадров.
+            min_score (float): Минимальная оценка совпадения шаблона (TM_CCOEFF_NORMED, от -1 до 1).
+            search_margin (float): Размер окна поиска вокруг рамки в долях её размера.
+            quality_gate (FrameQualityGate): Фильтр кадров до любых вычислений; None — без фильтра.
+            inference (InferenceService): Очередь инференса для детекции и эмбеддингов; None — напрямую FaceAuth.
+        """
+        self.face_auth = face_auth
+        self.inference = inference
+        self.redetect_every = redetect_every
+        self.min_score = min_score
+        self.search_margin = search_margin
+        self.quality_gate = quality_gate
+        self._lock = threading.Lock()
+        self.reset()
+
+    def reset(self):
+        """Сбрасывает отслеживание: следующий кадр пройдёт полную детекцию."""
+        self._box = None  # (x, y, w, h)
+        self._template = None  # Лицо в оттенках серого на момент детекции
+        self._eyes = None  # Глаза (левый, правый) относительно рамки на момент детекции
+        self._frames_since_detection = 0
+        self._last_result = None
+
+    @staticmethod
+    def _gray(frame):
+        return cv2.cvtColor(frame, cv2.COLOR_BGR2GRAY) if frame.ndim == 3 else frame
+
+    @property
+    def _models(self):
+        """Сервис инференса, если он задан, иначе FaceAuth (методы detect_and_embed и embed_region)."""
+        return self.inference if self.inference is not None else self.face_auth
+
+    def _detect(self, frame):
+        """Полная детекция и эмбеддинг; обновляет рамку, шаблон и положение глаз."""
+        TRACKER_FRAMES.inc(mode='detect')
+        result = self._models.detect_and_embed(frame)
+        if result is None:
+            self.reset()
+            return None
+        area = result["facial_area"]
+        height, width = frame.shape[:2]
+        x, y = max(int(area["x"]), 0), max(int(area["y"]), 0)
+        w, h = min(int(area["w"]), width - x), min(int(area["h"]), height - y)
+        self._box = (x, y, w, h)
+        self._template = self._gray(frame)[y:y + h, x:x + w].copy()
+        left_eye, right_eye = area.get("left_eye"), area.get("right_eye")
+        self._eyes = None
+        if left_eye is not None and right_eye is not None:
+            self._eyes = ((left_eye[0] - x, left_eye[1] - y), (right_eye[0] - x, right_eye[1] - y))
+        self._frames_since_detection = 0
+        return {"box": self._box, "score": 1.0, "confidence": result["confidence"],
+                "embedding": result["embedding"], "tracked": False}
+
+    def _track_eyes(self, box):
+        """Глаза последней детекции, сдвинутые вместе с рамкой, в координатах кадра."""
+        if self._eyes is None:
+            return None
+        return tuple((box[0] + dx, box[1] + dy) for dx, dy in self._eyes)
+
+    @timed('track')
+    def _track(self, frame):
+        """
+        Ищет шаблон лица в окне вокруг прежней рамки.
+        Возвращает:
+            tuple[tuple, float]: Новая рамка и оценка совпадения.
+        """
+        x, y, w, h = self._box
+        height, width = frame.shape[:2]
+        margin_x, margin_y = int(w * self.search_margin), int(h * self.search_margin)
+        left, top = max(x - margin_x, 0), max(y - margin_y, 0)
+        right, bottom = min(x + w + margin_x, width), min(y + h + margin_y, height)
+        window = self._gray(frame[top:bottom, left:right])
+        if window.shape[0] < h or window.shape[1] < w:
+            return self._box, -1.0
+        scores = cv2.matchTemplate(window, self._template, cv2.TM_CCOEFF_NORMED)
+        _, score, _, location = cv2.minMaxLoc(scores)
+        return (left + location[0], top + location[1], w, h), float(score)
+
+    def process(self, frame, embed=True):
+        """
+        Обрабатывает очередной кадр потока.
+
+        Аргументы:
+            frame (numpy.ndarray): Кадр BGR (как Camera.get_frame()).
+            embed (bool): Считать ли эмбеддинг на отслеживаемых кадрах.
+
+        Возвращает:
+            dict | None: box, score, confidence, embedding, tracked (True, если детектор не запускался)
+            и reused (кадр не изменился — возвращён прошлый результат); rejected с причинами,
+            если кадр отклонён фильтром качества; None, если лицо не найдено.
+        """
+        frame = np.asarray(frame)
+        with self._lock:
+            if self.quality_gate is not None:
+                quality = self.quality_gate.check(frame, use_motion=True)
+                if not quality["ok"]:
+                    if quality["reasons"] == ['no_motion'] and self._last_result is not None:
+                        TRACKER_FRAMES.inc(mode='reused')
+                        return dict(self._last_result, reused=True)
+                    TRACKER_FRAMES.inc(mode='rejected')
+                    return {"rejected": quality["reasons"], "quality": quality}
+
+            self._frames_since_detection += 1
+            result = None
+            if self._box is not None and self._frames_since_detection < self.redetect_every:
+                box, score = self._track(frame)
+                if score >= self.min_score:
+                    TRACKER_FRAMES.inc(mode='track')
+                    self._box = box
+                    embedding = self._models.embed_region(frame, box, self._track_eyes(box)) if embed else None
+                    result = {"box": box, "score": score, "confidence": None,
+                              "embedding": embedding, "tracked": True}
+            if result is None:
+                result = self._detect(frame)
+            self._last_result = result
+            return result
@@ -0,0 +1,103 @@
+import threading
+import cv2
+import numpy as np
+from metrics import METRICS, timed
+
+FRAMES_REJECTED = METRICS.counter('frames_rejected_total', 'Frames rejected by the quality gate before inference.', ('reason',))
+
+# Тексты причин отказа для пользователя
+REASON_MESSAGES = {
+    'blurry': "Кадр размыт. Держите камеру неподвижно.",
+    'too_dark': "Кадр слишком тёмный. Добавьте освещения.",
+    'too_bright': "Кадр пересвечен. Уберите яркий источник света.",
+    'no_motion': "Кадр не изменился с предыдущего.",
+    'too_much_motion': "Слишком сильное движение в кадре.",
+}
+
+
+class FrameQualityGate:
+    def __init__(self, min_sharpness=40.0, min_brightness=40.0, max_brightness=220.0,
+                 min_motion=None, max_motion=None, size=160):
+        """
+        Быстрая проверка кадра перед вызовом DeepFace.
+
+        Оценки считаются на уменьшенной копии кадра в оттенках серого средствами OpenCV/NumPy:
+        резкость — дисперсия Лапласиана, яркость — среднее значение пикселя,
+        движение — средняя абсолютная разница с предыдущим кадром.
+
+        Аргументы:
+            min_sharpness (float): Минимальная дисперсия Лапласиана (ниже — кадр размыт).
+            min_brightness (float): Минимальная средняя яркость (0-255).
+            max_brightness (float): Максимальная средняя яркость (0-255).
+            min_motion (float): Минимальная разница с предыдущим кадром (ниже — кадр повторяется); None — не проверять.
+            max_motion (float): Максимальная разница с предыдущим кадром (выше — смазан движением); None — не проверять.
+            size (int): Ширина уменьшенной копии, на которой считаются оценки.
+        """
+        self.min_sharpness = min_sharpness
+        self.min_brightness = min_brightness
+        self.max_brightness = max_brightness
+        self.min_motion = min_motion
+        self.max_motion = max_motion
+        self.size = size
+        self._previous = None  # Уменьшенная копия предыдущего кадра для оценки движения
+        self._lock = threading.Lock()
+
+    def _downscale(self, frame):
+        """Уменьшенная копия кадра в оттенках серого."""
+        frame = np.asarray(frame)
+        if frame.dtype != np.uint8:
+            frame = np.clip(frame * 255.0 if frame.max() <= 1.0 else frame, 0, 255).astype(np.uint8)
+        gray = cv2.cvtColor(frame, cv2.COLOR_BGR2GRAY) if frame.ndim == 3 else frame
+        height, width = gray.shape[:2]
+        if width > self.size:
+            gray = cv2.resize(gray, (self.size, max(1, int(height * self.size / width))), interpolation=cv2.INTER_AREA)
+        return gray
+
+    @timed('quality_gate')
+    def check(self, frame, use_motion=True):
+        """
+        Оценивает кадр.
+
+        Аргументы:
+            frame (numpy.ndarray): Кадр (BGR/RGB или оттенки серого).
+            use_motion (bool): Сравнивать ли с предыдущим кадром (для живого потока).
+
+        Возвращает:
+            dict: ok (bool), reasons (коды причин отказа), sharpness, brightness, motion (или None).
+        """
+        small = self._downscale(frame)
+        sharpness = float(cv2.Laplacian(small, cv2.CV_64F).var())
+        brightness = float(small.mean())
+        motion = None
+        if use_motion:
+            with self._lock:
+                previous, self._previous = self._previous, small
+            if previous is not None and previous.shape == small.shape:
+                motion = float(cv2.absdiff(small, previous).mean())
+
+        reasons = []
+        if sharpness < self.min_sharpness:
+            reasons.append('blurry')
+        if brightness < self.min_brightness:
+            reasons.append('too_dark')
+        if brightness > self.max_brightness:
+            reasons.append('too_bright')
+        if motion is not None:
+            if self.min_motion is not None and motion < self.min_motion:
+                reasons.append('no_motion')
+            if self.max_motion is not None and motion > self.max_motion:
+                reasons.append('too_much_motion')
+        for reason in reasons:
+            FRAMES_REJECTED.inc(reason=reason)
+        return {"ok": not reasons, "reasons": reasons, "sharpness": sharpness,
+                "brightness": brightness, "motion": motion}
+
+    def reset(self):
+        """Забывает предыдущий кадр (например, при смене источника)."""
+        with self._lock:
+            self._previous = None
+
+    @staticmethod
+    def describe(reasons):
+        """Сообщение для пользователя по кодам причин отказа."""
+        return " ".join(REASON_MESSAGES.get(reason, reason) for reason in reasons)
@@ -0,0 +1,36 @@
+"""
+Настройки gunicorn для production-запуска:
+
+    gunicorn -c gunicorn.conf.py
+
+Переменные окружения:
+    FACE_BIND            — адрес (по умолчанию 0.0.0.0:5000);
+    FACE_WORKERS         — число процессов (по умолчанию 2);
+    FACE_THREADS         — потоков обработки запросов на процесс (по умолчанию 4);
+    FACE_TF_THREADS      — потоков TensorFlow внутри операции на процесс (по умолчанию ядра / FACE_WORKERS);
+    FACE_CAMERA_LOCK     — файл блокировки камеры (см. wsgi.py);
+    FACE_PRELOAD_MODELS  — 1, чтобы загружать модели до fork, а не в каждом воркере (см. wsgi.py).
+"""
+import os
+
+bind = os.environ.get('FACE_BIND', '0.0.0.0:5000')
+workers = int(os.environ.get('FACE_WORKERS', 2))
+threads = int(os.environ.get('FACE_THREADS', 4))
+worker_class = 'gthread'  # Потоки нужны для долгих ответов /video_stream
+wsgi_app = 'wsgi:create_app()'
+preload_app = True  # База и галерея загружаются один раз до fork (модели — только с FACE_PRELOAD_MODELS=1)
+timeout = 120  # Первый запрос воркера может ждать прогрева моделей
+graceful_timeout = 30
+
+# Потоки TensorFlow делятся между воркерами, чтобы процессы не конкурировали за ядра.
+# Переменные читаются при импорте TensorFlow, поэтому задаются здесь, до загрузки приложения.
+tf_threads = int(os.environ.get('FACE_TF_THREADS', max(1, (os.cpu_count() or 1) // workers)))
+os.environ.setdefault('TF_NUM_INTRAOP_THREADS', str(tf_threads))
+os.environ.setdefault('TF_NUM_INTEROP_THREADS', '2')
+os.environ.setdefault('OMP_NUM_THREADS', str(tf_threads))
+
+
+def post_fork(server, worker):
+    import wsgi
+    wsgi.post_fork()
+    server.log.info(f"Воркер {worker.pid} готов к приёму запросов.")
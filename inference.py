@@ -0,0 +1,214 @@
+import queue
+import threading
+import time
+from collections import Counter
+from concurrent.futures import Future, TimeoutError as FutureTimeout
+from metrics import METRICS, QUEUE_DEPTH
+
+BATCH_SIZE = METRICS.histogram('inference_batch_size', 'Requests processed per model batch.',
+                               buckets=(1, 2, 4, 8, 16, 32, 64))
+REJECTED = METRICS.counter('inference_rejected_total', 'Requests rejected because the queue was full.')
+TIMED_OUT = METRICS.counter('inference_timeouts_total', 'Requests abandoned after waiting longer than the timeout.')
+
+
+class ServiceOverloaded(Exception):
+    """Очередь инференса заполнена: запрос нужно отклонить (HTTP 503), а не ставить в ожидание."""
+
+
+class InferenceService:
+    def __init__(self, face_auth, workers=1, max_queue=32, max_batch=16, batch_window_ms=5.0, timeout=30.0):
+        """
+        Слой инференса между Web и FaceAuth.
+
+        Запросы из потоков Flask попадают в ограниченную очередь, которую разбирает фиксированное
+        число потоков-воркеров. Воркер собирает запросы, пришедшие в пределах batch_window_ms,
+        в один пакет и обрабатывает его одним вызовом detect_and_embed_many (рамки от трекера —
+        одним вызовом embed_regions). Так TensorFlow не запускается одновременно из каждого потока запроса.
+
+        Аргументы:
+            face_auth (FaceAuth): Загруженные модели.
+            workers (int): Число потоков-воркеров.
+            max_queue (int): Максимальная длина очереди; при переполнении submit бросает ServiceOverloaded.
+            max_batch (int): Максимальный размер пакета.
+            batch_window_ms (float): Сколько ждать дополнительные запросы после первого в пакете.
+            timeout (float): Максимальное время ожидания результата в detect_and_embed, секунды.
+        """
+        self.face_auth = face_auth
+        self.workers = workers
+        self.max_queue = max_queue
+        self.max_batch = max_batch
+        self.batch_window = batch_window_ms / 1000.0
+        self.timeout = timeout
+        self._queue = queue.Queue(maxsize=max_queue)
+        self._stats_lock = threading.Lock()
+        self._batch_sizes = Counter()  # размер пакета -> сколько раз встречался
+        self.requests = 0
+        self.rejected = 0
+        self.timed_out = 0
+        self._threads = []
+        self._lifecycle_lock = threading.Lock()  # start/stop из нескольких потоков не создают лишних воркеров
+        self.is_running = False
+        print(f"[LOG INFERENCE] Сервис инференса создан (воркеров: {workers}, очередь: {max_queue}, пакет: {max_batch}).")
+
+    def start(self):
+        """Запускает потоки-воркеры (один раз, даже при одновременных вызовах)."""
+        with self._lifecycle_lock:
+            if self.is_running:
+                return
+            for i in range(self.workers):
+                thread = threading.Thread(target=self._worker, name=f"inference-{i}", daemon=True)
+                thread.start()
+                self._threads.append(thread)
+            self.is_running = True
+        print("[LOG INFERENCE] Воркеры инференса запущены.")
+
+    def stop(self):
+        """Останавливает воркеры после обработки уже принятых запросов."""
+        with self._lifecycle_lock:
+            if not self.is_running:
+                return
+            self.is_running = False
+            for _ in self._threads:
+                self._queue.put(None)
+            for thread in self._threads:
+                thread.join()
+            self._threads = []
+        print("[LOG INFERENCE] Воркеры инференса остановлены.")
+
+    def _submit(self, job):
+        """Ставит задание в очередь; при переполнении бросает ServiceOverloaded."""
+        if not self.is_running:
+            self.start()
+        future = Future()
+        try:
+            self._queue.put_nowait((job, future))
+        except queue.Full:
+            with self._stats_lock:
+                self.rejected += 1
+            REJECTED.inc()
+            raise ServiceOverloaded(f"Очередь инференса заполнена ({self.max_queue}).")
+        with self._stats_lock:
+            self.requests += 1
+        return future
+
+    def _wait(self, future, timeout=None):
+        """
+        Ждёт результат задания. Если его нет за timeout, задание отменяется (воркер его пропустит)
+        и бросается ServiceOverloaded, как при переполненной очереди.
+        """
+        timeout = timeout or self.timeout
+        try:
+            return future.result(timeout=timeout)
+        except FutureTimeout:
+            future.cancel()
+            with self._stats_lock:
+                self.timed_out += 1
+            TIMED_OUT.inc()
+            raise ServiceOverloaded(f"Результат инференса не получен за {timeout:.1f}s.")
+
+    def submit(self, image):
+        """
+        Ставит изображение в очередь на детекцию и получение эмбеддинга.
+
+        Возвращает:
+            Future: Результат detect_and_embed (dict или None).
+        """
+        return self._submit(('detect', image))
+
+    def submit_region(self, image, box, eyes=None):
+        """
+        Ставит область кадра (рамку от трекера) в очередь на эмбеддинг без детекции.
+
+        Возвращает:
+            Future: Результат FaceAuth.embed_region (эмбеддинг float32).
+        """
+        return self._submit(('region', image, box, eyes))
+
+    def detect_and_embed(self, image, timeout=None):
+        """Синхронный вариант submit: ждёт и возвращает результат, как FaceAuth.detect_and_embed."""
+        return self._wait(self.submit(image), timeout)
+
+    def embed_region(self, image, box, eyes=None, timeout=None):
+        """Синхронный вариант submit_region: ждёт и возвращает результат, как FaceAuth.embed_region."""
+        return self._wait(self.submit_region(image, box, eyes), timeout)
+
+    def _collect_batch(self, first):
+        """Добирает в пакет запросы, пришедшие в течение batch_window после первого."""
+        batch = [first]
+        deadline = time.monotonic() + self.batch_window
+        while len(batch) < self.max_batch:
+            remaining = deadline - time.monotonic()
+            if remaining <= 0:
+                break
+            try:
+                item = self._queue.get(timeout=remaining)
+            except queue.Empty:
+                break
+            if item is None:
+                self._queue.put(None)  # Сигнал остановки вернётся этому же или другому воркеру
+                break
+            batch.append(item)
+        return batch
+
+    def _worker(self):
+        while True:
+            item = self._queue.get()
+            if item is None:
+                break
+            # Запросы, отменённые по таймауту, пока ждали в очереди, не обрабатываются
+            batch = [(job, future) for job, future in self._collect_batch(item)
+                     if future.set_running_or_notify_cancel()]
+            if not batch:
+                continue
+            with self._stats_lock:
+                self._batch_sizes[len(batch)] += 1
+            BATCH_SIZE.observe(len(batch))
+            QUEUE_DEPTH.set(self._queue.qsize())
+            detect = [(job, future) for job, future in batch if job[0] == 'detect']
+            regions = [(job, future) for job, future in batch if job[0] == 'region']
+            if detect:
+                self._run(detect, lambda jobs: self.face_auth.detect_and_embed_many(
+                    [job[1] for job in jobs], batch_size=self.max_batch))
+            if regions:
+                self._run(regions, lambda jobs: self.face_auth.embed_regions([job[1:] for job in jobs]),
+                          fail_on_error=True)
+
+    @staticmethod
+    def _run(batch, process, fail_on_error=False):
+        """
+        Обрабатывает пакет заданий одного вида и раздаёт результаты по Future.
+        - process: функция (список заданий) -> (результаты, ошибки {индекс: текст}).
+        - fail_on_error: завершать Future задания с ошибкой исключением ValueError, а не результатом None.
+        """
+        try:
+            results, failures = process([job for job, _ in batch])
+        except Exception as e:
+            print(f"[ОШИБКА INFERENCE] Ошибка обработки пакета из {len(batch)} запросов: {e}")
+            for _, future in batch:
+                future.set_exception(e)
+            return
+        for i, ((_, future), result) in enumerate(zip(batch, results)):
+            if fail_on_error and i in failures:
+                future.set_exception(ValueError(failures[i]))
+            else:
+                future.set_result(result)
+
+    def stats(self):
+        """
+        Возвращает:
+            dict: Глубина очереди, число запросов, отказов, таймаутов и пакетов, средний размер и гистограмма пакетов.
+        """
+        with self._stats_lock:
+            batches = sum(self._batch_sizes.values())
+            items = sum(size * count for size, count in self._batch_sizes.items())
+            return {
+                "queue_depth": self._queue.qsize(),
+                "max_queue": self.max_queue,
+                "workers": self.workers,
+                "requests": self.requests,
+                "rejected": self.rejected,
+                "timed_out": self.timed_out,
+                "batches": batches,
+                "avg_batch_size": items / batches if batches else 0.0,
+                "batch_sizes": dict(sorted(self._batch_sizes.items())),
+            }
@@ -1,44 +1,188 @@
-from web import Web
-from db import Database
-from camera import Camera
-from face_auth import FaceAuth
+"""
+Запуск приложения и служебные команды.
 
-def main():
-    """Основной запуск программы."""
-    print("[ЛОГ MAIN] Запуск основного модуля...")
+    python main.py                      — сервер разработки Flask (как раньше, то же, что serve);
+    python main.py serve --profile-only — создать все компоненты, вывести профиль запуска и выйти;
+    python main.py users                — список пользователей;
+    python main.py delete-user NAME     — удалить пользователя;
+    python main.py rebuild-store        — пересобрать хранилище эмбеддингов по базе.
+
+Служебные команды работают только с базой и не импортируют DeepFace/TensorFlow.
+"""
+import argparse
+import os
+from metrics import StartupProfile
+
+# С какого размера галереи точный поиск заменяется приближённым (IVF)
+ANN_MIN_USERS = 50000
+ANN_INDEX_PATH = "app.db.ivf"
+EMBEDDING_STORE_PATH = "app.db.store"
+# Хранение векторов индекса лиц: float32, float16 или int8 (см. quantization.py). Порог поиска
+# для режима берётся из калибровки quantization.py --check --write.
+QUANTIZATION_MODE = os.environ.get('FACE_QUANTIZATION', 'float32')
+
+
+def open_database(profile):
+    """Открывает базу вместе с хранилищем эмбеддингов."""
+    with profile.step("import db"):
+        from db import Database
+        from embedding_store import EmbeddingStore
+    with profile.step("init database"):
+        return Database(embedding_store=EmbeddingStore(EMBEDDING_STORE_PATH))
+
+
+def build_web(camera_lock_path=None, load_models=True, warm_up=True, profile=None):
+    """
+    Создаёт все компоненты приложения.
+
+    Аргументы:
+        camera_lock_path (str): Файл блокировки камеры для нескольких процессов (см. Camera); None — без блокировки.
+        load_models (bool): Загрузить веса моделей сразу (при preload в gunicorn — до fork).
+        warm_up (bool): Прогнать тестовое фото через модели; иначе прогрев выполнит Web.prepare().
+        profile (StartupProfile): Профиль, в который записываются времена шагов.
+
+    Возвращает:
+        Web | None: Веб-приложение или None, если инициализация не удалась.
+    """
+    profile = profile or StartupProfile()
+    with profile.step("import web"):
+        from web import Web
+        from camera import Camera
+        from broadcaster import StreamBroadcaster
+        from frame_quality import FrameQualityGate
+    with profile.step("import index"):
+        from face_index import FaceIndex
+        from ann_index import IVFIndex
+    with profile.step("import face_auth"):
+        import face_auth as face_auth_module  # Без DeepFace: он импортируется отдельным шагом ниже
+        from embedding_cache import EmbeddingCache
+        from inference import InferenceService
+        from face_tracker import FaceTracker
 
     try:
         print("[ЛОГ MAIN] Инициализация базы данных...")
-        db = Database()
+        db = open_database(profile)
         print("[ЛОГ MAIN] База данных успешно инициализирована.")
     except Exception as e:
         print(f"[ERROR MAIN] ERROR при инициализации базы данных: {e}")
-        return
+        return None
+
+    try:
+        print("[ЛОГ MAIN] Построение индекса лиц...")
+        with profile.step("init face_index"):
+            if len(db.get_usernames()) >= ANN_MIN_USERS:
+                face_index = IVFIndex.from_database(db, ANN_INDEX_PATH, quantization_mode=QUANTIZATION_MODE)
+            else:
+                face_index = FaceIndex.from_database(db, quantization_mode=QUANTIZATION_MODE)
+        print("[ЛОГ MAIN] Индекс лиц успешно построен.")
+    except Exception as e:
+        print(f"[ERROR MAIN] ERROR при построении индекса лиц: {e}")
+        return None
 
     try:
         print("[ЛОГ MAIN] Инициализация камеры...")
-        camera = Camera()
+        with profile.step("init camera"):
+            camera = Camera(threaded=True, lock_path=camera_lock_path)
+            broadcaster = StreamBroadcaster(camera)
         print("[ЛОГ MAIN] Камера успешно инициализирована.")
     except Exception as e:
         print(f"[ERROR MAIN] ERROR при инициализации камеры: {e}")
-        return
+        return None
 
     try:
         print("[ЛОГ MAIN] Инициализация FaceAuth...")
-        face_auth = FaceAuth()
+        with profile.step("init face_auth"):
+            face_auth = face_auth_module.FaceAuth(cache=EmbeddingCache(max_entries=10000))
+            inference = InferenceService(face_auth)
+        if load_models or warm_up:
+            with profile.step("import deepface"):
+                face_auth_module.import_deepface()
+            print("[ЛОГ MAIN] Загрузка моделей...")
+            with profile.step("load models"):
+                face_auth.load_models()
+        if warm_up:
+            print("[ЛОГ MAIN] Прогрев моделей...")
+            with profile.step("warm up"):
+                face_auth.warm_up()
         print("[ЛОГ MAIN] FaceAuth успешно инициализирован.")
     except Exception as e:
         print(f"[ERROR MAIN] ERROR при инициализации FaceAuth: {e}")
-        return
+        return None
 
     try:
-        print("[ЛОГ MAIN] Создание и запуск веб-сервера...")
-        web = Web(db, camera, face_auth)
+        print("[ЛОГ MAIN] Создание веб-сервера...")
+        with profile.step("init web"):
+            tracker = FaceTracker(face_auth, quality_gate=FrameQualityGate(min_motion=0.5), inference=inference)
+            web = Web(db, camera, face_auth, face_index, broadcaster, inference,
+                      quality_gate=FrameQualityGate(), tracker=tracker)
         print("[ЛОГ MAIN] Веб-сервер успешно создан.")
+    except Exception as e:
+        print(f"[ERROR MAIN] ERROR при создании веб-сервера: {e}")
+        return None
+    return web
+
+
+def serve(args, profile):
+    """Сервер разработки Flask (один процесс)."""
+    print("[ЛОГ MAIN] Запуск основного модуля...")
+    web = build_web(warm_up=not args.lazy_models, load_models=not args.lazy_models, profile=profile)
+    print(f"[ЛОГ MAIN] Профиль запуска:\n{profile.report()}")
+    if web is None or args.profile_only:
+        return
+    try:
+        print("[ЛОГ MAIN] Запуск веб-сервера...")
         web.run()
     except Exception as e:
         print(f"[ERROR MAIN] ERROR при запуске веб-сервера: {e}")
-        return
+
+
+def list_users(args, profile):
+    db = open_database(profile)
+    usernames = sorted(db.get_usernames())
+    for username in usernames:
+        print(username)
+    print(f"[ЛОГ MAIN] Пользователей: {len(usernames)}.")
+
+
+def delete_user(args, profile):
+    db = open_database(profile)
+    if not db.delete_user(args.username):
+        raise SystemExit(1)
+    # Работающие воркеры читают приближённый индекс с диска: удаление попадает в него сразу
+    if os.path.exists(os.path.join(ANN_INDEX_PATH, 'meta.json')):
+        from ann_index import IVFIndex
+        IVFIndex(ANN_INDEX_PATH).remove(args.username)
+
+
+def rebuild_store(args, profile):
+    db = open_database(profile)
+    with profile.step("rebuild store"):
+        db.rebuild_embedding_store()
+
+
+def main():
+    """Основной запуск программы."""
+    profile = StartupProfile()
+    parser = argparse.ArgumentParser(description="Сервер распознавания лиц и служебные команды.")
+    commands = parser.add_subparsers(dest="command")
+    serve_parser = commands.add_parser("serve", help="Сервер разработки Flask (по умолчанию).")
+    serve_parser.add_argument("--profile-only", action="store_true", help="Создать компоненты, вывести профиль и выйти.")
+    serve_parser.add_argument("--lazy-models", action="store_true",
+                              help="Не загружать модели при запуске (загрузятся перед приёмом запросов).")
+    serve_parser.set_defaults(handler=serve)
+    commands.add_parser("users", help="Список пользователей.").set_defaults(handler=list_users)
+    delete_parser = commands.add_parser("delete-user", help="Удалить пользователя.")
+    delete_parser.add_argument("username")
+    delete_parser.set_defaults(handler=delete_user)
+    commands.add_parser("rebuild-store", help="Пересобрать хранилище эмбеддингов.").set_defaults(handler=rebuild_store)
+    args = parser.parse_args()
+    if args.command is None:
+        args = parser.parse_args(["serve"])
+
+    args.handler(args, profile)
+    if args.handler is not serve:
+        print(f"[ЛОГ MAIN] Профиль запуска:\n{profile.report()}")
+
 
 if __name__ == "__main__":
     main()
@@ -0,0 +1,235 @@
+import bisect
+import threading
+import time
+from contextlib import contextmanager
+
+# Границы корзин гистограмм задержек (секунды)
+DEFAULT_BUCKETS = (0.0005, 0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0)
+
+
+def _escape(value):
+    """Экранирует значение метки для текстового формата Prometheus."""
+    return str(value).replace('\\', '\\\\').replace('"', '\\"').replace('\n', '\\n')
+
+
+def _format_labels(labelnames, values, extra=None):
+    pairs = [f'{name}="{_escape(value)}"' for name, value in zip(labelnames, values)]
+    if extra:
+        pairs.append(extra)
+    return "{" + ",".join(pairs) + "}" if pairs else ""
+
+
+def _format_number(value):
+    if value == float('inf'):
+        return "+Inf"
+    return repr(float(value)) if isinstance(value, float) else str(value)
+
+
+class Counter:
+    def __init__(self, name, documentation, labelnames=()):
+        """Монотонный счётчик с метками."""
+        self.name = name
+        self.documentation = documentation
+        self.labelnames = tuple(labelnames)
+        self._values = {}
+        self._lock = threading.Lock()
+
+    def inc(self, amount=1, **labels):
+        key = tuple(str(labels.get(name, "")) for name in self.labelnames)
+        with self._lock:
+            self._values[key] = self._values.get(key, 0) + amount
+
+    def render(self):
+        lines = [f"# HELP {self.name} {self.documentation}", f"# TYPE {self.name} counter"]
+        with self._lock:
+            for key, value in sorted(self._values.items()):
+                lines.append(f"{self.name}{_format_labels(self.labelnames, key)} {_format_number(value)}")
+        return lines
+
+
+class Gauge:
+    def __init__(self, name, documentation, labelnames=()):
+        """Текущее значение с метками (глубина очереди, число клиентов и т.п.)."""
+        self.name = name
+        self.documentation = documentation
+        self.labelnames = tuple(labelnames)
+        self._values = {}
+        self._lock = threading.Lock()
+
+    def set(self, value, **labels):
+        key = tuple(str(labels.get(name, "")) for name in self.labelnames)
+        with self._lock:
+            self._values[key] = value
+
+    def render(self):
+        lines = [f"# HELP {self.name} {self.documentation}", f"# TYPE {self.name} gauge"]
+        with self._lock:
+            for key, value in sorted(self._values.items()):
+                lines.append(f"{self.name}{_format_labels(self.labelnames, key)} {_format_number(value)}")
+        return lines
+
+
+class Histogram:
+    def __init__(self, name, documentation, labelnames=(), buckets=DEFAULT_BUCKETS):
+        """Гистограмма с фиксированными корзинами, суммой и количеством наблюдений."""
+        self.name = name
+        self.documentation = documentation
+        self.labelnames = tuple(labelnames)
+        self.buckets = tuple(sorted(buckets))
+        self._values = {}  # метки -> [счётчики по корзинам, сумма, количество]
+        self._lock = threading.Lock()
+
+    def observe(self, value, **labels):
+        key = tuple(str(labels.get(name, "")) for name in self.labelnames)
+        index = bisect.bisect_left(self.buckets, value)
+        with self._lock:
+            state = self._values.get(key)
+            if state is None:
+                state = self._values[key] = [[0] * len(self.buckets), 0.0, 0]
+            if index < len(self.buckets):
+                state[0][index] += 1
+            state[1] += value
+            state[2] += 1
+
+    def render(self):
+        lines = [f"# HELP {self.name} {self.documentation}", f"# TYPE {self.name} histogram"]
+        with self._lock:
+            for key, (counts, total, count) in sorted(self._values.items()):
+                cumulative = 0
+                for bound, bucket_count in zip(self.buckets, counts):
+                    cumulative += bucket_count
+                    labels = _format_labels(self.labelnames, key, f'le="{_format_number(float(bound))}"')
+                    lines.append(f"{self.name}_bucket{labels} {cumulative}")
+                labels = _format_labels(self.labelnames, key, 'le="+Inf"')
+                lines.append(f"{self.name}_bucket{labels} {count}")
+                lines.append(f"{self.name}_sum{_format_labels(self.labelnames, key)} {_format_number(total)}")
+                lines.append(f"{self.name}_count{_format_labels(self.labelnames, key)} {count}")
+        return lines
+
+
+class MetricsRegistry:
+    def __init__(self):
+        """Реестр метрик процесса; отдаётся эндпоинтом /metrics в текстовом формате Prometheus."""
+        self._metrics = {}
+        self._lock = threading.Lock()
+
+    def _get_or_create(self, cls, name, documentation, labelnames, **kwargs):
+        with self._lock:
+            metric = self._metrics.get(name)
+            if metric is None:
+                metric = self._metrics[name] = cls(name, documentation, labelnames, **kwargs)
+            elif not isinstance(metric, cls):
+                raise ValueError(f"Метрика '{name}' уже зарегистрирована с другим типом.")
+            return metric
+
+    def counter(self, name, documentation, labelnames=()):
+        return self._get_or_create(Counter, name, documentation, labelnames)
+
+    def gauge(self, name, documentation, labelnames=()):
+        return self._get_or_create(Gauge, name, documentation, labelnames)
+
+    def histogram(self, name, documentation, labelnames=(), buckets=DEFAULT_BUCKETS):
+        return self._get_or_create(Histogram, name, documentation, labelnames, buckets=buckets)
+
+    def render(self):
+        """Возвращает все метрики в текстовом формате Prometheus."""
+        with self._lock:
+            metrics = list(self._metrics.values())
+        lines = []
+        for metric in metrics:
+            lines.extend(metric.render())
+        return "\n".join(lines) + "\n"
+
+
+METRICS = MetricsRegistry()
+
+STAGE_SECONDS = METRICS.histogram(
+    'face_stage_seconds', 'Latency of processing stages (capture, jpeg_encode, detect, embed, compare, db_query, db_commit).',
+    ('stage',))
+STAGE_ERRORS = METRICS.counter('face_stage_errors_total', 'Stages that raised an exception.', ('stage',))
+REQUEST_SECONDS = METRICS.histogram(
+    'http_request_seconds', 'Whole-request latency per route.', ('route', 'method', 'status'))
+QUEUE_DEPTH = METRICS.gauge('inference_queue_depth', 'Requests waiting in the inference queue.')
+STARTUP_SECONDS = METRICS.gauge('startup_seconds', 'Time spent in each startup step (imports, component init).', ('step',))
+
+# Разбивка времени текущего HTTP-запроса по стадиям (для заголовка Server-Timing)
+_request_local = threading.local()
+
+
+def start_request():
+    """Начинает сбор разбивки по стадиям для запроса в текущем потоке."""
+    _request_local.timings = []
+
+
+def finish_request():
+    """
+    Завершает сбор разбивки.
+    Возвращает:
+        list[tuple[str, float]]: Пары (стадия, секунды) в порядке выполнения или [] вне запроса.
+    """
+    timings = getattr(_request_local, 'timings', None) or []
+    _request_local.timings = None
+    return timings
+
+
+def record(stage, seconds):
+    """Записывает длительность стадии в гистограмму и в разбивку текущего запроса."""
+    STAGE_SECONDS.observe(seconds, stage=stage)
+    timings = getattr(_request_local, 'timings', None)
+    if timings is not None:
+        timings.append((stage, seconds))
+
+
+@contextmanager
+def timed(stage):
+    """
+    Замеряет блок кода (или функцию, если использовать как декоратор) как стадию stage.
+
+    Пример:
+        with timed('detect'):
+            faces = DeepFace.extract_faces(...)
+    """
+    start = time.perf_counter()
+    try:
+        yield
+    except Exception:
+        STAGE_ERRORS.inc(stage=stage)
+        raise
+    finally:
+        record(stage, time.perf_counter() - start)
+
+
+class StartupProfile:
+    def __init__(self):
+        """Профиль запуска: время импортов и инициализации каждого компонента."""
+        self.steps = []  # Пары (шаг, секунды) в порядке выполнения
+        self._start = time.perf_counter()
+
+    @contextmanager
+    def step(self, name):
+        """Замеряет шаг запуска; время попадает и в профиль, и в метрику startup_seconds."""
+        start = time.perf_counter()
+        try:
+            yield
+        finally:
+            seconds = time.perf_counter() - start
+            self.steps.append((name, seconds))
+            STARTUP_SECONDS.set(seconds, step=name)
+
+    def report(self):
+        """Текст профиля: шаги по порядку и общее время с момента создания профиля."""
+        width = max((len(name) for name, _ in self.steps), default=0)
+        lines = [f"  {name:<{width}}  {seconds * 1000:8.1f} ms" for name, seconds in self.steps]
+        lines.append(f"  {'всего':<{width}}  {(time.perf_counter() - self._start) * 1000:8.1f} ms")
+        return "\n".join(lines)
+
+
+def server_timing_header(timings):
+    """
+    Формирует заголовок Server-Timing из разбивки запроса; повторы одной стадии суммируются.
+    Пример: 'detect;dur=41.2, embed;dur=88.0'
+    """
+    totals = {}
+    for stage, seconds in timings:
+        totals[stage] = totals.get(stage, 0.0) + seconds
+    return ", ".join(f"{stage};dur={seconds * 1000:.1f}" for stage, seconds in totals.items())
@@ -0,0 +1,210 @@
+"""
+Компактное представление эмбеддингов для больших галерей.
+
+Режимы:
+    float32 — без сжатия (4 байта на компоненту);
+    float16 — половинная точность (2 байта, память в 2 раза меньше);
+    int8    — 1 байт на компоненту и масштаб float32 на вектор (около 4 раз меньше).
+
+Векторы перед квантованием нормализуются по L2, поэтому расстояние считается как euclidean_l2
+(sqrt(2 - 2 * cos)), а масштаб int8 — max|x| / 127 для каждого вектора.
+
+Проверка точности на фото из репозитория и запись порогов по режимам в thresholds.json
+(их применяет поиск 1:N, см. FaceAuth.identification_threshold):
+    python quantization.py --check --threshold 0.8 --write
+"""
+import argparse
+import itertools
+import os
+import time
+
+import numpy as np
+
+QUANTIZATION_MODES = ('float32', 'float16', 'int8')
+
+# Сколько строк переводится в float32 за раз при поиске (ограничивает временную память)
+SCORE_CHUNK = 65536
+
+
+def normalize(vectors):
+    """Приводит векторы к float32 и нормализует строки по L2."""
+    vectors = np.atleast_2d(np.asarray(vectors, dtype=np.float32))
+    norms = np.linalg.norm(vectors, axis=1, keepdims=True)
+    norms[norms == 0] = 1.0
+    return vectors / norms
+
+
+def storage_dtype(mode):
+    """Тип элементов матрицы для режима квантования."""
+    if mode not in QUANTIZATION_MODES:
+        raise ValueError(f"Неизвестный режим квантования: {mode}. Доступны: {QUANTIZATION_MODES}")
+    return {'float32': np.float32, 'float16': np.float16, 'int8': np.int8}[mode]
+
+
+def quantize(vectors, mode):
+    """
+    Нормализует и квантует векторы.
+
+    Аргументы:
+        vectors (array): Матрица эмбеддингов (n, dim).
+        mode (str): 'float32', 'float16' или 'int8'.
+
+    Возвращает:
+        tuple[numpy.ndarray, numpy.ndarray]: Коды (n, dim) в storage_dtype(mode) и масштабы (n,) float32
+        (для float-режимов масштабы равны 1).
+    """
+    vectors = normalize(vectors)
+    scales = np.ones(len(vectors), dtype=np.float32)
+    if mode == 'int8':
+        scales = np.abs(vectors).max(axis=1) / 127.0
+        scales[scales == 0] = 1.0
+        codes = np.clip(np.rint(vectors / scales[:, None]), -127, 127).astype(np.int8)
+        return codes, scales.astype(np.float32)
+    return vectors.astype(storage_dtype(mode)), scales
+
+
+def dequantize(codes, scales):
+    """Восстанавливает векторы float32 из кодов и масштабов."""
+    return codes.astype(np.float32) * scales[:, None]
+
+
+def similarities(codes, scales, query, chunk=SCORE_CHUNK):
+    """
+    Косинусные сходства запроса со всеми строками квантованной матрицы.
+
+    Строки переводятся в float32 блоками по chunk, поэтому в памяти постоянно хранится
+    только компактная матрица.
+
+    Аргументы:
+        codes (numpy.ndarray): Квантованная матрица (n, dim).
+        scales (numpy.ndarray): Масштабы строк (n,).
+        query (numpy.ndarray): Нормализованный запрос float32 (dim,).
+
+    Возвращает:
+        numpy.ndarray: Сходства (n,) float32.
+    """
+    if codes.dtype == np.float32:
+        return codes @ query
+    result = np.empty(len(codes), dtype=np.float32)
+    for start in range(0, len(codes), chunk):
+        block = codes[start:start + chunk].astype(np.float32)
+        result[start:start + chunk] = (block @ query) * scales[start:start + chunk]
+    return result
+
+
+def l2_distances(similarity):
+    """Переводит косинусное сходство нормализованных векторов в расстояние euclidean_l2."""
+    return np.sqrt(np.maximum(2.0 - 2.0 * similarity, 0.0))
+
+
+def pairwise_distances(embeddings, mode):
+    """Матрица расстояний euclidean_l2 между всеми парами после квантования в режиме mode."""
+    codes, scales = quantize(embeddings, mode)
+    restored = dequantize(codes, scales)
+    return l2_distances(restored @ restored.T)
+
+
+def calibrate_thresholds(embeddings, base_threshold, modes=QUANTIZATION_MODES):
+    """
+    Подбирает порог для каждого режима квантования по эталону float32.
+
+    Порог сдвигается на среднюю ошибку расстояния режима относительно float32,
+    а затем проверяется, насколько решения «тот же человек / другой» совпадают с эталонными.
+
+    Аргументы:
+        embeddings (array): Эмбеддинги для калибровки (n, dim), n >= 2.
+        base_threshold (float): Порог euclidean_l2 для float32.
+
+    Возвращает:
+        dict: {режим: {threshold, mean_error, max_abs_error, agreement, bytes_per_vector}}.
+    """
+    embeddings = np.asarray(embeddings, dtype=np.float32)
+    upper = np.triu_indices(len(embeddings), k=1)
+    reference = pairwise_distances(embeddings, 'float32')[upper]
+    reference_decisions = reference <= base_threshold
+    report = {}
+    for mode in modes:
+        distances = pairwise_distances(embeddings, mode)[upper]
+        error = distances - reference
+        threshold = float(base_threshold + error.mean())
+        report[mode] = {
+            "threshold": threshold,
+            "mean_error": float(error.mean()),
+            "max_abs_error": float(np.abs(error).max()),
+            "agreement": float(((distances <= threshold) == reference_decisions).mean()),
+            "bytes_per_vector": embeddings.shape[1] * np.dtype(storage_dtype(mode)).itemsize
+                                + (4 if mode == 'int8' else 0),
+        }
+    return report
+
+
+def check_fixtures(threshold, paths=None, model_name='Facenet'):
+    """
+    Проверка точности на фото из репозитория: эмбеддинги float32 против квантованных.
+    Возвращает:
+        dict: Отчёт calibrate_thresholds и расстояния по парам фото в каждом режиме.
+    """
+    from face_auth import FaceAuth
+    base_dir = os.path.dirname(os.path.abspath(__file__))
+    paths = paths or [os.path.join(base_dir, name) for name in ('ruslan.jpeg', 'ruslan2.jpeg', 'damir.jpeg')]
+    embeddings, failures = FaceAuth(model_name=model_name).get_embeddings(paths)
+    if failures:
+        raise RuntimeError(f"Не удалось получить эмбеддинги: {failures}")
+    embeddings = np.stack(embeddings)
+    pairs = {}
+    for mode in QUANTIZATION_MODES:
+        distances = pairwise_distances(embeddings, mode)
+        for i, j in itertools.combinations(range(len(paths)), 2):
+            pair = f"{os.path.basename(paths[i])}~{os.path.basename(paths[j])}"
+            pairs.setdefault(pair, {})[mode] = round(float(distances[i, j]), 6)
+    return {"calibration": calibrate_thresholds(embeddings, threshold), "pairs": pairs}
+
+
+def write_thresholds(model_name, calibration, base_threshold, path=None):
+    """
+    Записывает пороги по режимам квантования в запись модели конфига FaceAuth (поле identification).
+    Возвращает:
+        dict: Запись модели.
+    """
+    from face_auth import THRESHOLDS_PATH, update_calibration
+    return update_calibration(model_name, path or THRESHOLDS_PATH, identification={
+        "distance_metric": "euclidean_l2",
+        "base_threshold": base_threshold,
+        "thresholds": {mode: stats["threshold"] for mode, stats in calibration.items()},
+        "calibrated_at": time.strftime("%Y-%m-%d %H:%M:%S"),
+    })
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Проверка квантования эмбеддингов.")
+    parser.add_argument("--check", action="store_true", help="Сравнить режимы на фото из репозитория (нужен DeepFace).")
+    parser.add_argument("--synthetic", type=int, default=1000, help="Без --check: сравнить режимы на N случайных векторах.")
+    parser.add_argument("--threshold", type=float, default=0.8, help="Порог euclidean_l2 для float32.")
+    parser.add_argument("--dim", type=int, default=128)
+    parser.add_argument("--model", default="Facenet")
+    parser.add_argument("--write", action="store_true",
+                        help="С --check: записать пороги по режимам в конфиг порогов FaceAuth.")
+    parser.add_argument("--thresholds", default=None, help="Конфиг порогов (по умолчанию thresholds.json).")
+    args = parser.parse_args()
+
+    if args.write and not args.check:
+        parser.error("--write требует --check: пороги по случайным векторам не записываются.")
+    if args.check:
+        report = check_fixtures(args.threshold, model_name=args.model)
+        for pair, distances in report["pairs"].items():
+            print(f"[RESULT] {pair}: {distances}")
+        calibration = report["calibration"]
+    else:
+        rng = np.random.default_rng(0)
+        calibration = calibrate_thresholds(rng.standard_normal((max(args.synthetic, 2), args.dim)), args.threshold)
+    for mode, stats in calibration.items():
+        print(f"[RESULT] {mode}: порог {stats['threshold']:.4f}, средняя ошибка {stats['mean_error']:+.5f}, "
+              f"макс. ошибка {stats['max_abs_error']:.5f}, совпадение решений {stats['agreement']:.2%}, "
+              f"{stats['bytes_per_vector']} байт на вектор")
+    if args.write:
+        entry = write_thresholds(args.model, calibration, args.threshold, args.thresholds)
+        print(f"[RESULT] Пороги идентификации записаны для {args.model}: {entry['identification']['thresholds']}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,212 @@
+"""
+Протокол каталогов, которые одновременно открывают все процессы сервера (gunicorn):
+хранилище эмбеддингов (embedding_store.py) и приближённый индекс (ann_index.py).
+
+Каталог:
+    *.npy          — массивы по строкам (capacity, ...), открываются через np.memmap;
+    usernames.txt  — имя пользователя строки (по одному в строке файла, только дописывается);
+    meta.json      — dim, ёмкость, число строк и удалений, размер usernames.txt, версия и поколение
+                     (и поля конкретного каталога);
+    lock           — файл блокировки записи.
+
+Запись сериализуется между потоками RLock, а между процессами — flock файла lock. Строки
+и usernames.txt сбрасываются на диск до атомарной записи meta.json, поэтому читатели видят
+только строки, опубликованные целиком. Версия растёт при каждой публикации, поколение меняется
+при записи каталога заново: по ним процесс решает, дочитать новые строки или переоткрыть файлы.
+"""
+import json
+import os
+import threading
+import time
+from contextlib import contextmanager
+
+import numpy as np
+
+try:
+    import fcntl
+except ImportError:  # Windows: запись защищена только между потоками одного процесса
+    fcntl = None
+
+
+@contextmanager
+def file_lock(path):
+    """Блокировка записи каталога path между процессами (flock файла lock)."""
+    with open(os.path.join(path, 'lock'), 'a') as lock_file:
+        if fcntl is not None:
+            fcntl.flock(lock_file, fcntl.LOCK_EX)
+        yield
+
+
+def write_meta(path, **meta):
+    """Атомарно записывает meta.json — точку публикации изменений для всех процессов."""
+    tmp_path = os.path.join(path, 'meta.json.tmp')
+    with open(tmp_path, 'w', encoding='utf-8') as f:
+        json.dump(meta, f)
+    os.replace(tmp_path, os.path.join(path, 'meta.json'))
+
+
+def write_usernames(path, usernames):
+    """
+    Записывает usernames.txt.tmp для нового каталога.
+    Возвращает:
+        int: Размер файла в байтах (usernames_size для meta.json).
+    """
+    data = ''.join(f"{username}\n" for username in usernames).encode('utf-8')
+    with open(os.path.join(path, 'usernames.txt.tmp'), 'wb') as f:
+        f.write(data)
+    return len(data)
+
+
+def install(path, names, **meta):
+    """
+    Подменяет файлы names записанными рядом файлами .tmp и публикует meta.json нового поколения.
+    Вызывается под file_lock: процессы, у которых каталог уже открыт, переоткроют его при следующем refresh.
+    """
+    for name in names:
+        os.replace(os.path.join(path, name + '.tmp'), os.path.join(path, name))
+    write_meta(path, **meta, removed=0, version=0, generation=time.time_ns())
+
+
+class SharedDirectory:
+    """
+    Общая часть EmbeddingStore и IVFIndex: meta.json, usernames.txt, блокировка записи и refresh.
+
+    Наследник задаёт:
+        _open_arrays(meta) — отображает свои массивы в память;
+        _capacity()        — ёмкость массивов (число строк);
+        _index_rows()      — строит словарь _positions (username -> строка) по живым строкам;
+        _index_added(first, added) — добавляет в _positions строки, дописанные другим процессом.
+    """
+
+    def __init__(self, path):
+        self.path = path
+        self._lock = threading.RLock()
+        self._lock_file = None  # Открытый файл lock, пока этот процесс держит блокировку записи
+        self._positions = {}
+
+    def _file(self, name):
+        return os.path.join(self.path, name)
+
+    def __len__(self):
+        return len(self._positions)
+
+    def __contains__(self, username):
+        return username in self._positions
+
+    def _read_meta(self):
+        with open(self._file('meta.json'), encoding='utf-8') as f:
+            meta = json.load(f)
+        # Каталог, записанный до появления версий: usernames.txt читается целиком
+        if "version" not in meta:
+            meta.update(usernames_size=os.path.getsize(self._file('usernames.txt')), version=0, generation=0)
+        meta.setdefault("removed", 0)  # Записан до счётчика удалений
+        return meta
+
+    def _meta(self):
+        """Поля meta.json открытого каталога."""
+        return {"dim": self.dim, "capacity": self._capacity(), "count": self.count,
+                "usernames_size": self._usernames_size, "removed": self._removed,
+                "version": self._version, "generation": self._generation}
+
+    def _publish(self):
+        """Увеличивает версию и записывает meta.json после того, как данные сброшены на диск."""
+        self._version += 1
+        write_meta(self.path, **self._meta())
+
+    def _open(self):
+        """Отображает файлы в память по meta.json и строит словарь строк."""
+        meta = self._read_meta()
+        self.dim = meta["dim"]
+        self.count = meta["count"]  # Число записанных строк (включая удалённые)
+        self._usernames_size = meta["usernames_size"]
+        self._removed = meta["removed"]
+        self._version = meta["version"]
+        self._generation = meta["generation"]
+        self._open_arrays(meta)
+        with open(self._file('usernames.txt'), 'rb') as f:
+            self._usernames = f.read(self._usernames_size).decode('utf-8').split('\n')[:self.count]
+        self._index_rows()
+
+    def refresh(self):
+        """
+        Подхватывает изменения, опубликованные другими процессами.
+        Дописанные строки читаются инкрементально; после удалений словарь строк строится заново,
+        а при новом поколении или ёмкости файлы переоткрываются.
+        """
+        with self._lock:
+            meta = self._read_meta()
+            if meta["version"] == self._version and meta["generation"] == self._generation:
+                return
+            if meta["generation"] != self._generation or meta.get("capacity", self._capacity()) != self._capacity():
+                self._open()
+                return
+            with open(self._file('usernames.txt'), 'rb') as f:
+                f.seek(self._usernames_size)
+                data = f.read(meta["usernames_size"] - self._usernames_size)
+            added = data.decode('utf-8').split('\n')[:meta["count"] - self.count]
+            first = self.count
+            self._usernames.extend(added)
+            self.count = meta["count"]
+            self._usernames_size = meta["usernames_size"]
+            self._version = meta["version"]
+            if meta["removed"] != self._removed:
+                self._removed = meta["removed"]
+                self._index_rows()
+                return
+            self._index_added(first, added)
+
+    @contextmanager
+    def _write_lock(self):
+        """
+        Блокировка записи: между потоками — self._lock, между процессами — flock файла lock.
+        После захвата каталог обновляется, чтобы запись шла с настоящего числа строк на диске.
+        Вложенные вызовы в том же потоке блокировку не перезахватывают.
+        """
+        with self._lock:
+            if self._lock_file is not None:
+                yield
+                return
+            lock_file = open(self._file('lock'), 'a')
+            try:
+                if fcntl is not None:
+                    fcntl.flock(lock_file, fcntl.LOCK_EX)
+                self._lock_file = lock_file
+                self.refresh()
+                yield
+            finally:
+                self._lock_file = None
+                lock_file.close()
+
+    def _append_usernames(self, usernames):
+        """Дописывает имена строк в usernames.txt с опубликованного размера (под блокировкой записи, без публикации)."""
+        data = ''.join(f"{username}\n" for username in usernames).encode('utf-8')
+        with open(self._file('usernames.txt'), 'r+b') as f:
+            f.seek(self._usernames_size)
+            f.write(data)
+            f.truncate()  # Хвост от незавершённой записи отбрасывается
+        self._usernames.extend(usernames)
+        self.count += len(usernames)
+        self._usernames_size += len(data)
+
+    def _grow_arrays(self, arrays):
+        """
+        Удваивает ёмкость массивов (под блокировкой записи) и публикует её.
+        - arrays: список (атрибут, имя файла, значение новых строк).
+        """
+        capacity = self._capacity() * 2
+        for attribute, name, fill in arrays:
+            old = getattr(self, attribute)
+            grown = np.lib.format.open_memmap(self._file(name + '.tmp'), mode='w+', dtype=old.dtype,
+                                              shape=(capacity,) + old.shape[1:])
+            grown[:] = fill
+            grown[:len(old)] = old
+            grown.flush()
+            del grown
+            old.flush()
+        for attribute, _, _ in arrays:
+            setattr(self, attribute, None)
+        for attribute, name, _ in arrays:
+            os.replace(self._file(name + '.tmp'), self._file(name))
+            setattr(self, attribute, np.load(self._file(name), mmap_mode='r+'))
+        # Новая ёмкость сразу попадает в meta.json, чтобы другие процессы переоткрыли файлы
+        self._publish()
@@ -1,12 +1,26 @@
-from flask import Flask, render_template, request, redirect, url_for, Response, flash
+import time
+import cv2
+from flask import Flask, render_template, request, redirect, url_for, Response, flash, jsonify, g
+from inference import ServiceOverloaded
+from camera import CameraBusy, UPLOAD_MAX_BYTES
+import metrics
 
 class Web:
-    def __init__(self, db, camera, face_auth):
+    def __init__(self, db, camera, face_auth, face_index=None, broadcaster=None, inference=None, timing_header=False,
+                 quality_gate=None, tracker=None):
         self.app = Flask(__name__)
         self.app.secret_key = 'supersecretkey'  # Для flash-сообщений
+        self.app.config['MAX_CONTENT_LENGTH'] = UPLOAD_MAX_BYTES  # Больший запрос получает 413 до чтения тела
         self.db = db
         self.camera = camera
         self.face_auth = face_auth
+        self.face_index = face_index
+        self.broadcaster = broadcaster
+        self.inference = inference
+        self.timing_header = timing_header  # Добавлять ли заголовок Server-Timing с разбивкой по стадиям
+        self.quality_gate = quality_gate  # FrameQualityGate: отсев плохих кадров до вызова DeepFace
+        self.tracker = tracker  # FaceTracker: отслеживание лица между кадрами живого потока
+        self.setup_hooks()
         self.setup_routes()
 
     def log(self, message):
@@ -22,7 +36,61 @@ class Web:
             flash(message)
         return render_template(template), status_code
 
+    def detect_and_embed(self, image):
+        """
+        Детекция и эмбеддинг через сервис инференса, если он настроен, иначе напрямую через FaceAuth.
+        Бросает ServiceOverloaded, если очередь инференса заполнена.
+        """
+        if self.inference is not None:
+            with metrics.timed('inference'):
+                return self.inference.detect_and_embed(image)
+        return self.face_auth.detect_and_embed(image)
+
+    def check_quality(self, frame):
+        """
+        Проверяет качество кадра с камеры до запуска моделей.
+        Возвращает:
+            dict: Результат FrameQualityGate.check, если кадр отклонён, иначе None.
+        """
+        if self.quality_gate is None:
+            return None
+        quality = self.quality_gate.check(frame, use_motion=False)
+        if quality["ok"]:
+            return None
+        self.log(f"Кадр отклонён фильтром качества: {quality['reasons']} "
+                 f"(резкость {quality['sharpness']:.1f}, яркость {quality['brightness']:.1f})")
+        return quality
+
+    def setup_hooks(self):
+        """Замер времени каждого запроса и разбивка по стадиям."""
+        @self.app.before_request
+        def start_timer():
+            g.request_start = time.perf_counter()
+            metrics.start_request()
+
+        @self.app.after_request
+        def record_request(response):
+            elapsed = time.perf_counter() - g.get('request_start', time.perf_counter())
+            timings = metrics.finish_request()
+            route = request.url_rule.rule if request.url_rule else 'unmatched'
+            metrics.REQUEST_SECONDS.observe(elapsed, route=route, method=request.method, status=response.status_code)
+            if self.timing_header or request.headers.get('X-Timing'):
+                response.headers['Server-Timing'] = metrics.server_timing_header(timings + [('total', elapsed)])
+            return response
+
     def setup_routes(self):
+        @self.app.errorhandler(ServiceOverloaded)
+        def overloaded(e):
+            """Быстрый отказ при переполненной очереди инференса."""
+            self.log(f"Запрос отклонён: {e}")
+            return "Сервис перегружен. Повторите попытку позже.", 503, {"Retry-After": "1"}
+
+        @self.app.errorhandler(CameraBusy)
+        def camera_busy(e):
+            """Камерой владеет другой процесс сервера."""
+            self.log(f"Запрос к камере отклонён: {e}")
+            return "Камера занята другим процессом сервера. Повторите попытку позже.", 503, {"Retry-After": "5"}
+
         @self.app.route('/')
         def index():
             """Главная страница с кнопками."""
@@ -54,32 +122,42 @@ class Web:
 
                 
 
-                if self.db.get_user_data(username):
+                if self.db.get_user_data(username, include_photo=False):
                     self.log(f"Ошибка регистрации: {username} уже существует.")
                     return self.render_with_message('register.html', "Ошибка регистрации. Имя пользователя уже занято.", 400)
 
                 try:
-                    frame = self.camera.get_frame(RGB2=True)
+                    # Модели получают кадр в BGR, как загруженные фото и фото при массовой регистрации
+                    frame = self.camera.get_frame()
                     if frame is None:
                         self.log("Не удалось получить кадр с камеры.")
                         return self.render_with_message('register.html', "Не удалось получить кадр с камеры.", 400)
 
-                    if not self.face_auth.detect_face(frame):
+                    quality = self.check_quality(frame)
+                    if quality is not None:
+                        return self.render_with_message('register.html', self.quality_gate.describe(quality["reasons"]), 400)
+
+                    face = self.detect_and_embed(frame)
+                    if face is None:
                         self.log("Лицо на фотографии не обнаружено.")
                         return self.render_with_message('register.html', "Лицо на фотографии не обнаружено. Убедитесь, что ваше лицо видно.", 400)
 
-                    embedding = self.face_auth.get_embedding(frame)
-                    if embedding is None:
-                        self.log("Не удалось извлечь эмбеддинг из кадра.")
-                        return self.render_with_message('register.html', "Не удалось извлечь эмбеддинг из кадра. Попробуйте снова.", 400)
-
-                    if self.db.add_user(username, embedding=embedding, photo=frame):
+                    photo = cv2.cvtColor(frame, cv2.COLOR_BGR2RGB)  # Фото в базе хранится в RGB
+                    if self.db.add_user(username, embedding=face["embedding"], photo=photo, model_name=self.face_auth.model_name):
                         self.log(f"Успешная регистрация: {username}")
                         return redirect(url_for('index'))
                     else:
                         self.log(f"Ошибка регистрации: {username} уже существует.")
                         return self.render_with_message('register.html', "Ошибка регистрации. Имя пользователя уже занято.", 400)
 
+                except ServiceOverloaded as e:
+                    self.log(f"Ошибка регистрации: {e}")
+                    return self.render_with_message('register.html', "Сервис перегружен. Повторите попытку позже.", 503)
+
+                except CameraBusy as e:
+                    self.log(f"Ошибка регистрации: {e}")
+                    return self.render_with_message('register.html', "Камера занята. Повторите попытку позже.", 503)
+
                 except ValueError as e:
                     self.log(f"Ошибка регистрации: {e}")
                     return self.render_with_message('register.html', str(e), 400)
@@ -101,24 +179,42 @@ class Web:
         @self.app.route('/video_stream')
         def video_stream():
             """Генерация видеопотока с камеры."""
+            if not self.camera.is_running:
+                # Владелец открывает камеру, остальные процессы читают общий буфер кадров;
+                # без буфера CameraBusy возвращается до начала ответа
+                self.camera.start()
+            if not self.camera.is_running:
+                # start() отказывает без исключения, если камеру запускали и останавливали слишком часто
+                self.log("Камера не запущена: видеопоток не начат.")
+                return "Камера не запущена. Повторите попытку позже.", 503, {"Retry-After": "1"}
             self.log("Генерация видеопотока началась.")
-            return Response(self.camera.generate_video_stream(), mimetype='multipart/x-mixed-replace; boundary=frame')
+            stream = self.broadcaster.stream() if self.broadcaster else self.camera.generate_video_stream()
+            return Response(stream, mimetype='multipart/x-mixed-replace; boundary=frame')
 
         @self.app.route('/authenticate_face', methods=['POST'])
         def authenticate_face():
             """Авторизация с помощью распознавания лица."""
-            image_path = request.files['face_image'].filename
-            self.log(f"Получено изображение для авторизации: {image_path}")
+            upload = request.files.get('face_image')
+            if upload is None:
+                return self.render_with_message('face_scan.html', "Изображение не передано.", 400)
+            self.log(f"Получено изображение для авторизации: {upload.filename}")
+
+            try:
+                image = self.camera.upload_to_numpy(upload.stream)
+            except ValueError as e:
+                self.log(f"Не удалось декодировать изображение {upload.filename}: {e}")
+                return self.render_with_message('face_scan.html', str(e), 400)
 
-            embedding = self.face_auth.get_embedding(image_path)
+            face = self.detect_and_embed(image)
 
-            if embedding is None:
-                self.log(f"Не удалось обработать изображение: {image_path}")
+            if face is None:
+                self.log(f"Не удалось обработать изображение: {upload.filename}")
                 return self.render_with_message('face_scan.html', "Ошибка обработки изображения.", 400)
+            embedding = face["embedding"]
 
             user_embedding = self.db.get_user_embedding(request.form['username'])
 
-            if not user_embedding:
+            if user_embedding is None:
                 self.log(f"Эмбеддинг пользователя не найден: {request.form['username']}")
                 return self.render_with_message('face_scan.html', "Эмбеддинг пользователя не найден.", 404)
 
@@ -129,7 +225,64 @@ class Web:
                 self.log(f"Аутентификация лица неудачна для пользователя: {request.form['username']}")
                 return self.render_with_message('face_scan.html', "Аутентификация лица не удалась.", 401)
 
+        @self.app.route('/identify')
+        def identify():
+            """Определение пользователя по текущему кадру камеры (поиск 1:N)."""
+            if self.face_index is None:
+                return jsonify({"error": "Индекс лиц не инициализирован."}), 503
+            k = request.args.get('k', default=1, type=int)
+            try:
+                frame = self.camera.get_frame()  # BGR, как на всех путях детекции
+            except RuntimeError as e:
+                self.log(f"Не удалось получить кадр для идентификации: {e}")
+                return jsonify({"error": "Не удалось получить кадр с камеры."}), 503
+
+            tracked = False
+            if self.tracker is not None:
+                face = self.tracker.process(frame)
+                if face is not None and "rejected" in face:
+                    return jsonify({"error": self.tracker.quality_gate.describe(face["rejected"]),
+                                    "quality": face["quality"]}), 422
+                tracked = bool(face and face["tracked"])
+            else:
+                quality = self.check_quality(frame)
+                if quality is not None:
+                    return jsonify({"error": self.quality_gate.describe(quality["reasons"]), "quality": quality}), 422
+                face = self.detect_and_embed(frame)
+            if face is None:
+                return jsonify({"error": "Лицо на кадре не обнаружено."}), 400
+
+            # Порог euclidean_l2 для режима квантования индекса: ближайший сосед дальше порога — чужой
+            threshold = self.face_auth.identification_threshold(self.face_index.quantization_mode)
+            matches = [(name, distance) for name, distance in self.face_index.search(face["embedding"], k=k)
+                       if distance <= threshold]
+            self.log(f"Идентификация: {matches[:1]} (порог {threshold:.4f})")
+            return jsonify({"matches": [{"username": name, "distance": distance} for name, distance in matches],
+                            "threshold": threshold, "tracked": tracked})
+
+        @self.app.route('/metrics')
+        def metrics_endpoint():
+            """Метрики в текстовом формате Prometheus."""
+            if self.inference is not None:
+                metrics.QUEUE_DEPTH.set(self.inference.stats()["queue_depth"])
+            return Response(metrics.METRICS.render(), mimetype='text/plain; version=0.0.4')
+
+        @self.app.route('/inference_stats')
+        def inference_stats():
+            """Статистика очереди и пакетов инференса для подбора размера пула."""
+            if self.inference is None:
+                return jsonify({"error": "Сервис инференса не настроен."}), 404
+            return jsonify(self.inference.stats())
+
+    def prepare(self):
+        """Подготовка процесса к приёму запросов: прогрев моделей и запуск воркеров инференса."""
+        self.face_auth.ensure_ready()
+        if self.inference is not None:
+            self.inference.start()
+
     def run(self):
-        """Запуск Flask-приложения."""
+        """Запуск Flask-приложения (сервер разработки). Запросы принимаются только после прогрева моделей."""
+        self.prepare()
         self.log("Запуск Flask-сервера...")
-        self.app.run(host='0.0.0.0', port=5000, debug=True)
+        # Перезагрузчик запустил бы main() повторно в дочернем процессе и заново загрузил бы модели
+        self.app.run(host='0.0.0.0', port=5000, debug=True, use_reloader=False)
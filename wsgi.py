@@ -0,0 +1,52 @@
+"""
+Точка входа WSGI для production-запуска под gunicorn:
+
+    gunicorn -c gunicorn.conf.py
+
+С preload_app база и галерея эмбеддингов загружаются в мастер-процессе до fork, и воркеры
+разделяют эти страницы памяти (copy-on-write). TensorFlow в мастере не импортируется: после fork
+каждый воркер открывает свои соединения с базой, загружает и прогревает модели и запускает
+потоки инференса (см. post_fork).
+
+Камерой владеет один процесс — тот, что первым захватил CAMERA_LOCK_PATH. Он публикует кадры
+в общий буфер CAMERA_LOCK_PATH + '.frames', из которого остальные воркеры отдают видеопоток,
+регистрацию и идентификацию; если владелец завершился, камеру забирает следующий воркер.
+
+Индекс лиц в памяти у каждого воркера свой, но перед поиском он сверяется с версией общего
+хранилища эмбеддингов, а приближённый индекс (IVF) все воркеры читают и пишут на диске,
+поэтому регистрация в одном воркере сразу видна поиску в остальных.
+"""
+import os
+from main import build_web
+from metrics import StartupProfile
+
+CAMERA_LOCK_PATH = os.environ.get('FACE_CAMERA_LOCK', 'camera.lock')
+# Загружать ли веса моделей до fork (FACE_PRELOAD_MODELS=1). Экономит память воркеров, но TensorFlow,
+# инициализированный в мастере, может зависнуть при первом инференсе после fork, и с TF 2.18 под gunicorn
+# это не проверено. Поэтому по умолчанию модели загружаются в каждом воркере.
+PRELOAD_MODELS = os.environ.get('FACE_PRELOAD_MODELS', '0') == '1'
+
+web = None  # Web, созданный create_app (нужен хуку post_fork)
+
+
+def create_app():
+    """
+    Фабрика приложения для gunicorn ('wsgi:create_app()').
+
+    Возвращает:
+        Flask: WSGI-приложение.
+    """
+    global web
+    profile = StartupProfile()
+    web = build_web(camera_lock_path=CAMERA_LOCK_PATH, load_models=PRELOAD_MODELS, warm_up=False, profile=profile)
+    print(f"[ЛОГ WSGI] Профиль запуска:\n{profile.report()}")
+    if web is None:
+        raise RuntimeError("Не удалось создать приложение, подробности в логе выше.")
+    return web.app
+
+
+def post_fork():
+    """Подготовка воркера после fork."""
+    # Соединения пула, открытые в мастере, нельзя использовать из нескольких процессов
+    web.db.engine.dispose(close=False)
+    web.prepare()